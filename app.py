@@ -1,85 +1,186 @@
-from flask import Flask, render_template, request, jsonify
-import pandas as pd
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
+import numpy as np
 import os
+import random
+import re
+import time
+import threading
+import hmac
+import hashlib
+import json
+import queue
+import unicodedata
+from collections import OrderedDict
 from openai import OpenAI
 from dotenv import load_dotenv
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from data_state import DataStore
+from llm_cache import LLMCache, make_key
+from warm_store import WarmStore
+import generation_strategies
+from llm_limiter import BoundedExecutor, Overloaded, RateLimiter
+import llm_transport
+from llm_transport import CircuitOpen, DeadlineExceeded, Transport
+from singleflight import SingleFlight
+from batch_jobs import JobError, JobManager, parse_rows
+import metrics
+import prompts
+import scoring
 
 load_dotenv()
 
 app = Flask(__name__)
 
 # グローバル変数
-df = None
 client = None
 
-# 初期化関数
-def initialize():
-    global df, client
-    if df is None:
-        excel_path = os.path.join(os.path.dirname(__file__), '米国での業務内容.xlsx')
-        df = pd.read_excel(excel_path, sheet_name='米国での業務内容')
-    if client is None:
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            print(f"ERROR: OPENAI_API_KEY not found. Environment variables: {list(os.environ.keys())}")
-            raise ValueError("OPENAI_API_KEY environment variable is not set")
-        print(f"INFO: OPENAI_API_KEY found (length: {len(api_key)})")
-        client = OpenAI(api_key=api_key)
-
-# 管理職とスタッフの判定辞書
-management_positions = [
-    "部長", "マネージャー", "CFO", "社長", "取締役", "役員", "統括",
-    "部門長", "課長", "GM", "ゼネラルマネージャー", "ディレクター",
-    "VP", "本部長", "事業部長", "支店長", "所長", "manager", "director",
-    "chief", "head", "president", "vice president", "executive"
-]
-
-staff_positions = [
-    "スタッフ", "社員", "担当", "メンバー", "アシスタント", "アソシエイト",
-    "スペシャリスト", "コーディネーター", "staff", "associate", "specialist",
-    "coordinator", "assistant", "member", "employee"
-]
-
-# 業界・部門の同義語辞書
-industry_synonyms = {
-    # 業界 - データベースにある値をそのまま使う
-    "製薬": "医薬品",
-    "薬": "医薬品",
-    "医療": "医薬品",
-    "ファーマ": "医薬品",
-    "おもちゃ": "玩具",
-    # IT、自動車などはそのまま
+# インデックスを作成するカテゴリ列
+INDEXED_COLUMNS = ["業界", "部門", "ポジション"]
+
+# サンプルデータ・インデックス・同義語辞書（data_state.py 参照）
+# 元ファイルが更新されたら再読み込みし、新しい世代ができてから差し替える
+data_store = DataStore.from_env(INDEXED_COLUMNS)
+
+# 参考サンプルの検索方法（リクエストの retrieval で切り替え可能）
+#   keyword:  業界・部門の部分一致（一致しなければランダム）
+#   semantic: 職務内容の類似検索（semantic_index.py で作成したインデックスを使う）
+RETRIEVAL_MODES = ("keyword", "semantic")
+SAMPLE_RETRIEVAL = os.getenv('SAMPLE_RETRIEVAL', 'keyword')
+
+# 生成に使うモデルとプロンプトのバージョン
+# プロンプト（prompts.py）を変更したらPROMPT_VERSIONを上げること（古いキャッシュが使われなくなる）
+OPENAI_MODEL = "gpt-4-turbo"
+PROMPT_VERSION = "5"
+
+# 50文字未満の項目が出たときの補充方法（generation_strategies.py 参照）と制限時間
+GENERATION_STRATEGY = os.getenv('GENERATION_STRATEGY', 'overrequest')
+GENERATION_BUDGET_SEC = float(os.getenv('GENERATION_BUDGET_SEC', 60))
+GENERATION_OPTIONS = {
+    'overrequest_factor': float(os.getenv('GENERATION_OVERREQUEST_FACTOR', 1.4)),
+    'hedge_delay': float(os.getenv('GENERATION_HEDGE_DELAY_SEC', 6)),
+    'max_parallel': int(os.getenv('GENERATION_MAX_PARALLEL', 2)),
 }
 
-department_synonyms = {
-    # 部門 - データベースにある値をそのまま使うか、よく使われる別名のみ
-    "戦略": "経営企画",
-    "企画": "経営企画",
-    "経営管理": "経営企画",
-    "経営": "経営企画",
-    "販売": "営業",
-    "セールス": "営業",
-    "マーケ": "マーケティング",
-    "人材": "人事",
-    "HR": "人事",
-    "経理": "財務",
-    "会計": "財務",
-    "開発": "製品開発(R&D)",
-    "研究": "製品開発(R&D)",
-    "R&D": "製品開発(R&D)",
-    "研究開発": "製品開発(R&D)",
-    "IT": "システム",
-    "情報システム": "システム",
-    "法務": "法務・知財",
-    "知財": "法務・知財",
-    "品質": "品質管理",
-    "QA": "品質管理",
-    "購買": "調達",
-    "資材": "調達",
-    "生産": "製造",
-    "工場": "製造",
-}
+# 参考サンプル（データの職務内容）をほぼそのまま写した生成項目の扱い（dedupe.py のインデックスを使う）
+#   drop: 採用しない / flag: 採用するがログと計測に残す / off: 判定しない
+# 生成済みの項目どうしの近似重複は常に除外する
+REFERENCE_COPY_ACTIONS = ("drop", "flag", "off")
+REFERENCE_COPY_ACTION = os.getenv('REFERENCE_COPY_ACTION', 'drop')
+
+# 生成結果のキャッシュ（プロセス内LRU + SQLite）
+llm_cache = LLMCache.from_env()
+
+# よく使われる条件の事前生成結果（python warm_store.py で作成、読み取り専用）
+warm_store = WarmStore.from_env()
+
+# 同じ条件の生成が実行中なら相乗りする（キャッシュと同じSQLiteでワーカー間も調整）
+# 他のワーカーから受け取った結果も complete を持つようにする（関数は後で定義）
+inflight = SingleFlight(path=llm_cache.path, error_types=(Overloaded, CircuitOpen, DeadlineExceeded, TimeoutError),
+                        transient_errors=(Overloaded, CircuitOpen, TimeoutError),
+                        encode=lambda value: encode_generation(value), decode=lambda value: decode_generation(value))
+
+# OpenAI呼び出しの流量制限と、パターン生成用の共有スレッドプール（llm_limiter.py 参照）
+llm_limiter = RateLimiter.from_env()
+llm_executor = BoundedExecutor.from_env()
+
+# OpenAI呼び出しの接続プール・期限・ヘッジ・サーキットブレーカー（llm_transport.py 参照）
+llm = Transport.from_env()
+# 1リクエストでOpenAI呼び出しに使える時間（秒）。各呼び出しのタイムアウトは残り時間まで
+LLM_REQUEST_BUDGET_SEC = float(os.getenv('LLM_REQUEST_BUDGET_SEC', 120))
+# OpenAIの障害時（サーキットブレーカーが開いているときなど）の /api/search・/api/generate の応答
+#   database: データベースの検索結果を返す（source: "database"） / none: エラーを返す（ブレーカーが開いていれば503）
+LLM_BREAKER_FALLBACK = os.getenv('LLM_BREAKER_FALLBACK', 'database')
+
+# 段階ごとのタイムアウト（秒）
+COMPARE_TIMEOUT_SEC = float(os.getenv('COMPARE_TIMEOUT_SEC', 120))
+EVALUATION_TIMEOUT_SEC = float(os.getenv('EVALUATION_TIMEOUT_SEC', 30))
+
+# 比較結果（パターンA/B）の評価方法（リクエストの judge で切り替え可能、scoring.py 参照）
+#   llm:   AIで評価する（ローカルの自動評価も local_scores として付ける）
+#   local: ローカルの自動評価のみ（OpenAIを呼ばない）
+#   gated: ローカルで評価し、点差が JUDGE_GATE_MARGIN 未満のときだけAIで評価する
+#   async: ローカルの評価をすぐ返し、AIの評価は応答の後で行う
+#          （/api/compare は /api/evaluations/<id> で取得、ストリーミングでは続けて送る）
+JUDGE_MODES = ("llm", "local", "gated", "async")
+JUDGE_MODE = os.getenv('JUDGE_MODE', 'gated')
+JUDGE_GATE_MARGIN = float(os.getenv('JUDGE_GATE_MARGIN', 1.5))
+
+# 計測（/metrics で出力。段階ごとの所要時間は metrics.STAGE_SECONDS）
+HTTP_SECONDS = metrics.histogram(
+    'http_request_duration_seconds', 'HTTPリクエストの処理時間（秒）', labels=('endpoint', 'method', 'status'))
+LLM_CALLS = metrics.counter(
+    'llm_calls_total', 'OpenAI呼び出し回数（outcome: ok / closed / deadline / circuit_open / error）', labels=('kind', 'outcome'))
+LLM_TOKENS = metrics.counter(
+    'llm_tokens_total',
+    'OpenAIの使用トークン数（type: prompt / cached_prompt プロンプトキャッシュに当たった分 / completion。途中で打ち切った生成は受信分からの概算）',
+    labels=('kind', 'type'))
+PROMPT_REFERENCES = metrics.counter(
+    'prompt_reference_samples_total',
+    'プロンプトに入れる参考サンプル（used: 使用 / duplicate: 近似重複で除外 / truncated: 切り詰め / over_budget: トークン数の上限で除外）',
+    labels=('result',))
+GENERATION_ITEMS = metrics.counter(
+    'generation_items_total', '生成された項目数（accepted: 採用, short: 文字数不足, fallback: 不足分を文字数不足の項目で補った）',
+    labels=('result',))
+GENERATION_CALLS = metrics.histogram(
+    'generation_llm_calls', '1回の生成に使ったOpenAI呼び出し回数（2回目以降は補充）', buckets=(1, 2, 3, 4, 5))
+GENERATION_RETRIES = metrics.counter('generation_retries_total', '補充のためのOpenAI呼び出し回数')
+GENERATION_INCOMPLETE = metrics.counter(
+    'generation_incomplete_total', '制限時間で打ち切った・目標件数に届かなかった生成の回数（キャッシュ・事前生成ストアに残さない）')
+DUPLICATE_ITEMS = metrics.counter(
+    'generation_duplicate_items_total',
+    '近似重複として検出した生成項目（reason: duplicate 生成済みの項目と重複 / reference_copy 参考サンプルの写し、action: drop / flag）',
+    labels=('reason', 'action'))
+EVALUATIONS = metrics.counter(
+    'evaluations_total', '比較結果の評価回数（judge: 結果を決めた評価方法 local / llm）', labels=('mode', 'judge'))
+JUDGE_AGREEMENT = metrics.counter(
+    'judge_agreement_total', 'AIで評価したとき、ローカルの評価と勝者が一致したか', labels=('result',))
+metrics.stats_gauges('llm_cache', '生成結果キャッシュ', llm_cache.stats)
+metrics.stats_gauges('warm_store', '事前生成ストア', warm_store.stats)
+metrics.stats_gauges('singleflight', '実行中の生成への相乗り', inflight.stats)
+metrics.stats_gauges('llm_limiter', 'OpenAI呼び出しの流量制限', llm_limiter.stats)
+metrics.stats_gauges('llm_transport', 'OpenAI呼び出しのヘッジ・サーキットブレーカー（breaker_state: 0 closed / 1 open / 2 half_open）', llm.stats)
+metrics.gauge('llm_executor_rejected', '共有スレッドプールが満杯で断ったリクエスト数', lambda: llm_executor.rejected)
+metrics.stats_gauges('data', 'サンプルデータの再読み込み（generation: 現在の世代）', data_store.stats)
+
+# 初期化（同時に来た最初のリクエストで二重に読み込まないようロックする）
+_init_lock = threading.Lock()
+_initialized = False
+
+def load_data():
+    """データとインデックスを読み込む（スレッド・接続を作らないので、gunicornのfork前に呼べる）"""
+    data_store.load()
+    if warm_store.expected is None:
+        warm_store.open(warm_store_version())
+
+def current_data():
+    """このリクエストで使うデータの世代（リクエストの途中で再読み込みされても変わらない）"""
+    return data_store.get()
+
+def create_client():
+    """OpenAIクライアントを作成（APIキーがなければ ValueError）"""
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        print(f"ERROR: OPENAI_API_KEY not found. Environment variables: {list(os.environ.keys())}")
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+    print(f"INFO: OPENAI_API_KEY found (length: {len(api_key)})")
+    return OpenAI(api_key=api_key, **llm.client_options())
+
+# 初期化関数
+def initialize():
+    """データの読み込みに加え、OpenAIクライアントと一括生成ジョブのワーカーを用意する（ワーカープロセスごと）"""
+    global client, _initialized
+    if _initialized:
+        return
+    load_data()
+    with _init_lock:
+        if _initialized:
+            return
+        if client is None:
+            client = create_client()
+        # 一括生成ジョブのワーカーを起動（未完了のジョブがあれば再開）
+        batch_jobs.start()
+        # 元ファイルの監視（スレッドなので fork 後のワーカーごとに起動する）
+        data_store.start_watcher()
+        _initialized = True
 
 def infer_position_category(position):
     """ポジションから管理職かスタッフかを推測（意味ベース）"""
@@ -90,15 +191,18 @@ def infer_position_category(position):
     extracted = extract_keywords(position)
     position_lower = extracted.lower() if extracted else position.lower()
 
+    # 管理職・スタッフの判定語は data/synonyms.json で管理する
+    synonyms = current_data().synonyms
+
     # 管理職の判定（キーワードが管理職リストに含まれているか、または部分一致）
-    for keyword in management_positions:
+    for keyword in synonyms.management_positions:
         keyword_lower = keyword.lower()
         # 双方向チェック: キーワードが入力に含まれる、または入力がキーワードに含まれる
         if keyword_lower in position_lower or position_lower in keyword_lower:
             return "管理職"
 
     # スタッフの判定
-    for keyword in staff_positions:
+    for keyword in synonyms.staff_positions:
         keyword_lower = keyword.lower()
         if keyword_lower in position_lower or position_lower in keyword_lower:
             return "スタッフ"
@@ -121,13 +225,20 @@ def extract_keywords(text):
 
     return keywords.strip()
 
+def normalize_position(value):
+    """ポジションの表記ゆれを正規化（全角・半角、大文字・小文字、空白の違いを無視する。キャッシュキー用）"""
+    if not value:
+        return ""
+    text = unicodedata.normalize('NFKC', extract_keywords(value)).lower()
+    return " ".join(text.split())
+
 def normalize_industry(value):
     """業界の類義語を正規化＋キーワード抽出"""
     if not value:
         return ""
 
-    # まず同義語辞書をチェック
-    normalized = industry_synonyms.get(value.strip(), None)
+    # まず同義語辞書（data/synonyms.json）をチェック
+    normalized = current_data().synonyms.industry.get(value.strip(), None)
     if normalized:
         return normalized
 
@@ -139,14 +250,73 @@ def normalize_department(value):
     if not value:
         return ""
 
-    # まず同義語辞書をチェック
-    normalized = department_synonyms.get(value.strip(), None)
+    # まず同義語辞書（data/synonyms.json）をチェック
+    normalized = current_data().synonyms.department.get(value.strip(), None)
     if normalized:
         return normalized
 
     # 同義語になければキーワード抽出
     return extract_keywords(value)
 
+def error_response(e):
+    """例外をJSONのエラーレスポンスに変換（混雑は503、タイムアウトは504）"""
+    status = 500
+    headers = {}
+    if isinstance(e, Overloaded):
+        status = 503
+        headers['Retry-After'] = str(getattr(e, 'retry_after', 5))
+    elif isinstance(e, TimeoutError):
+        status = 504
+    return jsonify({
+        'success': False,
+        'error': str(e) or type(e).__name__
+    }), status, headers
+
+@app.before_request
+def start_request_metrics():
+    # リクエストIDは呼び出し元から渡されたもの（X-Request-ID）を優先する
+    metrics.start_request(request.headers.get('X-Request-ID'))
+    # このリクエストでOpenAI呼び出しに使える時間（共有スレッドプールにも引き継がれる）
+    llm_transport.set_deadline(LLM_REQUEST_BUDGET_SEC)
+    # このリクエストで使うデータの世代を固定する（ストリーミングは送信し終わるまで）
+    g.data_token = data_store.pin()
+
+@app.teardown_request
+def release_data_state(exc):
+    token = g.pop('data_token', None)
+    if token is not None:
+        data_store.unpin(token)
+
+@app.after_request
+def finish_request_metrics(response):
+    context = metrics.current_request()
+    if context is None:
+        return response
+    response.headers['X-Request-ID'] = context.id
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    method = request.method
+    path = request.path
+
+    def finish():
+        # ストリーミング応答は送信し終わった時点で記録する
+        elapsed = context.elapsed()
+        HTTP_SECONDS.observe(elapsed, endpoint=endpoint, method=method, status=str(response.status_code))
+        if endpoint != '/metrics':
+            metrics.log('request', method=method, path=path, status=response.status_code,
+                        duration_ms=round(elapsed * 1000, 1), stages_ms=context.stage_millis())
+
+    response.call_on_close(finish)
+    return response
+
+def invalid_choice(name, value, choices):
+    return jsonify({
+        'success': False,
+        'error': f"{name} は {' / '.join(choices)} のいずれかを指定してください: {value}"
+    }), 400
+
+def invalid_retrieval(retrieval):
+    return invalid_choice('retrieval', retrieval, RETRIEVAL_MODES)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -160,22 +330,22 @@ def search():
     position = data.get('position', '')
     industry = data.get('industry', '')
     department = data.get('department', '')
+    area = data.get('area', '')
+    bypass_cache = bool(data.get('no_cache', False))
+    retrieval = data.get('retrieval') or SAMPLE_RETRIEVAL
+    if retrieval not in RETRIEVAL_MODES:
+        return invalid_retrieval(retrieval)
 
     try:
-        # 参考サンプルを取得（教師信号として使用）
-        reference_samples = get_reference_samples(industry, department)
-        # AI生成を実行
-        generated_results = generate_job_descriptions(position, industry, department, reference_samples)
+        # 参考サンプルを参照してAI生成を実行（同じ条件はキャッシュから返す）
+        source, generated_results = generate_or_fallback(position, industry, department, area, bypass_cache, retrieval)
         return jsonify({
             'success': True,
-            'source': 'ai',
+            'source': source,
             'results': generated_results
         })
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(e)
 
 @app.route('/api/generate', methods=['POST'])
 def generate():
@@ -186,61 +356,219 @@ def generate():
     position = data.get('position', '')
     industry = data.get('industry', '')
     department = data.get('department', '')
+    area = data.get('area', '')
+    bypass_cache = bool(data.get('no_cache', False))
+    retrieval = data.get('retrieval') or SAMPLE_RETRIEVAL
+    if retrieval not in RETRIEVAL_MODES:
+        return invalid_retrieval(retrieval)
 
     try:
-        # 参考サンプルを取得（業界または部門のいずれかでマッチ）
-        reference_samples = get_reference_samples(industry, department)
-        generated_results = generate_job_descriptions(position, industry, department, reference_samples)
+        # 参考サンプルを参照してAI生成を実行（同じ条件はキャッシュから返す）
+        source, generated_results = generate_or_fallback(position, industry, department, area, bypass_cache, retrieval)
         return jsonify({
             'success': True,
-            'source': 'ai',
+            'source': source,
             'results': generated_results
         })
     except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return error_response(e)
+
+def generation_cache_key(kind, position, industry, department, area, **extra):
+    """生成結果のキャッシュキー（表記ゆれを正規化した入力・モデル・プロンプトのバージョン）
+
+    プロンプトにはポジションをそのまま入れるので、キーにも正規化したポジションを入れる
+    （区分だけにすると「CFO」と「営業部長」が同じ結果になる）。区分は参考サンプルの検索に使う。
+    """
+    return make_key(
+        kind,
+        position=normalize_position(position),
+        position_category=infer_position_category(position),
+        industry=normalize_industry(industry),
+        department=normalize_department(department),
+        area=(area or "").strip(),
+        model=OPENAI_MODEL,
+        prompt_version=PROMPT_VERSION,
+        **extra
+    )
+
+class GeneratedItems(list):
+    """生成した項目のリスト（complete=False なら制限時間で打ち切ったか目標件数に届かなかった）"""
+
+    def __init__(self, items=(), complete=True):
+        super().__init__(items)
+        self.complete = complete
+
+def is_complete(value):
+    """生成結果（項目のリスト、または比較パターンの辞書）が揃っているか。揃っていなければキャッシュしない"""
+    if isinstance(value, dict):
+        value = value.get('generated')
+    return getattr(value, 'complete', True)
+
+def encode_generation(value):
+    """他のワーカーに渡す形にする（GeneratedItems の complete をJSONに残す）"""
+    if isinstance(value, GeneratedItems):
+        return {'generated_items': list(value), 'complete': value.complete}
+    if isinstance(value, dict) and isinstance(value.get('generated'), GeneratedItems):
+        return {**value, 'generated': encode_generation(value['generated'])}
+    return value
+
+def decode_generation(value):
+    """encode_generation() の逆（他のワーカーの結果も is_complete() で判定できるようにする）"""
+    if isinstance(value, dict) and 'generated_items' in value:
+        return GeneratedItems(value['generated_items'], complete=value['complete'])
+    if isinstance(value, dict) and isinstance(value.get('generated'), dict):
+        return {**value, 'generated': decode_generation(value['generated'])}
+    return value
+
+def cached_compute(key, compute, bypass_cache=False):
+    """キャッシュ → 実行中の同じ計算への相乗り → 計算 の順で結果を得る
+
+    bypass_cache=True（no_cache）は新しく生成し直すため、実行中の計算にも相乗りしない。
+    """
+    if bypass_cache:
+        return llm_cache.get_or_compute(key, compute, bypass=True, cacheable=is_complete)
+    return llm_cache.get_or_compute(key, lambda: inflight.do(key, compute), cacheable=is_complete)
+
+def cached_generation(key, compute, bypass_cache=False):
+    """事前生成ストアにあればそのまま返し、なければ cached_compute() で生成する"""
+    if not bypass_cache:
+        value = warm_store.get(key)
+        if value is not None:
+            return value
+    return cached_compute(key, compute, bypass_cache)
+
+def generation_task(kind, position, industry, department, area, retrieval=None, on_item=None):
+    """生成1回分の (キャッシュキー, 計算する関数)（kind: reference / similar / random）
+
+    リクエストと事前生成（warm_store.py）で同じキー・同じ生成を使う。
+    """
+    retrieval = resolve_retrieval(retrieval)
+    key = generation_cache_key(kind, position, industry, department, area, retrieval=retrieval)
+
+    if kind == 'reference':
+        def compute():
+            reference_samples = get_reference_samples(industry, department, retrieval, area)
+            return generate_job_descriptions(position, industry, department, area, reference_samples)
+        return key, compute
+
+    label, get_samples = COMPARE_PATTERNS[kind]
+
+    def compute():
+        samples = get_samples(industry, department, area, retrieval)
+        # generate_job_descriptions内でフィルタ+フォールバック済み
+        results = generate_job_descriptions(position, industry, department, area, samples, 10, on_item=on_item)
+        print(f"[COMPARE] {kind}: {len(results)}件", flush=True)
+        return {
+            'label': label,
+            # 実際にプロンプトに入れたもの（近似重複の除外・切り詰め・トークン数の上限の後）
+            'samples_used': list(prompts.select_references(tuple(samples), 10)[0]),
+            'generated': results
+        }
+    return key, compute
 
-def get_reference_samples(industry, department):
+def generate_with_references(position, industry, department, area, bypass_cache=False, retrieval=None):
+    """参考サンプル付きでAI生成（キャッシュ経由）"""
+    key, compute = generation_task('reference', position, industry, department, area, retrieval)
+    return cached_generation(key, compute, bypass_cache)
+
+def generate_or_fallback(position, industry, department, area, bypass_cache=False, retrieval=None):
+    """AI生成して ('ai', 結果) を返す
+
+    OpenAIの障害（サーキットブレーカーが開いている・接続エラー・5xx・期限切れ）で生成できなければ、
+    データベースの検索結果で ('database', 結果) を返す（LLM_BREAKER_FALLBACK=none または該当なしなら元の例外）。
+    """
+    try:
+        return 'ai', generate_with_references(position, industry, department, area, bypass_cache, retrieval)
+    except (CircuitOpen,) + llm_transport.FAILURE_ERRORS:
+        if LLM_BREAKER_FALLBACK != 'database':
+            raise
+        results = search_database(position, industry, department)
+        if not results:
+            raise
+        print(f"[TRANSPORT] OpenAIの障害のためデータベースの検索結果を返します（{len(results)}件）", flush=True)
+        return 'database', results
+
+def resolve_retrieval(retrieval):
+    """実際に使う検索方法（類似検索インデックスがなければ keyword）"""
+    retrieval = retrieval or SAMPLE_RETRIEVAL
+    if retrieval == "semantic" and current_data().semantic_index is None:
+        return "keyword"
+    return retrieval
+
+def select_rows(rows):
+    """インデックスが返した行の真偽値配列から、該当する行位置を元の並び順で返す"""
+    return np.flatnonzero(rows)
+
+def take_texts(rows):
+    """行位置の職務内容をリストで返す（必要な行だけPythonの文字列にする）"""
+    job_texts = current_data().job_texts
+    return [job_texts[int(row)].as_py() for row in rows]
+
+def sample_rows(rows, count):
+    """行位置からランダムに count 件選ぶ（足りなければすべて）"""
+    if len(rows) <= count:
+        return rows
+    return [rows[i] for i in random.sample(range(len(rows)), count)]
+
+def get_reference_samples(industry, department, retrieval=None, area=""):
     """参考サンプルを取得（従来の関数、互換性のため残す）"""
-    return get_similar_samples(industry, department, 5)
+    return get_similar_samples(industry, department, 5, retrieval, area)
 
-def get_similar_samples(industry, department, count=5):
+@metrics.timed('retrieval')
+def get_similar_samples(industry, department, count=5, retrieval=None, area=""):
     """似た業界・部門からサンプルを取得"""
-    global df
+    if resolve_retrieval(retrieval) == "semantic":
+        return get_semantic_samples(industry, department, area, count)
 
     # 業界または部門で部分一致検索
     norm_ind = normalize_industry(industry) if industry else ""
     norm_dep = normalize_department(department) if department else ""
+    search_index = current_data().search_index
 
     if norm_ind and norm_dep:
         # 両方ある場合はOR検索
-        results = df[
-            (df["業界"].str.contains(norm_ind, na=False, case=False)) |
-            (df["部門"].str.contains(norm_dep, na=False, case=False))
-        ]
+        results = select_rows(
+            search_index.match("業界", norm_ind) |
+            search_index.match("部門", norm_dep)
+        )
     elif norm_ind:
-        results = df[df["業界"].str.contains(norm_ind, na=False, case=False)]
+        results = select_rows(search_index.match("業界", norm_ind))
     elif norm_dep:
-        results = df[df["部門"].str.contains(norm_dep, na=False, case=False)]
+        results = select_rows(search_index.match("部門", norm_dep))
     else:
         # どちらもなければランダムサンプル
-        results = df.sample(min(count, len(df)))
-
-    if len(results) < count:
-        return results["職務内容"].tolist()
-    return results["職務内容"].sample(count).tolist()
+        return get_random_samples(count)
+
+    return take_texts(sample_rows(results, count))
+
+def get_semantic_samples(industry, department, area, count=5):
+    """入力（業界・部門・担当領域）と職務内容が似ている順にサンプルを取得"""
+    # 同義語を変換した値も加えて検索する（例: 製薬 → 医薬品）
+    terms = [industry, normalize_industry(industry), department, normalize_department(department), area]
+    query = " ".join(dict.fromkeys(term.strip() for term in terms if term and term.strip()))
+    if not query:
+        return get_random_samples(count)
+
+    # 同じ文面の行は1件にまとめる
+    data = current_data()
+    samples = []
+    for row, score in data.semantic_index.top(query, count * 3):
+        text = data.job_texts[int(row)].as_py()
+        if text and text not in samples:
+            samples.append(text)
+        if len(samples) == count:
+            break
+    print(f"[RETRIEVAL] semantic: {query!r} → {len(samples)}件", flush=True)
+    return samples or get_random_samples(count)
 
 def get_random_samples(count=5):
     """業界・部門に関係なくランダムにサンプルを取得"""
-    global df
-    return df["職務内容"].sample(min(count, len(df))).tolist()
+    rows = len(current_data().job_texts)
+    return take_texts(random.sample(range(rows), min(count, rows)))
 
+@metrics.timed('database')
 def search_database(position, industry, department):
     """データベースから似た業界・部門・ポジションで検索してそのまま出力"""
-    global df
-
     # ポジションの推測
     inferred_category = infer_position_category(position)
     search_position = inferred_category if inferred_category else position
@@ -250,202 +578,436 @@ def search_database(position, industry, department):
     norm_dep = normalize_department(department)
 
     # 検索（AND検索）
-    results = df[
-        (df["ポジション"].str.contains(search_position, na=False, case=False)) &
-        (df["業界"].str.contains(norm_ind, na=False, case=False)) &
-        (df["部門"].str.contains(norm_dep, na=False, case=False))
-    ]
-
-    if not results.empty:
-        return results["職務内容"].head(10).tolist()
-    else:
-        return []
+    search_index = current_data().search_index
+    results = select_rows(
+        search_index.match("ポジション", search_position) &
+        search_index.match("業界", norm_ind) &
+        search_index.match("部門", norm_dep)
+    )
 
-def generate_job_descriptions(position, industry, department, area, reference_samples=None, sample_count=5):
-    """ChatGPTで職務内容を生成（文字数チェック付き）"""
+    return take_texts(results[:10])
+
+def generate_job_descriptions(position, industry, department, area, reference_samples=None, sample_count=5, on_item=None):
+    """ChatGPTで職務内容を生成（文字数チェック付き）。GeneratedItems を返す"""
+    results = GeneratedItems()
+    with metrics.stage('generation'):
+        def on_done(complete):
+            results.complete = complete
+        for item in iter_job_descriptions(position, industry, department, area, reference_samples, sample_count, on_done=on_done):
+            results.append(item)
+            if on_item:
+                on_item(item)
+    return results
+
+def iter_job_descriptions(position, industry, department, area, reference_samples=None, sample_count=5, strategy=None, on_done=None):
+    """職務内容をストリーミング生成し、採用が決まった項目から順に返す
+
+    トークンを受信しながら番号付きリストを1行ずつ取り出し、50文字以上の項目は
+    その場で返す。目標件数に達したらストリームを閉じて残りの生成を打ち切る。
+    不足分の補充方法は strategy（省略時は GENERATION_STRATEGY）で切り替える。
+    on_done: 最後まで返したときに complete（制限時間内に目標件数が揃ったか）で呼ばれる
+    """
 
     MIN_CHARS = 50  # 最低文字数
     TARGET_COUNT = 10  # 目標件数
     MAX_RETRIES = 5  # 最大リトライ回数（増加）
 
-    all_results = []
-    all_generated = []  # フィルタ前の全結果（フォールバック用）
-    retry_count = 0
-
-    while len(all_results) < TARGET_COUNT and retry_count < MAX_RETRIES:
-        needed = TARGET_COUNT - len(all_results)
-        generated = _generate_job_descriptions_raw(position, industry, department, area, reference_samples, sample_count, needed)
-
-        print(f"[DEBUG] リトライ{retry_count+1}: 生成{len(generated)}件", flush=True)
-        # 文字数チェック：50文字以上のもののみ採用
-        for item in generated:
-            char_count = len(item)
-            all_generated.append((char_count, item))  # フォールバック用に保存
-            if char_count >= MIN_CHARS:
-                all_results.append(item)
-                print(f"[DEBUG] 採用: {char_count}文字", flush=True)
-            else:
-                print(f"[DEBUG] 除外: {char_count}文字 - {item[:30]}...", flush=True)
-            if len(all_results) >= TARGET_COUNT:
-                break
-
-        retry_count += 1
-
-    # 50文字以上が不足している場合、長い順にフォールバック
-    if len(all_results) < TARGET_COUNT:
-        all_generated.sort(key=lambda x: x[0], reverse=True)  # 長い順
-        for char_count, item in all_generated:
-            if item not in all_results:
-                all_results.append(item)
-                print(f"[DEBUG] フォールバック採用: {char_count}文字", flush=True)
-                if len(all_results) >= TARGET_COUNT:
-                    break
-
-    print(f"[DEBUG] 最終結果: {len(all_results)}件", flush=True)
-    return all_results[:TARGET_COUNT]
-
-def _generate_job_descriptions_raw(position, industry, department, area, reference_samples=None, sample_count=5, count=10):
-    """ChatGPTで職務内容を生成（内部関数）"""
-
-    # 参考サンプルをプロンプトに含める
-    reference_text = ""
-    if reference_samples and len(reference_samples) > 0:
-        reference_text = "\n\n【フォーマット参考サンプル】以下は文体・長さ・具体性のレベルの参考例です:\n"
-        for i, sample in enumerate(reference_samples[:sample_count], 1):
-            reference_text += f"{i}. {sample}\n"
-
-    # 担当領域の条件文を作成
-    area_condition = f"- 担当領域:{area}" if area else ""
-    area_analysis = f'- 「{area}」という担当領域で特に重要な業務は何か' if area else ""
-
-    prompt = f"""以下の条件で、米国ビザ申請書に記載する職務内容を{count}件生成してください。
-
-【条件】
-- ポジション:{position}
-- 業界:{industry}
-- 部門:{department}
-{area_condition}
-- 勤務地:アメリカ
-
-【ステップ1: 特徴の分析】
-まず、以下の点を考えてください（出力不要）：
-- 「{industry}」業界の特徴は何か（市場環境、規制、競争要因など）
-- 「{department}」部門で重要な業務領域は何か
-- 「{position}」として期待される役割・責任は何か
-{area_analysis}
-- アメリカで行う業務として適切な内容は何か
-
-【ステップ2: 職務内容の生成】
-上記の分析を踏まえて、この組み合わせに特有の職務内容を10件生成してください。
-{reference_text}
-【重要な制約】
-- これはアメリカで行う業務内容です。
-- 参考サンプルの「内容」は完全に無視してください。参考サンプルは異なる業界・部門のものが含まれています。
-- 参考サンプルから学ぶべきは「文体」「1文あたりの長さ」「具体性のレベル」「表現パターン」のみです。
-- 生成する内容は、必ず指定された「{industry}」業界の「{department}」部門の業務に限定してください。
-- 業界・部門・ポジションの特徴を反映した具体的な内容にしてください。
-
-【文字数の厳守（最重要）】
-- 各項目は「最低50文字以上」で記述すること。50文字未満の出力は絶対に不可。
-- 目標は60〜80文字。短い文は具体的な情報を追加して必ず50文字以上にすること。
-- 例：「営業戦略を立案」(8文字)→NG、「北米市場における新規顧客開拓に向けた営業戦略の立案と、四半期ごとの売上目標達成に向けたアクションプランの策定」(65文字)→OK
-
-【具体性の確保】
-- 必ず含めるべき要素：対象（製品/市場/顧客層）、手法・プロセス、目的・成果
-- 業界特有の専門用語、規制名、システム名などを積極的に使用すること
-
-【文体の制約】
-- 必ず日本語で出力すること（英語や中国語など他の言語は使用しないこと）
-- 文体は「です・ます調」ではなく、体言止めや「~する」などの常体で統一すること
-- 文末表現は「~を行う」「~に関与」「~を担当」「~の実施」「~を図る」「~を推進」などを使用すること
-- 箇条書きで{count}件を番号付きリストで出力すること（分析結果は出力せず、職務内容のみ出力）
-"""
-
-    response = client.chat.completions.create(
-        model="gpt-4-turbo",
-        messages=[
-            {"role": "system", "content": "あなたは米国ビザ申請書に適した職務内容を日本語で生成するアシスタントです。"},
-            {"role": "user", "content": prompt}
-        ]
-    )
-
-    # 生成結果をリストに変換
-    content = response.choices[0].message.content
-    lines = [line.strip() for line in content.split('\n') if line.strip() and not line.strip().startswith('#')]
+    calls = []
 
-    # 番号を除去してリスト化
-    job_list = []
-    for line in lines:
-        # "1. " や "1) " などの番号を除去
-        import re
-        cleaned = re.sub(r'^\d+[.):]\s*', '', line)
-        if cleaned:
-            job_list.append(cleaned)
+    def fetch(count, deadline):
+        calls.append(count)
+        items = _stream_job_descriptions_raw(position, industry, department, area, reference_samples, sample_count, count, deadline)
+        return _count_items(items, MIN_CHARS)
 
-    return job_list
+    results = generation_strategies.run(
+        strategy or GENERATION_STRATEGY, fetch, TARGET_COUNT, MIN_CHARS, MAX_RETRIES,
+        budget=llm_transport.budget(GENERATION_BUDGET_SEC), check=check_reference_copy,
+        on_drop=lambda reason: DUPLICATE_ITEMS.inc(reason=reason, action='drop'),
+        executor=llm_executor, **GENERATION_OPTIONS
+    )
+    count = 0
+    try:
+        for item in results:
+            count += 1
+            if len(item) < MIN_CHARS:
+                GENERATION_ITEMS.inc(result='fallback')
+            yield item
+    finally:
+        GENERATION_CALLS.observe(len(calls))
+        if len(calls) > 1:
+            GENERATION_RETRIES.inc(len(calls) - 1)
+
+    if not count and results.timed_out:
+        # 1件も得られないまま期限切れ（空の結果を返さず、504・データベースの検索結果での代替にする）
+        raise DeadlineExceeded("制限時間内に職務内容を生成できませんでした")
+    if not results.complete:
+        GENERATION_INCOMPLETE.inc()
+        print(f"[DEBUG] 制限時間内に目標件数が揃わなかったため、結果をキャッシュしません（{count}件）", flush=True)
+    if on_done:
+        on_done(results.complete)
+    print(f"[DEBUG] 最終結果: {count}件", flush=True)
+
+def check_reference_copy(item, sig):
+    """参考サンプル（データの職務内容）をほぼそのまま写した項目なら除外理由を返す"""
+    reference_index = current_data().reference_index
+    if REFERENCE_COPY_ACTION == 'off' or reference_index is None:
+        return None
+    match = reference_index.find(sig)
+    if match is None:
+        return None
+    row, score = match
+    metrics.log('reference_copy', row=row, similarity=round(score, 3), action=REFERENCE_COPY_ACTION)
+    if REFERENCE_COPY_ACTION == 'flag':
+        DUPLICATE_ITEMS.inc(reason='reference_copy', action='flag')
+        return None
+    return 'reference_copy'
+
+def _count_items(items, min_chars):
+    """生成された項目を文字数で数えながらそのまま返す（close() は元のジェネレータに伝える）"""
+    try:
+        for item in items:
+            GENERATION_ITEMS.inc(result='accepted' if len(item) >= min_chars else 'short')
+            yield item
+    finally:
+        items.close()
+
+@metrics.timed('prompt')
+def _build_generation_messages(position, industry, department, area, reference_samples=None, sample_count=5, count=10):
+    """職務内容生成用のメッセージを作成（参考サンプルはトークン数の上限内に絞る。prompts.py 参照）"""
+    references, counts = prompts.select_references(tuple(reference_samples or ()), sample_count)
+    for result, number in counts.items():
+        if number:
+            PROMPT_REFERENCES.inc(number, result=result)
+    return prompts.generation_messages(position, industry, department, area, references, count)
+
+def warm_store_version():
+    """事前生成ストアの有効性を判定する値（モデル名・プロンプトのバージョンと内容のハッシュ）
+
+    プロンプトの内容は、入力の代わりに目印の文字列を入れて組み立てたもののハッシュにする。
+    PROMPT_VERSION を上げ忘れても、テンプレートを変えれば古いストアは使われない。
+    """
+    # 計測（PROMPT_REFERENCES・prompt の所要時間）に数えないよう、prompts.py を直接使う
+    references, _ = prompts.select_references(('<sample>',), 5)
+    messages = prompts.generation_messages('<position>', '<industry>', '<department>', '<area>', references)
+    payload = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    return {
+        'model': OPENAI_MODEL,
+        'prompt_version': PROMPT_VERSION,
+        'prompt_sha256': hashlib.sha256(payload.encode('utf-8')).hexdigest(),
+    }
+
+def estimate_tokens(messages, completion_tokens=0):
+    """トークン数の見積もり（送信前にローカルで数える。prompts.count_message_tokens 参照）"""
+    return prompts.count_message_tokens(messages) + completion_tokens
+
+def _clean_item(line):
+    """生成結果の1行から番号を除去（空行・見出しはNone）"""
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    # "1. " や "1) " などの番号を除去
+    cleaned = re.sub(r'^\d+[.):]\s*', '', line)
+    return cleaned or None
+
+def _stream_job_descriptions_raw(position, industry, department, area, reference_samples=None, sample_count=5, count=10, deadline=None):
+    """ChatGPTで職務内容をストリーミング生成し、1行完成するごとに項目を返す（内部関数）
+
+    ジェネレータを途中で close() するとストリームも閉じ、以降のトークン生成を打ち切る。
+    deadline（time.monotonic() 基準）を過ぎた場合も打ち切る。
+    """
+    messages = _build_generation_messages(position, industry, department, area, reference_samples, sample_count, count)
+    check_breaker('generation')
+    wait_limit = llm_transport.remaining(deadline)
+
+    # 1項目あたり約100トークンとして見積もる（実際の使用量は受信後に反映）
+    queued = time.perf_counter()
+    with llm_limiter.slot(estimate_tokens(messages, count * 100), timeout=wait_limit) as slot:
+        started = time.perf_counter()
+        metrics.record_stage('llm_queue', started - queued)
+        try:
+            # 最初のチャンクが届いた時点で返る（遅ければ流量制限の空きがあればヘッジする。llm_transport.py 参照）
+            stream = llm.create(
+                client, 'generation', deadline=deadline,
+                limiter=llm_limiter, estimated_tokens=slot.estimated_tokens,
+                model=OPENAI_MODEL,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+        except DeadlineExceeded:
+            # 制限時間までに最初の応答がなかった（集まった分とフォールバックで返す。
+            # 1件もなければ iter_job_descriptions が DeadlineExceeded にする）
+            print("[DEBUG] 制限時間のため生成を打ち切り", flush=True)
+            record_llm_call('generation', 'deadline', time.perf_counter() - started, None, estimate_tokens(messages), 0)
+            return
+        except Exception as e:
+            record_llm_call('generation', llm_outcome(e), time.perf_counter() - started, None, estimate_tokens(messages), 0)
+            raise
+
+        received = 0
+        usage = None
+        first_token = None
+        outcome = 'error'
+        try:
+            buffer = ""
+            for chunk in stream:
+                if getattr(chunk, 'usage', None):
+                    usage = chunk.usage
+                    slot.record(usage.total_tokens)
+                if generation_strategies.expired(deadline):
+                    print("[DEBUG] 制限時間のため生成を打ち切り", flush=True)
+                    outcome = 'deadline'
+                    return
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                    metrics.record_stage('llm_first_token', first_token)
+                received += len(delta)
+                buffer += delta
+                # 改行が届いた時点で1項目完成
+                while "\n" in buffer:
+                    line, buffer = buffer.split("\n", 1)
+                    item = _clean_item(line)
+                    if item:
+                        yield item
+            item = _clean_item(buffer)
+            outcome = 'ok'
+            if item:
+                yield item
+        except DeadlineExceeded:
+            # 最初のチャンクの後にストリームが止まり、呼び出しの期限を過ぎた（受信した分で続ける）
+            print("[DEBUG] 制限時間のため生成を打ち切り（ストリーミングの途中）", flush=True)
+            outcome = 'deadline'
+        except GeneratorExit:
+            # 必要な件数が揃ったなどで呼び出し側が打ち切った
+            outcome = 'closed'
+            raise
+        finally:
+            stream.close()
+            if slot.used_tokens is None:
+                # 途中で打ち切った場合は受信した分で概算
+                slot.record(estimate_tokens(messages, received))
+            record_llm_call('generation', outcome, time.perf_counter() - started, usage,
+                            estimate_tokens(messages), received, first_token=first_token, count=count)
+
+def check_breaker(kind):
+    """OpenAIが停止中（サーキットブレーカーが開いている）なら、流量制限の枠を使わずにすぐ断る"""
+    try:
+        llm.breaker.check()
+    except CircuitOpen:
+        LLM_CALLS.inc(kind=kind, outcome='circuit_open')
+        raise
+
+def llm_outcome(e):
+    """呼び出しが失敗したときの outcome（circuit_open: ブレーカーで断った / deadline: 期限切れ）"""
+    if isinstance(e, CircuitOpen):
+        return 'circuit_open'
+    if isinstance(e, TimeoutError):
+        return 'deadline'
+    return 'error'
+
+def record_llm_call(kind, outcome, seconds, usage, prompt_estimate, completion_estimate, **fields):
+    """OpenAI呼び出し1回分の計測とログ（usageがなければ概算のトークン数を使う）"""
+    prompt_tokens = usage.prompt_tokens if usage else prompt_estimate
+    completion_tokens = usage.completion_tokens if usage else completion_estimate
+    # プロバイダのプロンプトキャッシュに当たったトークン数（usage.prompt_tokens_details.cached_tokens）
+    cached_tokens = getattr(getattr(usage, 'prompt_tokens_details', None), 'cached_tokens', None) or 0
+    metrics.record_stage(f'llm_{kind}', seconds)
+    LLM_CALLS.inc(kind=kind, outcome=outcome)
+    LLM_TOKENS.inc(prompt_tokens, kind=kind, type='prompt')
+    LLM_TOKENS.inc(cached_tokens, kind=kind, type='cached_prompt')
+    LLM_TOKENS.inc(completion_tokens, kind=kind, type='completion')
+    fields = {key: value for key, value in fields.items() if value is not None}
+    if 'first_token' in fields:
+        fields['first_token_ms'] = round(fields.pop('first_token') * 1000, 1)
+    metrics.log('llm_call', kind=kind, outcome=outcome, duration_ms=round(seconds * 1000, 1),
+                prompt_tokens=prompt_tokens, cached_tokens=cached_tokens, completion_tokens=completion_tokens,
+                prompt_estimate=prompt_estimate, usage_reported=usage is not None, **fields)
 
 def filter_by_length(items, min_chars=50):
     """50文字以上のものだけを返す"""
     return [item for item in items if len(item) >= min_chars]
 
-def evaluate_patterns(position, industry, department, area, similar_results, random_results):
-    """2つのパターンをAIで評価"""
-
-    area_text = f"、担当領域「{area}」" if area else ""
-
-    prompt = f"""以下の2つのパターンで生成された職務内容を評価してください。
-
-【入力条件】
-- ポジション: {position}
-- 業界: {industry}
-- 部門: {department}
-{f'- 担当領域: {area}' if area else ''}
-
-【パターンA: 似た業界・部門を参照】
-{chr(10).join([f'{i+1}. {item}' for i, item in enumerate(similar_results)])}
-
-【パターンB: ランダムサンプルを参照】
-{chr(10).join([f'{i+1}. {item}' for i, item in enumerate(random_results)])}
-
-【評価基準】
-1. 業界特性の反映: {industry}業界特有の業務内容が含まれているか
-2. 部門特性の反映: {department}部門の典型的な業務が含まれているか
-3. ポジション特性の反映: {position}としての役割・責任が適切か
-{f'4. 担当領域の反映: {area}に関連する業務が含まれているか' if area else ''}
-5. 具体性: 抽象的でなく、具体的な業務内容になっているか
-6. 多様性: 似たような内容の繰り返しがなく、多様な業務が含まれているか
+def evaluation_key(position, industry, department, area, similar_results, random_results):
+    """AIの評価のキャッシュキー（同じ条件・同じ生成結果なら同じキー）"""
+    return generation_cache_key(
+        'evaluation', position, industry, department, area,
+        similar_results=similar_results, random_results=random_results
+    )
 
-【出力形式】
-以下のJSON形式で出力してください（他の文章は不要）:
-{{
-  "winner": "A" または "B" または "同等",
-  "score_a": 1-10の整数,
-  "score_b": 1-10の整数,
-  "reason": "選んだ理由を1-2文で簡潔に"
-}}"""
+def llm_evaluate_patterns(position, industry, department, area, similar_results, random_results, bypass_cache=False):
+    """2つのパターンをAIで評価（失敗時は例外）"""
+
+    def request_evaluation():
+        messages = prompts.evaluation_messages(position, industry, department, area, similar_results, random_results)
+        check_breaker('evaluation')
+        queued = time.perf_counter()
+        with llm_limiter.slot(estimate_tokens(messages, 300), timeout=llm_transport.remaining()) as slot:
+            started = time.perf_counter()
+            metrics.record_stage('llm_queue', started - queued)
+            try:
+                response = llm.create(
+                    client, 'evaluation', timeout=EVALUATION_TIMEOUT_SEC,
+                    limiter=llm_limiter, estimated_tokens=slot.estimated_tokens,
+                    model=OPENAI_MODEL,
+                    messages=messages,
+                    response_format={"type": "json_object"}
+                )
+            except Exception as e:
+                record_llm_call('evaluation', llm_outcome(e), time.perf_counter() - started, None, estimate_tokens(messages), 0)
+                raise
+            if response.usage:
+                slot.record(response.usage.total_tokens)
+            record_llm_call('evaluation', 'ok', time.perf_counter() - started, response.usage,
+                            estimate_tokens(messages), len(response.choices[0].message.content or ''))
+
+        return json.loads(response.choices[0].message.content)
+
+    # 同じ条件・同じ生成結果の評価はキャッシュから返す（エラー時は保存しない）
+    # 同じ評価が実行中なら相乗りする
+    key = evaluation_key(position, industry, department, area, similar_results, random_results)
+    with metrics.stage('evaluation'):
+        result = cached_compute(key, request_evaluation, bypass_cache)
+    print(f"[EVAL] winner={result.get('winner')}, A={result.get('score_a')}, B={result.get('score_b')}", flush=True)
+    return {**result, 'judge': 'llm'}
+
+def local_evaluate_patterns(industry, department, area, similar_results, random_results):
+    """2つのパターンをローカルで自動評価（数ミリ秒、OpenAIを呼ばない）"""
+    keywords = scoring.split_keywords([
+        industry, normalize_industry(industry), department, normalize_department(department), area
+    ])
+    with metrics.stage('local_evaluation'):
+        result = scoring.evaluate(similar_results, random_results, keywords)
+    print(f"[EVAL] local: winner={result['winner']}, A={result['score_a']}, B={result['score_b']}", flush=True)
+    return result
+
+def needs_llm_evaluation(local, judge):
+    """ローカルの評価に加えてAIで評価するか（async はAIの評価を後で行うので False）"""
+    if judge == 'llm':
+        return True
+    if judge == 'gated':
+        return abs(local['score_a'] - local['score_b']) < JUDGE_GATE_MARGIN
+    return False
+
+def evaluate_patterns(position, industry, department, area, similar_results, random_results, bypass_cache=False, judge=None):
+    """2つのパターンを評価（judge: JUDGE_MODES のいずれか。省略時は JUDGE_MODE）
+
+    ローカルの自動評価は常に行い、local_scores として結果に付ける。
+    AIの評価が失敗した場合はローカルの評価を返す（llm_error にエラー内容）。
+    """
+    judge = judge or JUDGE_MODE
+    local = local_evaluate_patterns(industry, department, area, similar_results, random_results)
+
+    if judge == 'async':
+        EVALUATIONS.inc(mode=judge, judge='local')
+        evaluation_id = start_llm_evaluation(
+            position, industry, department, area, similar_results, random_results, bypass_cache, local)
+        return {**local, 'llm_evaluation_id': evaluation_id}
+
+    if not needs_llm_evaluation(local, judge):
+        EVALUATIONS.inc(mode=judge, judge='local')
+        return local
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4-turbo",
-            messages=[
-                {"role": "system", "content": "あなたは職務内容の品質を評価する専門家です。JSON形式で回答してください。"},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"}
-        )
-
-        import json
-        result = json.loads(response.choices[0].message.content)
-        print(f"[EVAL] winner={result.get('winner')}, A={result.get('score_a')}, B={result.get('score_b')}", flush=True)
-        return result
+        result = llm_evaluate_patterns(
+            position, industry, department, area, similar_results, random_results, bypass_cache)
     except Exception as e:
         print(f"[EVAL] エラー: {e}", flush=True)
-        return {
-            "winner": "評価エラー",
-            "score_a": 0,
-            "score_b": 0,
-            "reason": str(e)
-        }
+        EVALUATIONS.inc(mode=judge, judge='local')
+        return {**local, 'llm_error': str(e) or type(e).__name__}
+    EVALUATIONS.inc(mode=judge, judge='llm')
+    record_agreement(local, result)
+    return {**result, 'local_scores': local['local_scores']}
+
+def record_agreement(local, result):
+    """ローカルとAIの勝者が一致したかを記録（ローカルの評価の調整用）"""
+    agree = local['winner'] == result.get('winner')
+    JUDGE_AGREEMENT.inc(result='agree' if agree else 'disagree')
+    metrics.log('judge_agreement', local_winner=local['winner'], llm_winner=result.get('winner'),
+                local_scores=[local['score_a'], local['score_b']],
+                llm_scores=[result.get('score_a'), result.get('score_b')])
+
+# 応答の後で実行しているAIの評価（/api/evaluations/<id> 用、失敗したものはエラー内容を残す）
+pending_evaluations = {}
+failed_evaluations = OrderedDict()
+_evaluations_lock = threading.Lock()
+MAX_FAILED_EVALUATIONS = 256
+
+def start_llm_evaluation(position, industry, department, area, similar_results, random_results, bypass_cache, local):
+    """AIの評価を共有スレッドプールで開始し、評価IDを返す（混雑時は行わずNone）"""
+    key = evaluation_key(position, industry, department, area, similar_results, random_results)
+    evaluation_id = key.split(':', 1)[1]
+
+    def run():
+        # 応答の後に行うので、元のリクエストの残り時間ではなく評価のタイムアウトまで待つ
+        llm_transport.set_deadline(EVALUATION_TIMEOUT_SEC)
+        try:
+            result = llm_evaluate_patterns(
+                position, industry, department, area, similar_results, random_results, bypass_cache)
+        except Exception as e:
+            print(f"[EVAL] エラー（非同期）: {e}", flush=True)
+            with _evaluations_lock:
+                failed_evaluations[evaluation_id] = str(e) or type(e).__name__
+                while len(failed_evaluations) > MAX_FAILED_EVALUATIONS:
+                    failed_evaluations.popitem(last=False)
+            return
+        finally:
+            with _evaluations_lock:
+                pending_evaluations.pop(evaluation_id, None)
+        record_agreement(local, result)
+
+    with _evaluations_lock:
+        if evaluation_id in pending_evaluations:
+            return evaluation_id
+        failed_evaluations.pop(evaluation_id, None)
+        pending_evaluations[evaluation_id] = True
+    try:
+        llm_executor.submit_all([(run, ())])
+    except Overloaded:
+        print("[EVAL] 混雑のためAIの評価を省略", flush=True)
+        with _evaluations_lock:
+            pending_evaluations.pop(evaluation_id, None)
+        return None
+    return evaluation_id
+
+# 比較パターンの定義（ラベル, 参照サンプルの取得方法）
+COMPARE_PATTERNS = {
+    'similar': ('似た業界・部門 × 10件', lambda industry, department, area, retrieval: get_similar_samples(industry, department, 10, retrieval, area)),
+    'random': ('ランダム × 10件', lambda industry, department, area, retrieval: get_random_samples(10)),
+}
+
+def run_pattern(kind, position, industry, department, area, bypass_cache=False, on_item=None, retrieval=None):
+    """比較パターン1つ分のAI生成（参照サンプルごとキャッシュする）
+
+    on_item を渡すと、採用された項目を生成中に1件ずつ通知する
+    （キャッシュヒット時や、実行中の同じ生成に相乗りした場合は呼ばれない）。
+    """
+    key, compute = generation_task(kind, position, industry, department, area, retrieval, on_item)
+    return cached_generation(key, compute, bypass_cache)
+
+def database_pattern(position, industry, department):
+    """データベースから直接出力するパターン（AI生成なし）"""
+    return {
+        'label': 'データベース直接',
+        'samples_used': [],
+        'generated': search_database(position, industry, department)
+    }
+
+def compare_params(data):
+    """比較エンドポイント共通の入力"""
+    return (
+        data.get('position', ''),
+        data.get('industry', ''),
+        data.get('department', ''),
+        data.get('area', ''),
+        bool(data.get('no_cache', False)),
+        data.get('retrieval') or SAMPLE_RETRIEVAL,
+        data.get('judge') or JUDGE_MODE
+    )
 
 @app.route('/api/compare', methods=['POST'])
 def compare():
@@ -453,59 +1015,32 @@ def compare():
     initialize()
     print("[COMPARE] v3 - 並列処理 + GPT-4-turbo", flush=True)
 
-    data = request.json
-    position = data.get('position', '')
-    industry = data.get('industry', '')
-    department = data.get('department', '')
-    area = data.get('area', '')
-
+    position, industry, department, area, bypass_cache, retrieval, judge = compare_params(request.json)
+    if retrieval not in RETRIEVAL_MODES:
+        return invalid_retrieval(retrieval)
+    if judge not in JUDGE_MODES:
+        return invalid_choice('judge', judge, JUDGE_MODES)
     results = {}
-    MIN_CHARS = 50
-
-    def generate_similar():
-        samples = get_similar_samples(industry, department, 10)
-        # generate_job_descriptions内でフィルタ+フォールバック済み
-        results = generate_job_descriptions(position, industry, department, area, samples, 10)
-        print(f"[COMPARE] similar: {len(results)}件", flush=True)
-        return {
-            'label': '似た業界・部門 × 10件',
-            'samples_used': samples,
-            'generated': results
-        }
-
-    def generate_random():
-        samples = get_random_samples(10)
-        # generate_job_descriptions内でフィルタ+フォールバック済み
-        results = generate_job_descriptions(position, industry, department, area, samples, 10)
-        print(f"[COMPARE] random: {len(results)}件", flush=True)
-        return {
-            'label': 'ランダム × 10件',
-            'samples_used': samples,
-            'generated': results
-        }
 
     try:
-        # 並列処理でsimilarとrandomを同時生成
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            future_similar = executor.submit(generate_similar)
-            future_random = executor.submit(generate_random)
-
-            results['similar'] = future_similar.result()
-            results['random'] = future_random.result()
+        # 共有スレッドプールでsimilarとrandomを同時生成（混雑時はOverloaded → 503）
+        future_similar, future_random = llm_executor.submit_all([
+            (run_pattern, ('similar', position, industry, department, area, bypass_cache, None, retrieval)),
+            (run_pattern, ('random', position, industry, department, area, bypass_cache, None, retrieval)),
+        ])
+        results['similar'] = future_similar.result(timeout=COMPARE_TIMEOUT_SEC)
+        results['random'] = future_random.result(timeout=COMPARE_TIMEOUT_SEC)
 
         # パターン3: データベースから直接出力（AI生成なし）
-        db_results = search_database(position, industry, department)
-        results['database'] = {
-            'label': 'データベース直接',
-            'samples_used': [],
-            'generated': db_results
-        }
+        results['database'] = database_pattern(position, industry, department)
 
-        # AI評価を実行
+        # 評価（judge に応じてローカルの自動評価・AI評価）
         evaluation = evaluate_patterns(
             position, industry, department, area,
             results['similar']['generated'],
-            results['random']['generated']
+            results['random']['generated'],
+            bypass_cache,
+            judge
         )
         results['evaluation'] = evaluation
 
@@ -514,11 +1049,287 @@ def compare():
             'results': results
         })
     except Exception as e:
+        return error_response(e)
+
+def sse_event(event, data):
+    """Server-Sent Eventsの1イベント分の文字列"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/compare/stream', methods=['POST'])
+def compare_stream():
+    """3パターン比較のストリーミング版（SSE）
+
+    準備できたものから順に送信する:
+      event: item       data: {"name": "similar" | "random", "text": "..."}（AI生成中の項目を1件ずつ）
+      event: pattern    data: {"name": "database" | "similar" | "random", "label", "samples_used", "generated"}
+      event: evaluation data: 評価結果（/api/compareのevaluationと同じ。judge=async ではローカル・AIの順に2回）
+      event: done       data: {}
+      event: error      data: {"error": "..."}
+    """
+    initialize()
+    print("[COMPARE] stream", flush=True)
+
+    position, industry, department, area, bypass_cache, retrieval, judge = compare_params(request.json)
+    if retrieval not in RETRIEVAL_MODES:
+        return invalid_retrieval(retrieval)
+    if judge not in JUDGE_MODES:
+        return invalid_choice('judge', judge, JUDGE_MODES)
+
+    # 生成スレッドからの通知（採用された項目・パターンの完了）を受け取るキュー
+    events = queue.Queue()
+
+    def on_item(kind):
+        return lambda item: events.put(('item', {'name': kind, 'text': item}))
+
+    # ストリームを開始する前に受け付けておき、混雑時はすぐに503を返す
+    kinds = list(COMPARE_PATTERNS)
+    try:
+        futures = dict(zip(llm_executor.submit_all([
+            (run_pattern, (kind, position, industry, department, area, bypass_cache, on_item(kind), retrieval))
+            for kind in kinds
+        ]), kinds))
+    except Overloaded as e:
+        return error_response(e)
+    for future in futures:
+        future.add_done_callback(lambda f: events.put(('done', f)))
+
+    def stream():
+        try:
+            # データベースは数ミリ秒で終わるので先に送る
+            yield sse_event('pattern', {'name': 'database', **database_pattern(position, industry, department)})
+
+            deadline = time.monotonic() + COMPARE_TIMEOUT_SEC
+            results = {}
+            while len(results) < len(futures):
+                try:
+                    event, payload = events.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    raise TimeoutError("生成がタイムアウトしました")
+                if event == 'item':
+                    yield sse_event('item', payload)
+                    continue
+                kind = futures[payload]
+                results[kind] = payload.result()
+                yield sse_event('pattern', {'name': kind, **results[kind]})
+
+            similar_results = results['similar']['generated']
+            random_results = results['random']['generated']
+            if judge == 'async':
+                # ローカルの評価を先に送り、AIの評価が終わったら続けて送る
+                yield sse_event('evaluation', evaluate_patterns(
+                    position, industry, department, area, similar_results, random_results, bypass_cache, 'local'
+                ))
+            evaluation = evaluate_patterns(
+                position, industry, department, area, similar_results, random_results, bypass_cache,
+                'llm' if judge == 'async' else judge
+            )
+            yield sse_event('evaluation', evaluation)
+            yield sse_event('done', {})
+        except Exception as e:
+            yield sse_event('error', {'error': str(e) or type(e).__name__})
+        finally:
+            # クライアントが切断した場合、まだ始まっていない生成は取り消す
+            for future in futures:
+                future.cancel()
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/evaluations/<evaluation_id>', methods=['GET'])
+def get_evaluation(evaluation_id):
+    """judge=async で応答の後に行ったAIの評価を取得する
+
+    終わっていれば 200（evaluation）、実行中なら 202、失敗したら 500、見つからなければ 404。
+    """
+    if not re.fullmatch(r'[0-9a-f]{64}', evaluation_id):
+        return jsonify({'success': False, 'error': '評価IDが不正です'}), 400
+    key = f"evaluation:{evaluation_id}"
+
+    result = llm_cache.get(key)
+    if result is not None:
+        return jsonify({'success': True, 'status': 'done', 'evaluation': {**result, 'judge': 'llm'}})
+
+    with _evaluations_lock:
+        pending = evaluation_id in pending_evaluations
+        error = failed_evaluations.get(evaluation_id)
+    status, message = inflight.status(key)
+    if pending or status in ('running', 'done'):  # done: キャッシュへの保存前
+        return jsonify({'success': True, 'status': 'pending'}), 202
+    if error is None and status == 'error':
+        error = message
+    if error is not None:
+        return jsonify({'success': False, 'status': 'error', 'error': error}), 500
+    return jsonify({'success': False, 'error': '評価が見つかりません'}), 404
+
+def process_batch_row(row):
+    """一括生成ジョブの1行分（/api/search と同じ生成・キャッシュ・流量制限を使う）"""
+    context = metrics.start_request()
+    llm_transport.set_deadline(LLM_REQUEST_BUDGET_SEC)
+    # 1行の生成の途中で再読み込みされても同じデータを使う
+    token = data_store.pin()
+    try:
+        results = generate_with_references(row['position'], row['industry'], row['department'], row['area'])
+    finally:
+        data_store.unpin(token)
+    metrics.log('batch_row', row=row['row'], duration_ms=round(context.elapsed() * 1000, 1),
+                stages_ms=context.stage_millis())
+    # complete=False の行は制限時間で打ち切った不完全な結果（キャッシュはされていない）
+    return {'results': results, 'complete': is_complete(results)}
+
+# 一括生成ジョブ（混雑時は失敗にせず、待ってから同じ行をやり直す）
+batch_jobs = JobManager.from_env(process_batch_row, retry_errors=(Overloaded,))
+metrics.stats_gauges('batch', '一括生成ジョブ', batch_jobs.stats)
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """一括生成ジョブを作成（CSV/JSONLのファイルをfileで、または本文で送る）"""
+    initialize()
+
+    try:
+        upload = request.files.get('file')
+        if upload:
+            rows = parse_rows(upload.read(), upload.filename or '')
+        else:
+            rows = parse_rows(request.get_data(), request.args.get('filename', ''))
+        job = batch_jobs.create(rows)
+        return jsonify({
+            'success': True,
+            'job': job
+        }), 202
+    except (JobError, UnicodeDecodeError) as e:
         return jsonify({
             'success': False,
             'error': str(e)
-        }), 500
+        }), 400
+    except Exception as e:
+        return error_response(e)
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """一括生成ジョブの進捗"""
+    initialize()
+
+    try:
+        return jsonify({
+            'success': True,
+            'job': batch_jobs.status(job_id)
+        })
+    except (JobError, KeyError):
+        return jsonify({
+            'success': False,
+            'error': 'job not found'
+        }), 404
+
+@app.route('/api/jobs/<job_id>/results', methods=['GET'])
+def job_results(job_id):
+    """一括生成ジョブの処理済みの結果（JSONL、1行1件、完了順）"""
+    initialize()
+
+    try:
+        status = batch_jobs.status(job_id)
+    except (JobError, KeyError):
+        return jsonify({
+            'success': False,
+            'error': 'job not found'
+        }), 404
+    return Response(batch_jobs.iter_results(job_id), mimetype='application/x-ndjson', headers={
+        'X-Job-Status': status['status'],
+        'Content-Disposition': f'attachment; filename="{job_id}.jsonl"'
+    })
+
+def check_admin_token():
+    """管理用エンドポイントのトークンを確認（ADMIN_TOKEN未設定なら常に拒否）"""
+    expected = os.getenv('ADMIN_TOKEN')
+    if not expected:
+        return False
+    return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), expected)
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """キャッシュのヒット・ミス件数と相乗りの件数"""
+    return jsonify({
+        'success': True,
+        'stats': llm_cache.stats(),
+        'inflight': inflight.stats()
+    })
+
+@app.route('/api/cache/invalidate', methods=['POST'])
+def cache_invalidate():
+    """キャッシュの削除（条件指定で該当パターンのみ、all=trueで全件）"""
+    if not check_admin_token():
+        return jsonify({
+            'success': False,
+            'error': 'unauthorized'
+        }), 401
+
+    data = request.json or {}
+    if data.get('all'):
+        llm_cache.invalidate()
+        return jsonify({'success': True, 'invalidated': 'all'})
+
+    position = data.get('position', '')
+    industry = data.get('industry', '')
+    department = data.get('department', '')
+    area = data.get('area', '')
+    kinds = ['reference', 'similar', 'random']
+    for kind in kinds:
+        for retrieval in RETRIEVAL_MODES:
+            llm_cache.invalidate(generation_cache_key(kind, position, industry, department, area, retrieval=retrieval))
+    return jsonify({'success': True, 'invalidated': kinds})
+
+@app.route('/api/admin/data', methods=['GET'])
+def data_status():
+    """現在のデータの世代・再読み込みの状況（このワーカープロセスのもの）"""
+    return jsonify({'success': True, 'data': data_store.status()})
+
+@app.route('/api/admin/reload', methods=['POST'])
+def data_reload():
+    """サンプルデータ・インデックス・同義語辞書を再読み込みする
+
+    このワーカーは裏で読み込みを始めて202を返す（完了までは今のデータで応答する）。
+    他のワーカーは再読み込み要求ファイルの更新を監視で検出して読み込む。
+    """
+    if not check_admin_token():
+        return jsonify({
+            'success': False,
+            'error': 'unauthorized'
+        }), 401
+
+    load_data()
+    started = data_store.request_reload('管理用エンドポイント')
+    return jsonify({'success': True, 'started': started, 'data': data_store.status()}), 202
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """データとインデックスの読み込みが済んでいれば200、まだなら503
+
+    OpenAIクライアントの状態（APIキーの設定漏れなどで作れていない）は llm_client で別に返す。
+    クライアントがなくてもデータベース直接の検索などには応答できるので、準備完了のままにする。
+    """
+    data = data_store.current
+    ready = data is not None
+    return jsonify({
+        'ready': ready,
+        'rows': len(data.df) if data is not None else 0,
+        'semantic_index': data is not None and data.semantic_index is not None,
+        'data_generation': data.generation if data is not None else 0,
+        'llm_client': client is not None,
+        # ブレーカーが開いていてもデータベースの検索結果で応答できるので、準備完了のままにする
+        'llm_breaker': llm.breaker.state
+    }), 200 if ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus形式の計測値（プロセスごと）"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 if __name__ == '__main__':
+    # 開発用サーバー（本番は gunicorn -c gunicorn.conf.py wsgi:app）
+    try:
+        initialize()
+    except Exception as e:
+        print(f"ERROR: 初期化に失敗しました（最初のリクエストで再試行します）: {e}", flush=True)
     port = int(os.getenv('PORT', 5000))
-    app.run(debug=False, host='0.0.0.0', port=port)
+    app.run(debug=False, host='0.0.0.0', port=port, threaded=True)
@@ -0,0 +1,294 @@
+"""一括生成ジョブ
+
+CSV/JSONLでアップロードされた (position, industry, department, area) の行を
+バックグラウンドのワーカーで順に処理する。進捗と結果はジョブごとのディレクトリに
+書き出すので、再起動しても未処理の行から再開できる。
+
+    jobs/<job_id>/job.json       ジョブの情報（件数・作成日時）
+    jobs/<job_id>/input.jsonl    入力行（row: 0始まりの行番号）
+    jobs/<job_id>/results.jsonl  処理済みの行（完了順に追記）
+    jobs/<job_id>/lock           処理中のプロセスが持つロック（複数ワーカーで二重に処理しない）
+"""
+import csv
+import fcntl
+import io
+import json
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+
+FIELDS = ('position', 'industry', 'department', 'area')
+
+# CSVの見出しは日本語でも受け付ける
+HEADER_ALIASES = {
+    'ポジション': 'position',
+    '業界': 'industry',
+    '部門': 'department',
+    '担当領域': 'area',
+}
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{12}$')
+
+
+class JobError(ValueError):
+    """入力やジョブIDが不正"""
+
+
+def parse_rows(data, filename=''):
+    """アップロードされたCSV/JSONLを行のリストに変換"""
+    text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+    stripped = text.lstrip()
+    if filename.endswith('.jsonl') or stripped.startswith('{'):
+        rows = []
+        for number, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except json.JSONDecodeError:
+                raise JobError(f"{number}行目がJSONとして読めません")
+    else:
+        reader = csv.DictReader(io.StringIO(text))
+        rows = [{HEADER_ALIASES.get(k.strip(), k.strip()): v for k, v in row.items() if k} for row in reader]
+
+    result = []
+    for number, row in enumerate(rows, 1):
+        if not isinstance(row, dict):
+            raise JobError(f"{number}件目の形式が不正です")
+        cleaned = {field: str(row.get(field) or '').strip() for field in FIELDS}
+        if not any(cleaned.values()):
+            continue  # 空行
+        if not (cleaned['position'] or cleaned['industry'] or cleaned['department']):
+            raise JobError(f"{number}件目: position/industry/department のいずれかが必要です")
+        result.append(cleaned)
+    return result
+
+
+class _Job:
+    """処理中のジョブ（このプロセスがロックを持っている）"""
+
+    def __init__(self, job_id, directory, total, done_rows, lock_file):
+        self.id = job_id
+        self.directory = directory
+        self.total = total
+        self.done_rows = done_rows
+        self.lock_file = lock_file
+        self.write_lock = threading.Lock()
+
+
+class JobManager:
+    """ジョブの作成・進捗管理と、行を処理するワーカー"""
+
+    def __init__(self, root, process_row, workers=2, max_rows=5000, retry_errors=(), retry_delay=5):
+        self.root = root
+        self.process_row = process_row  # 1行分の入力dictを受け取り、結果dictを返す
+        self.workers = workers
+        self.max_rows = max_rows
+        self.retry_errors = retry_errors  # この例外は失敗扱いにせず、待ってから同じ行をやり直す
+        self.retry_delay = retry_delay
+
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._started = False
+
+    @classmethod
+    def from_env(cls, process_row, **kwargs):
+        default_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs')
+        return cls(
+            os.getenv('BATCH_JOBS_DIR', default_root),
+            process_row,
+            workers=int(os.getenv('BATCH_WORKERS', 2)),
+            max_rows=int(os.getenv('BATCH_MAX_ROWS', 5000)),
+            **kwargs
+        )
+
+    # --- ワーカー ---
+
+    def start(self):
+        """ワーカーを起動し、未完了のジョブを再開する（2回目以降は何もしない）"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        os.makedirs(self.root, exist_ok=True)
+        for _ in range(self.workers):
+            threading.Thread(target=self._work, daemon=True, name='batch-worker').start()
+        for job_id in sorted(os.listdir(self.root)):
+            if JOB_ID_PATTERN.match(job_id):
+                self._resume(job_id)
+
+    def _work(self):
+        while True:
+            job, row = self._queue.get()
+            try:
+                self._process(job, row)
+            finally:
+                self._queue.task_done()
+
+    def _process(self, job, row):
+        while True:
+            try:
+                output = {'row': row['row'], **{k: row[k] for k in FIELDS}, **self.process_row(row)}
+                break
+            except self.retry_errors as e:
+                print(f"[BATCH] {job.id} row={row['row']} 再試行: {e}", flush=True)
+                time.sleep(self.retry_delay)
+            except Exception as e:
+                output = {'row': row['row'], **{k: row[k] for k in FIELDS}, 'error': str(e) or type(e).__name__}
+                break
+        self._append_result(job, output)
+
+    def _append_result(self, job, output):
+        with job.write_lock:
+            with open(os.path.join(job.directory, 'results.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(output, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            job.done_rows.add(output['row'])
+            finished = len(job.done_rows) >= job.total
+        if finished:
+            print(f"[BATCH] {job.id} 完了 ({job.total}件)", flush=True)
+            self._release(job)
+
+    def stats(self):
+        """待ち行列の行数と処理中のジョブ数"""
+        with self._lock:
+            active_jobs = len(self._jobs)
+        return {'queued_rows': self._queue.qsize(), 'active_jobs': active_jobs}
+
+    # --- ジョブの作成・再開 ---
+
+    def create(self, rows):
+        """ジョブを作成してキューに入れ、状態を返す"""
+        if not rows:
+            raise JobError("行がありません")
+        if len(rows) > self.max_rows:
+            raise JobError(f"1ジョブの上限は{self.max_rows}行です")
+        self.start()
+
+        job_id = uuid.uuid4().hex[:12]
+        directory = os.path.join(self.root, job_id)
+        os.makedirs(directory)
+        with open(os.path.join(directory, 'input.jsonl'), 'w', encoding='utf-8') as f:
+            for number, row in enumerate(rows):
+                f.write(json.dumps({'row': number, **row}, ensure_ascii=False) + '\n')
+        # job.jsonを最後に書く（これがあるジョブだけを有効とみなす）
+        self._write_json(os.path.join(directory, 'job.json'), {
+            'id': job_id,
+            'total': len(rows),
+            'created_at': time.time(),
+        })
+        self._resume(job_id)
+        return self.status(job_id)
+
+    def _resume(self, job_id):
+        """未処理の行をキューに入れる（他のプロセスが処理中ならスキップ）"""
+        directory = os.path.join(self.root, job_id)
+        meta = self._read_json(os.path.join(directory, 'job.json'))
+        if meta is None:
+            return
+        with self._lock:
+            if job_id in self._jobs:
+                return
+
+        lock_file = open(os.path.join(directory, 'lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return
+
+        # ロックを取ってから読む（直前まで他のプロセスが処理していた可能性がある）
+        done_rows = {result['row'] for result in self._read_results(directory)}
+        if len(done_rows) >= meta['total']:
+            lock_file.close()
+            return
+
+        # 書き込み途中で停止していた場合、次の結果が前の行とつながらないよう改行を補う
+        results_path = os.path.join(directory, 'results.jsonl')
+        if os.path.exists(results_path) and os.path.getsize(results_path):
+            with open(results_path, 'rb+') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+
+        job = _Job(job_id, directory, meta['total'], done_rows, lock_file)
+        with self._lock:
+            self._jobs[job_id] = job
+        pending = [row for row in self._read_jsonl(os.path.join(directory, 'input.jsonl'))
+                   if row['row'] not in done_rows]
+        print(f"[BATCH] {job_id} 開始: 残り{len(pending)}/{meta['total']}件", flush=True)
+        for row in pending:
+            self._queue.put((job, row))
+
+    def _release(self, job):
+        with self._lock:
+            self._jobs.pop(job.id, None)
+        fcntl.flock(job.lock_file, fcntl.LOCK_UN)
+        job.lock_file.close()
+
+    # --- 状態・結果 ---
+
+    def _directory(self, job_id):
+        if not JOB_ID_PATTERN.match(job_id or ''):
+            raise JobError("ジョブIDが不正です")
+        directory = os.path.join(self.root, job_id)
+        if not os.path.exists(os.path.join(directory, 'job.json')):
+            raise KeyError(job_id)
+        return directory
+
+    def status(self, job_id):
+        """ジョブの進捗（他のプロセスが処理中のジョブもファイルから読む）"""
+        directory = self._directory(job_id)
+        meta = self._read_json(os.path.join(directory, 'job.json'))
+        results = list(self._read_results(directory))
+        done = len({result['row'] for result in results})
+        failed = sum(1 for result in results if 'error' in result)
+        return {
+            'id': job_id,
+            'status': 'completed' if done >= meta['total'] else 'running',
+            'total': meta['total'],
+            'done': done,
+            'failed': failed,
+            'created_at': meta['created_at'],
+        }
+
+    def iter_results(self, job_id):
+        """処理済みの行をJSONLで1行ずつ返す"""
+        directory = self._directory(job_id)
+        for result in self._read_results(directory):
+            yield json.dumps(result, ensure_ascii=False) + '\n'
+
+    def _read_results(self, directory):
+        return self._read_jsonl(os.path.join(directory, 'results.jsonl'))
+
+    @staticmethod
+    def _read_jsonl(path):
+        if not os.path.exists(path):
+            return
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で停止した行は未処理として扱う
+                    continue
+
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    @staticmethod
+    def _write_json(path, data):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
@@ -0,0 +1,19 @@
+"""ベンチマーク共通の集計"""
+import statistics
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(int(round(p / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def summarize(values):
+    """中央値・p95・p99（値がなければNone）"""
+    if not values:
+        return None
+    return {
+        'p50': statistics.median(values),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+    }
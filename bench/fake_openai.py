@@ -0,0 +1,187 @@
+"""ベンチマーク用のOpenAIクライアントの代わり（APIを呼ばない）
+
+client.chat.completions.create() と同じ形で呼べるプロセス内のフェイク。
+番号付きの職務内容リストを返し、短い項目の割合や応答時間を設定できる。
+HTTPで同じ応答を返すサーバーは bench/fake_server.py。
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+# 項目は語句の組み合わせで作る（同じ文の繰り返しは近似重複として除外されるため）
+MARKETS = ["北米市場全域", "米国西海岸の拠点", "カナダ・米国地域", "中西部の工業地帯", "東海岸の主要都市圏", "テキサス州の拠点", "メキシコ国境地域", "シリコンバレー周辺"]
+TARGETS = ["新規の法人顧客", "既存の大口取引先", "現地の販売代理店", "大学病院・医療機関", "完成車メーカー", "大手小売チェーン", "3PL物流業者", "州政府・連邦機関"]
+METHODS = ["CRMの商談データを用いて", "現地チームと週次で連携し", "競合他社の価格動向を踏まえ", "FDAやEPAの規制要件に沿って", "KPIダッシュボードで可視化しながら", "日本本社の技術部門と協力し", "外部コンサルタントを活用して", "顧客アンケートの結果をもとに"]
+ACTIONS = ["営業戦略を立案", "価格交渉を実施", "販売実績を分析", "品質監査を計画", "契約条件を見直し", "需要予測を精緻化", "展示会出展を企画", "規制対応を推進"]
+GOALS = ["四半期売上目標の達成", "調達コストの削減", "顧客満足度の向上", "市場シェアの拡大", "納期遵守率の改善", "与信リスクの低減", "新製品の早期立ち上げ", "現地法人の収益改善"]
+
+
+class LatencyModel:
+    """応答時間のモデル（最初のトークンまでの時間は対数正規分布、以降は1トークンごとの一定時間）"""
+
+    def __init__(self, ttft_median=1.5, ttft_sigma=0.5, per_token=0.035, time_scale=1.0):
+        self.ttft_median = ttft_median
+        self.ttft_sigma = ttft_sigma
+        self.per_token = per_token
+        self.time_scale = time_scale  # 実時間を縮めてベンチマークを速く回すための係数
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds * self.time_scale)
+
+
+# プロンプトキャッシュの模擬（OpenAIと同じく、先頭1024トークン以上が一致すれば128トークン単位で再利用）
+PREFIX_CACHE_MIN = 1024
+PREFIX_CACHE_STEP = 128
+PREFIX_CACHE_SIZE = 4096
+
+
+def requested_count(messages, default=10):
+    """プロンプトの「◯件を番号付きリスト」から依頼件数を取り出す"""
+    text = messages[-1]['content'] if messages else ''
+    match = re.search(r'(\d+)件を番号付きリスト', text)
+    return int(match.group(1)) if match else default
+
+
+class FakeCompletions:
+    """chat.completions のフェイク"""
+
+    def __init__(self, short_rate=0.2, latency=None, seed=None, chunk_chars=1):
+        self.short_rate = short_rate
+        self.latency = latency or LatencyModel()
+        self.chunk_chars = chunk_chars  # 1トークンあたりの文字数の目安（日本語はおおよそ1文字1トークン）
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self._prefixes = OrderedDict()  # 先頭部分のハッシュ（最近使ったもの）
+
+    def _is_short(self):
+        with self._lock:
+            return self._rng.random() < self.short_rate
+
+    def _first_token(self):
+        with self._lock:
+            return self._rng.lognormvariate(0, self.latency.ttft_sigma) * self.latency.ttft_median
+
+    def _item(self, short):
+        with self._lock:
+            market, target, method, action, goal = (
+                self._rng.choice(words) for words in (MARKETS, TARGETS, METHODS, ACTIONS, GOALS))
+        if short:
+            return f"{target}向けに{action}"
+        return f"{market}の{target}を対象に、{method}{action}し、{goal}を図る"
+
+    def _content(self, count):
+        lines = []
+        for i in range(1, count + 1):
+            lines.append(f"{i}. {self._item(self._is_short())}")
+        return "\n".join(lines)
+
+    def _record(self, prompt_tokens=0, completion_tokens=0, calls=0, cached_tokens=0):
+        with self._lock:
+            self.calls += calls
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+            self.completion_tokens += completion_tokens
+
+    def _cached_prefix(self, messages):
+        """以前のプロンプトと先頭が一致するトークン数（1文字1トークンとして数える）"""
+        text = ''.join(f"<{m['role']}>{m['content']}" for m in messages or [])
+        boundaries = range(PREFIX_CACHE_MIN, len(text) + 1, PREFIX_CACHE_STEP)
+        digests = [hashlib.sha1(text[:end].encode('utf-8')).digest() for end in boundaries]
+        cached = 0
+        with self._lock:
+            for end, digest in zip(boundaries, digests):
+                if digest in self._prefixes:
+                    cached = end
+                    self._prefixes.move_to_end(digest)
+                self._prefixes[digest] = True
+            while len(self._prefixes) > PREFIX_CACHE_SIZE:
+                self._prefixes.popitem(last=False)
+        return cached
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'prompt_tokens': self.prompt_tokens,
+                'cached_tokens': self.cached_tokens,
+                'completion_tokens': self.completion_tokens,
+            }
+
+    def plan(self, messages, response_format=None):
+        """1回の呼び出しの応答を決める
+
+        (プロンプトのトークン数, うちキャッシュに当たった数, 応答のトークン列, 最初のトークンまでの秒数) を返す。
+        """
+        prompt_tokens = sum(len(m['content']) for m in messages or [])
+        cached_tokens = min(self._cached_prefix(messages), prompt_tokens)
+        self._record(prompt_tokens=prompt_tokens, calls=1, cached_tokens=cached_tokens)
+
+        if response_format:
+            content = json.dumps({"winner": "A", "score_a": 8, "score_b": 7, "reason": "fake"}, ensure_ascii=False)
+        else:
+            content = self._content(requested_count(messages))
+        tokens = [content[i:i + self.chunk_chars] for i in range(0, len(content), self.chunk_chars)]
+        return prompt_tokens, cached_tokens, tokens, self._first_token()
+
+    def reset(self):
+        """計測値を0に戻す（プロンプトキャッシュの内容は残す）"""
+        with self._lock:
+            self.calls = self.prompt_tokens = self.cached_tokens = self.completion_tokens = 0
+
+    def create(self, model=None, messages=None, stream=False, response_format=None, **kwargs):
+        prompt_tokens, cached_tokens, tokens, ttft = self.plan(messages, response_format)
+        content = ''.join(tokens)
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(tokens),
+                                total_tokens=prompt_tokens + len(tokens),
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens))
+
+        if stream:
+            return FakeStream(self, tokens, ttft, usage)
+
+        self.latency.sleep(ttft + self.latency.per_token * len(tokens))
+        self._record(completion_tokens=len(tokens))
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason='stop')], usage=usage)
+
+
+class FakeStream:
+    """ストリーミング応答のフェイク（close() 後はトークンを生成しない）"""
+
+    def __init__(self, completions, tokens, ttft, usage):
+        self._completions = completions
+        self._tokens = tokens
+        self._ttft = ttft
+        self._closed = False
+        self.usage = usage
+
+    def __iter__(self):
+        latency = self._completions.latency
+        latency.sleep(self._ttft)
+        for token in self._tokens:
+            if self._closed:
+                return
+            latency.sleep(latency.per_token)
+            self._completions._record(completion_tokens=1)
+            delta = SimpleNamespace(content=token)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=None)], usage=None)
+        yield SimpleNamespace(choices=[], usage=self.usage)
+
+    def close(self):
+        self._closed = True
+
+
+class FakeOpenAI:
+    """OpenAI(api_key=...) の代わり"""
+
+    def __init__(self, **kwargs):
+        self.chat = SimpleNamespace(completions=FakeCompletions(**kwargs))
@@ -0,0 +1,302 @@
+"""OpenAI Chat Completions APIのフェイクサーバー（負荷試験用、APIを呼ばない）
+
+アプリの OPENAI_BASE_URL をこのサーバーに向けると、実際のOpenAIの代わりに
+番号付きの職務内容リスト（評価ではJSON）を返す。応答時間・短い項目の割合・
+429（レート制限）と500（障害）の発生率・応答が止まる（stall）割合、ストリーミングの
+最初のトークンの後に止まる割合を設定できる。
+ストリーミング（stream=True）にも対応し、クライアントが途中で切断したら
+それ以降のトークンは生成しない。
+
+    python -m bench.fake_server --port 8001 --short-rate 0.2 --rate-limit-rate 0.05
+    python -m bench.fake_server --error-rate 0.1 --stall-rate 0.05 --stall-sec 30
+    python -m bench.fake_server --stream-stall-rate 0.05 --stall-sec 30
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake python app.py
+
+    GET  /stats        呼び出し回数・429/500の回数・止めた回数・トークン数
+    POST /stats/reset  カウンタを0に戻す
+    POST /faults       障害の設定を変える（{"error_rate": 1.0} で全呼び出しを500にするなど）
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_openai import FakeCompletions, LatencyModel  # noqa: E402
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """設定とカウンタを持つHTTPサーバー"""
+
+    daemon_threads = True
+
+    FAULTS = ('rate_limit_rate', 'error_rate', 'stall_rate', 'stall_seconds', 'stream_stall_rate')
+
+    def __init__(self, address, completions, rate_limit_rate=0.0, seed=None,
+                 error_rate=0.0, stall_rate=0.0, stall_seconds=30.0, stream_stall_rate=0.0):
+        super().__init__(address, FakeOpenAIHandler)
+        self.completions = completions
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate  # 応答を返す前に stall_seconds 秒止める割合（ハングの模擬）
+        self.stall_seconds = stall_seconds
+        self.stream_stall_rate = stream_stall_rate  # ストリーミングで最初のトークンの後に stall_seconds 秒止める割合
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.rate_limited = 0
+        self.errors = 0
+        self.stalls = 0
+        self.stream_stalls = 0
+        self.disconnects = 0
+
+    def handle_error(self, request, client_address):
+        # クライアントが切断した（ヘッジで使わなかった呼び出しなど）場合は表示しない
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def should_rate_limit(self):
+        with self._lock:
+            limited = self._rng.random() < self.rate_limit_rate
+            if limited:
+                self.rate_limited += 1
+            return limited
+
+    def should_fail(self):
+        with self._lock:
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            return failed
+
+    def stall(self):
+        """応答を止める秒数（止めなければ0）"""
+        with self._lock:
+            if self._rng.random() >= self.stall_rate:
+                return 0.0
+            self.stalls += 1
+            return self.stall_seconds
+
+    def stream_stall(self):
+        """ストリーミングを最初のトークンの後で止める秒数（止めなければ0）"""
+        with self._lock:
+            if self._rng.random() >= self.stream_stall_rate:
+                return 0.0
+            self.stream_stalls += 1
+            return self.stall_seconds
+
+    def set_faults(self, **faults):
+        with self._lock:
+            for name, value in faults.items():
+                if name in self.FAULTS and value is not None:
+                    setattr(self, name, float(value))
+            return {name: getattr(self, name) for name in self.FAULTS}
+
+    def count_disconnect(self):
+        with self._lock:
+            self.disconnects += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.completions.stats(),
+                'rate_limited': self.rate_limited,
+                'errors': self.errors,
+                'stalls': self.stalls,
+                'stream_stalls': self.stream_stalls,
+                'disconnects': self.disconnects,
+            }
+
+    def reset(self):
+        with self._lock:
+            self.rate_limited = 0
+            self.errors = 0
+            self.stalls = 0
+            self.stream_stalls = 0
+            self.disconnects = 0
+        self.completions.reset()
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # 1リクエストごとのアクセスログは出さない
+        pass
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, self.server.stats())
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        if self.path == '/stats/reset':
+            self.server.reset()
+            self._send_json(200, {'success': True})
+            return
+        if self.path == '/faults':
+            self._send_json(200, self.server.set_faults(**body))
+            return
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+
+        if self.server.should_rate_limit():
+            self._send_json(429, {'error': {
+                'message': 'Rate limit reached (fake)',
+                'type': 'requests',
+                'code': 'rate_limit_exceeded',
+            }}, headers={'Retry-After': '1'})
+            return
+        if self.server.should_fail():
+            self._send_json(500, {'error': {
+                'message': 'The server had an error while processing your request (fake)',
+                'type': 'server_error',
+            }})
+            return
+
+        completions = self.server.completions
+        # 応答を止める（接続したまま何も返さない）
+        completions.latency.sleep(self.server.stall())
+        prompt_tokens, cached_tokens, tokens, ttft = completions.plan(body.get('messages'), body.get('response_format'))
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': len(tokens),
+            'total_tokens': prompt_tokens + len(tokens),
+            'prompt_tokens_details': {'cached_tokens': cached_tokens},
+        }
+        completion_id = f"chatcmpl-fake-{uuid.uuid4().hex[:12]}"
+        model = body.get('model', 'fake')
+
+        if body.get('stream'):
+            self._stream(completion_id, model, tokens, ttft, usage,
+                         include_usage=(body.get('stream_options') or {}).get('include_usage'))
+            return
+
+        completions.latency.sleep(ttft + completions.latency.per_token * len(tokens))
+        completions._record(completion_tokens=len(tokens))
+        self._send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': ''.join(tokens)},
+                'finish_reason': 'stop',
+            }],
+            'usage': usage,
+        })
+
+    def _stream(self, completion_id, model, tokens, ttft, usage, include_usage):
+        """Server-Sent Eventsで1トークンずつ送る（切断されたら打ち切る）"""
+        completions = self.server.completions
+        latency = completions.latency
+
+        def chunk(choices, usage=None):
+            data = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': choices,
+            }
+            if include_usage:
+                data['usage'] = usage
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        try:
+            latency.sleep(ttft)
+            for i, token in enumerate(tokens):
+                latency.sleep(latency.per_token)
+                self.wfile.write(chunk([{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]))
+                self.wfile.flush()
+                completions._record(completion_tokens=1)
+                if i == 0:
+                    # 最初のトークンの後に止まる（接続したまま何も送らない）
+                    latency.sleep(self.server.stream_stall())
+            self.wfile.write(chunk([{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))
+            if include_usage:
+                self.wfile.write(chunk([], usage))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントがストリームを閉じた（必要な件数が揃った）
+            self.server.count_disconnect()
+
+
+def serve(port=0, host='127.0.0.1', short_rate=0.2, rate_limit_rate=0.0, latency=None, seed=None,
+          error_rate=0.0, stall_rate=0.0, stall_seconds=30.0, stream_stall_rate=0.0):
+    """別スレッドでサーバーを起動して返す（port=0なら空いているポート）"""
+    completions = FakeCompletions(short_rate=short_rate, latency=latency or LatencyModel(), seed=seed)
+    server = FakeOpenAIServer((host, port), completions, rate_limit_rate=rate_limit_rate, seed=seed,
+                              error_rate=error_rate, stall_rate=stall_rate, stall_seconds=stall_seconds,
+                              stream_stall_rate=stream_stall_rate)
+    threading.Thread(target=server.serve_forever, daemon=True, name='fake-openai').start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='OpenAI Chat Completions APIのフェイクサーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--short-rate', type=float, default=0.2, help='50文字未満の項目を返す割合')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='429を返す割合')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='500を返す割合')
+    parser.add_argument('--stall-rate', type=float, default=0.0, help='応答を止める割合')
+    parser.add_argument('--stream-stall-rate', type=float, default=0.0, help='ストリーミングを最初のトークンの後で止める割合')
+    parser.add_argument('--stall-sec', type=float, default=30.0, help='応答を止める秒数（--time-scale で縮む）')
+    parser.add_argument('--ttft', type=float, default=1.5, help='最初のトークンまでの時間の中央値（秒）')
+    parser.add_argument('--ttft-sigma', type=float, default=0.5, help='最初のトークンまでの時間のばらつき（対数正規分布のσ）')
+    parser.add_argument('--per-token', type=float, default=0.035, help='1トークンあたりの生成時間（秒）')
+    parser.add_argument('--time-scale', type=float, default=1.0, help='待ち時間の縮小率')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    latency = LatencyModel(ttft_median=args.ttft, ttft_sigma=args.ttft_sigma,
+                           per_token=args.per_token, time_scale=args.time_scale)
+    server = serve(args.port, args.host, args.short_rate, args.rate_limit_rate, latency, args.seed,
+                   args.error_rate, args.stall_rate, args.stall_sec, args.stream_stall_rate)
+    print(f"フェイクOpenAIサーバー: OPENAI_BASE_URL={server.base_url}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""負荷試験（フェイクのOpenAIサーバーに向けたアプリに同時リクエストを送る）
+
+フェイクサーバー（bench/fake_server.py）を起動し、OPENAI_BASE_URL をそこに向けた
+アプリをサブプロセスで起動してから、指定したエンドポイントに指定した同時実行数で
+リクエストを送る。スループット・レイテンシ（p50/p95/p99）・1リクエストあたりの
+OpenAI呼び出し回数・アプリのプロセスのメモリ使用量（RSS）を表示する。
+
+    python -m bench.load --endpoints search compare --concurrency 8 --requests 40
+    python -m bench.load --unique                      # 毎回OpenAIを呼ぶ（キャッシュ・相乗りなし）
+    python -m bench.load --time-scale 0.1 --short-rate 0.3 --rate-limit-rate 0.05
+    python -m bench.load --command "gunicorn -c gunicorn.conf.py wsgi:app"  # 本番と同じ構成
+    python -m bench.load --url http://127.0.0.1:5000 --fake-port 8001  # 起動済みのアプリに送る
+
+レイテンシは実時間（--time-scale でOpenAIの応答時間だけを縮めた状態）で表示する。
+"""
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.common import summarize  # noqa: E402
+from bench.fake_openai import LatencyModel  # noqa: E402
+from bench.fake_server import serve  # noqa: E402
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = {
+    'search': '/api/search',
+    'generate': '/api/generate',
+    'compare': '/api/compare',
+}
+
+# 送信する入力（キャッシュを使う場合も複数の条件に分散させる）
+CASES = [
+    {'position': '部長', 'industry': '製薬', 'department': '営業', 'area': ''},
+    {'position': 'マネージャー', 'industry': '自動車', 'department': '人事', 'area': '採用'},
+    {'position': 'スタッフ', 'industry': '物流', 'department': '財務', 'area': ''},
+    {'position': 'ディレクター', 'industry': '食品', 'department': 'マーケティング', 'area': 'ブランド'},
+    {'position': '担当', 'industry': '半導体', 'department': '品質管理', 'area': ''},
+    {'position': '課長', 'industry': '商社', 'department': '調達', 'area': '北米'},
+]
+
+
+def http_json(method, url, data=None, timeout=300):
+    """JSONを送ってJSONを受け取る（HTTPエラーも (status, body) で返す）"""
+    body = json.dumps(data).encode('utf-8') if data is not None else None
+    request = urllib.request.Request(url, data=body, method=method, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b'null')
+    except urllib.error.HTTPError as e:
+        try:
+            return e.code, json.loads(e.read() or b'null')
+        except ValueError:
+            return e.code, None
+
+
+def process_tree(pid):
+    """pid とその子孫のプロセスID"""
+    pids = [pid]
+    for current in pids:
+        try:
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def _proc_fields(path):
+    with open(path) as f:
+        return {key: int(value.split()[0]) / 1024 for key, value in
+                (line.split(':', 1) for line in f if ':' in line) if value.strip().endswith('kB')}
+
+
+def memory_mb(pid):
+    """プロセスごとの (RSS, 最大RSS, PSS) をMBで返す（Linuxの/procを読む）
+
+    PSSは共有ページを共有しているプロセス数で割った値。gunicornのワーカーが
+    fork前に読み込んだデータを共有できていれば、RSSよりかなり小さくなる。
+    """
+    result = {}
+    for child in process_tree(pid):
+        try:
+            status = _proc_fields(f'/proc/{child}/status')
+        except OSError:
+            continue
+        try:
+            pss = _proc_fields(f'/proc/{child}/smaps_rollup').get('Pss')
+        except OSError:
+            pss = None
+        result[child] = (status.get('VmRSS', 0), status.get('VmHWM', 0), pss)
+    return result
+
+
+def start_app(port, base_url, command, env_overrides):
+    """アプリをサブプロセスで起動し、応答するまで待つ"""
+    workdir = tempfile.mkdtemp(prefix='bench-load-')
+    env = {
+        **os.environ,
+        'PORT': str(port),
+        'OPENAI_BASE_URL': base_url,
+        'OPENAI_API_KEY': 'fake',
+        'LLM_CACHE_PATH': os.path.join(workdir, 'llm_cache.sqlite3'),
+        'BATCH_JOBS_DIR': os.path.join(workdir, 'jobs'),
+        **env_overrides,
+    }
+    log = open(os.path.join(workdir, 'app.log'), 'w')
+    process = subprocess.Popen(command, cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"アプリが終了しました（ログ: {log.name}）")
+        try:
+            urllib.request.urlopen(url + '/', timeout=1).close()
+            return process, url, log.name
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"アプリが起動しません（ログ: {log.name}）")
+
+
+def run_endpoint(url, name, cases, args):
+    """1エンドポイント分の負荷をかけ、(経過秒, [(レイテンシ, ステータス)]) を返す"""
+    payloads = itertools.cycle(cases)
+    lock = threading.Lock()
+
+    def one(number):
+        with lock:
+            payload = {**next(payloads), 'no_cache': args.no_cache}
+        if args.unique:
+            # 担当領域を変えて、キャッシュにも実行中の同じ生成への相乗りにも当たらないようにする
+            payload['area'] = f"{payload['area']}{name}{number}"
+        started = time.monotonic()
+        status, _ = http_json('POST', url + ENDPOINTS[name], payload)
+        return time.monotonic() - started, status
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(one, range(args.requests)))
+    return time.monotonic() - started, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='フェイクのOpenAIサーバーを使った負荷試験')
+    parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS), default=['search', 'compare'])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=32, help='エンドポイントごとのリクエスト数')
+    parser.add_argument('--no-cache', action='store_true', help='キャッシュを読まない（no_cache=true で送る）')
+    parser.add_argument('--unique', action='store_true',
+                        help='リクエストごとに入力を変える（キャッシュ・相乗りを使わず毎回OpenAIを呼ぶ）')
+    parser.add_argument('--url', help='起動済みのアプリのURL（省略時はサブプロセスで起動する）')
+    parser.add_argument('--port', type=int, default=5055, help='アプリを起動するポート')
+    parser.add_argument('--command', default=f'{sys.executable} app.py', help='アプリの起動コマンド')
+    parser.add_argument('--env', nargs='*', default=[], metavar='KEY=VALUE', help='アプリに渡す環境変数')
+    parser.add_argument('--fake-port', type=int, default=0, help='フェイクサーバーのポート（0なら空いているポート）')
+    parser.add_argument('--short-rate', type=float, default=0.2)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='フェイクサーバーが429を返す割合')
+    parser.add_argument('--ttft', type=float, default=1.5)
+    parser.add_argument('--ttft-sigma', type=float, default=0.5)
+    parser.add_argument('--per-token', type=float, default=0.035)
+    parser.add_argument('--time-scale', type=float, default=0.1, help='OpenAIの応答時間の縮小率')
+    args = parser.parse_args(argv)
+
+    latency = LatencyModel(ttft_median=args.ttft, ttft_sigma=args.ttft_sigma,
+                           per_token=args.per_token, time_scale=args.time_scale)
+    fake = serve(args.fake_port, short_rate=args.short_rate, rate_limit_rate=args.rate_limit_rate,
+                 latency=latency, seed=42)
+    print(f"フェイクOpenAIサーバー: {fake.base_url}", flush=True)
+
+    process = None
+    url = args.url
+    if not url:
+        overrides = dict(item.split('=', 1) for item in args.env)
+        process, url, log_path = start_app(args.port, fake.base_url, args.command.split(), overrides)
+        print(f"アプリ: {url}（pid {process.pid}, ログ {log_path}）", flush=True)
+
+    try:
+        # 初回リクエストでデータを読み込むので、計測前に1回送っておく
+        http_json('POST', url + ENDPOINTS['search'], {**CASES[0], 'no_cache': True})
+
+        print(f"{'endpoint':<9} {'ok':>4} {'err':>4} {'req/s':>7} {'p50(s)':>7} {'p95(s)':>7} {'p99(s)':>7} "
+              f"{'llm/req':>7} {'429':>4}")
+        for name in args.endpoints:
+            fake.reset()
+            elapsed, results = run_endpoint(url, name, CASES, args)
+            stats = fake.stats()
+            ok = [seconds for seconds, status in results if status == 200]
+            summary = summarize(ok) or {'p50': 0, 'p95': 0, 'p99': 0}
+            errors = {}
+            for _, status in results:
+                if status != 200:
+                    errors[status] = errors.get(status, 0) + 1
+            print(f"{name:<9} {len(ok):>4} {len(results) - len(ok):>4} {len(results) / elapsed:>7.2f} "
+                  f"{summary['p50']:>7.2f} {summary['p95']:>7.2f} {summary['p99']:>7.2f} "
+                  f"{stats['calls'] / len(results):>7.2f} {stats['rate_limited']:>4}"
+                  + (f"  エラー: {errors}" if errors else ''))
+
+        if process:
+            print("メモリ（MB）:")
+            for pid, (rss, peak, pss) in memory_mb(process.pid).items():
+                print(f"  pid {pid}: RSS {rss:.0f} / 最大 {peak:.0f}"
+                      + (f" / PSS {pss:.0f}" if pss is not None else ''))
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+        fake.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
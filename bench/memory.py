@@ -0,0 +1,88 @@
+"""サンプルデータのメモリ使用量と絞り込みの速さ
+
+データ（df）の列ごとのメモリ・カテゴリ列インデックスのメモリ・読み込み後のRSSと、
+業界・部門での絞り込み（get_similar_samples / search_database の検索部分）の時間を表示する。
+
+    python -m bench.memory
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.common import summarize  # noqa: E402
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='サンプルデータのメモリ使用量と絞り込みの速さ')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    import app  # noqa: E402（読み込み前のRSSを測るため、ここでimportする）
+    from data_state import DataState, Synonyms
+    from dataset import load_dataset
+    from search_index import CategoryIndex
+    devnull = open(os.devnull, 'w')
+    stdout = sys.stdout
+
+    before = rss_mb()
+    tracemalloc.start()
+    sys.stdout = devnull
+    try:
+        started = time.perf_counter()
+        df = load_dataset()
+        load_seconds = time.perf_counter() - started
+        after_df = tracemalloc.get_traced_memory()[0]
+        search_index = CategoryIndex(df, app.INDEXED_COLUMNS)
+        after_index = tracemalloc.get_traced_memory()[0]
+        # 類似検索・重複検出のインデックスは使わない（絞り込みだけを測る）
+        app.data_store.current = DataState(df, search_index, None, None, Synonyms.load(), (), 1)
+    finally:
+        sys.stdout = stdout
+    tracemalloc.stop()
+
+    print(f"行数: {len(df)}  読み込み: {load_seconds * 1000:.0f} ms  RSS増加: {rss_mb() - before:.1f} MB")
+    print("列ごとのメモリ（deep）:")
+    for column, size in df.memory_usage(deep=True).items():
+        dtype = df[column].dtype if column in df.columns else ''
+        print(f"  {str(column):<8} {size / 1024 / 1024:>7.2f} MB  {dtype}")
+    print(f"  合計     {df.memory_usage(deep=True).sum() / 1024 / 1024:>7.2f} MB")
+    print(f"読み込みで確保したPythonのメモリ（tracemalloc）: {after_df / 1024 / 1024:.2f} MB")
+    print(f"カテゴリ列インデックス: {(after_index - after_df) / 1024 / 1024:.2f} MB")
+
+    cases = [('医薬品', '営業'), ('自動車', ''), ('', '人事'), ('物流', '財務'), ('半導体', '倉庫')]
+    filters = {
+        '業界 OR 部門': lambda i, d: app.select_rows(
+            search_index.match("業界", i) | search_index.match("部門", d)),
+        'ポジション AND 業界 AND 部門': lambda i, d: app.select_rows(
+            search_index.match("ポジション", "管理職") & search_index.match("業界", i)
+            & search_index.match("部門", d)),
+        '職務内容を取り出す': lambda i, d: app.take_texts(app.select_rows(
+            search_index.match("業界", i))[:10]),
+    }
+    print(f"{'filter':<28} {'p50(us)':>9} {'p95(us)':>9}")
+    for name, fn in filters.items():
+        timings = []
+        for industry, department in cases:
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                fn(industry, department)
+                timings.append((time.perf_counter() - started) * 1e6)
+        summary = summarize(timings)
+        print(f"{name:<28} {summary['p50']:>9.1f} {summary['p95']:>9.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""検索・正規化のマイクロベンチマーク（OpenAIは呼ばない）
+
+get_similar_samples（keyword / semantic）・search_database・infer_position_category・
+ローカルの自動評価（local_evaluate_patterns）・参考サンプルの写しの判定を
+代表的な入力で繰り返し呼び、1回あたりの時間（中央値・p95）を表示する。
+--save で結果を保存し、--baseline で保存した結果との比を表示すると、変更による劣化を確認できる。
+
+    python -m bench.micro
+    python -m bench.micro --save bench/baseline.json
+    python -m bench.micro --baseline bench/baseline.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+import dedupe  # noqa: E402
+from bench.common import summarize  # noqa: E402
+
+INDUSTRIES = ['製薬', '自動車', '物流', '半導体', '']
+DEPARTMENTS = ['営業', '人事', '開発', '倉庫', '']
+POSITIONS = ['部長', 'マネージャー', 'スタッフ', 'Vice President', 'エンジニア', '']
+
+
+def case_inputs():
+    return [(industry, department) for industry in INDUSTRIES for department in DEPARTMENTS]
+
+
+def benchmarks():
+    """ベンチマーク名 → 入力を1つずつ処理する関数のリスト"""
+    cases = case_inputs()
+    result = {
+        'get_similar_samples[keyword]': [
+            (lambda i=i, d=d: app.get_similar_samples(i, d, 5, 'keyword')) for i, d in cases],
+        'search_database': [
+            (lambda p=p, i=i, d=d: app.search_database(p, i, d)) for p in POSITIONS[:3] for i, d in cases],
+        'infer_position_category': [
+            (lambda p=p: app.infer_position_category(p)) for p in POSITIONS],
+        'normalize_industry+department': [
+            (lambda i=i, d=d: (app.normalize_industry(i), app.normalize_department(d))) for i, d in cases],
+        'local_evaluate_patterns': [
+            (lambda i=i, d=d: app.local_evaluate_patterns(
+                i, d, '', app.get_similar_samples(i, d, 10, 'keyword'), app.get_random_samples(10)))
+            for i, d in cases],
+        'signature+check_reference_copy': [
+            (lambda t=t: app.check_reference_copy(t, dedupe.signature(t))) for t in app.get_random_samples(25)],
+    }
+    if app.current_data().semantic_index is not None:
+        result['get_similar_samples[semantic]'] = [
+            (lambda i=i, d=d: app.get_similar_samples(i, d, 5, 'semantic')) for i, d in cases]
+    return result
+
+
+def measure(calls, repeat):
+    """各入力を repeat 回ずつ呼び、1回あたりの時間（マイクロ秒）のリストを返す"""
+    timings = []
+    for call in calls:
+        call()  # 初回の遅延（キャッシュ・遅延初期化）を除く
+        for _ in range(repeat):
+            started = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - started) * 1e6)
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='検索・正規化のマイクロベンチマーク')
+    parser.add_argument('--repeat', type=int, default=20, help='入力ごとの繰り返し回数')
+    parser.add_argument('--save', help='結果をJSONで保存する')
+    parser.add_argument('--baseline', help='保存した結果と比較する')
+    args = parser.parse_args(argv)
+
+    # データの読み込みのみ（OpenAIのクライアントは作らない）
+    devnull = open(os.devnull, 'w')
+    stdout = sys.stdout
+    sys.stdout = devnull
+    try:
+        app.load_data()
+    finally:
+        sys.stdout = stdout
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    results = {}
+    print(f"{'benchmark':<32} {'p50(us)':>10} {'p95(us)':>10} {'vs base':>8}")
+    for name, calls in benchmarks().items():
+        sys.stdout = devnull  # 関数内のデバッグ出力を抑える
+        try:
+            summary = summarize(measure(calls, args.repeat))
+        finally:
+            sys.stdout = stdout
+        results[name] = summary
+        ratio = ''
+        if name in baseline:
+            ratio = f"{summary['p50'] / baseline[name]['p50']:.2f}x"
+        print(f"{name:<32} {summary['p50']:>10.1f} {summary['p95']:>10.1f} {ratio:>8}")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"保存しました: {args.save}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""プロンプトの確認（ゴールデンファイルとの比較と、フェイクのOpenAIでのトークン数）
+
+1. 固定の入力で組み立てたプロンプトを bench/golden/prompts.json と比べる。
+   prompts.py を変更したら差分を確認し、意図どおりなら --update で書き換える
+   （あわせて app.py の PROMPT_VERSION を上げる）。
+2. 同じ入力でフェイクのOpenAIクライアント（bench/fake_openai.py）に生成させ、
+   送信前の見積もりと usage のトークン数、プロンプトキャッシュに当たったトークン数を表示する。
+
+    python -m bench.prompts
+    python -m bench.prompts --update
+"""
+import argparse
+import difflib
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+import prompts  # noqa: E402
+from bench.fake_openai import FakeOpenAI, LatencyModel  # noqa: E402
+from llm_limiter import RateLimiter  # noqa: E402
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden', 'prompts.json')
+
+SAMPLES = [
+    "北米市場における医療機関向けの営業戦略を立案し、主要顧客との関係構築を通じて売上目標の達成を図る",
+    "北米市場における医療機関向けの営業戦略を立案し、主要顧客との関係構築を通じて売上目標の達成を図る。",
+    "FDA規制に準拠した製品情報の提供と、医師・薬剤師向けの学術説明会の企画・運営を担当",
+    "現地販売代理店の選定・契約交渉と、代理店の販売実績のモニタリングおよび改善指導を実施",
+    "競合製品の価格動向と市場シェアを分析し、" + "四半期ごとの価格戦略と販促施策の見直しを行い、" * 4 + "収益性の改善を推進",
+    "CRMデータを活用した顧客セグメント別の営業活動計画の策定と、営業チームのKPI管理に関与",
+]
+
+CASES = [
+    {'name': 'reference', 'position': 'マネージャー', 'industry': '製薬', 'department': '営業', 'area': '', 'samples': SAMPLES},
+    {'name': 'area', 'position': '担当', 'industry': '自動車', 'department': '品質管理', 'area': '北米工場', 'samples': SAMPLES[2:]},
+    {'name': 'no_samples', 'position': '部長', 'industry': '物流', 'department': '財務', 'area': '', 'samples': []},
+]
+
+
+def render_cases():
+    """ケースごとの生成用・評価用メッセージ"""
+    rendered = {}
+    for case in CASES:
+        args = (case['position'], case['industry'], case['department'], case['area'])
+        rendered[case['name']] = {
+            'generation': app._build_generation_messages(*args, case['samples'], 5, 10),
+            'retry': app._build_generation_messages(*args, case['samples'], 5, 3),
+            'evaluation': prompts.evaluation_messages(*args, SAMPLES[:3], SAMPLES[3:]),
+        }
+    return rendered
+
+
+def check_golden(rendered, update):
+    """ゴールデンファイルと比較（--update なら書き換える）。一致すれば True"""
+    if update or not os.path.exists(GOLDEN_PATH):
+        os.makedirs(os.path.dirname(GOLDEN_PATH), exist_ok=True)
+        with open(GOLDEN_PATH, 'w', encoding='utf-8') as f:
+            json.dump(rendered, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        print(f"ゴールデンファイルを書き出しました: {GOLDEN_PATH}")
+        return True
+
+    with open(GOLDEN_PATH, encoding='utf-8') as f:
+        golden = json.load(f)
+    expected = json.dumps(golden, ensure_ascii=False, indent=2).splitlines()
+    actual = json.dumps(rendered, ensure_ascii=False, indent=2).splitlines()
+    if expected == actual:
+        print("ゴールデンファイルと一致しました")
+        return True
+    print("ゴールデンファイルと異なります（意図した変更なら --update）:")
+    for line in difflib.unified_diff(expected, actual, 'golden', 'current', lineterm='', n=1):
+        print(f"  {line}")
+    return False
+
+
+def measure_tokens(repeat):
+    """フェイクのOpenAIで各ケースを repeat 回生成し、トークン数を表示する"""
+    fake = FakeOpenAI(short_rate=0.2, latency=LatencyModel(time_scale=0), seed=42)
+    app.client = fake
+    app.llm_limiter = RateLimiter(max_concurrent=4, rpm=1e12, tpm=1e12, max_queue=4)
+    completions = fake.chat.completions
+    devnull = open(os.devnull, 'w')
+
+    print(f"{'case':<12} {'estimate':>8} {'calls':>5} {'prompt/call':>11} {'cached/call':>11} {'cached%':>7}")
+    for case in CASES:
+        args = (case['position'], case['industry'], case['department'], case['area'], case['samples'])
+        # 送信前の見積もり（1回目の呼び出しのプロンプト）
+        estimate = app.estimate_tokens(app._build_generation_messages(*args, 5, 10))
+        completions.reset()
+        stdout = sys.stdout
+        sys.stdout = devnull
+        try:
+            for _ in range(repeat):
+                app.generate_job_descriptions(*args, 5)
+        finally:
+            sys.stdout = stdout
+        stats = completions.stats()
+        calls = max(stats['calls'], 1)
+        print(f"{case['name']:<12} {estimate:>8} {stats['calls']:>5} {stats['prompt_tokens'] / calls:>11.0f} "
+              f"{stats['cached_tokens'] / calls:>11.0f} {stats['cached_tokens'] / max(stats['prompt_tokens'], 1):>7.0%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='プロンプトのゴールデンファイル比較とトークン数')
+    parser.add_argument('--update', action='store_true', help='ゴールデンファイルを書き換える')
+    parser.add_argument('--repeat', type=int, default=5, help='ケースごとの生成回数')
+    args = parser.parse_args(argv)
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        app.load_data()
+        rendered = render_cases()
+    finally:
+        sys.stdout = stdout
+    ok = check_golden(rendered, args.update)
+    measure_tokens(args.repeat)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
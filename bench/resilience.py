@@ -0,0 +1,137 @@
+"""OpenAI呼び出しの通信層（llm_transport.py）の確認
+
+フェイクのOpenAIサーバー（bench/fake_server.py）に障害を起こさせ、実際のHTTPクライアント
+（接続プール・タイムアウト）を通して次の2つを計測する。
+
+1. 遅延: 一部の呼び出しの応答を止め（--stall-rate）、ヘッジあり・なしで生成のレイテンシを比べる
+2. 障害: 全呼び出しを500にして /api/search と同じ処理を続けて呼び、サーキットブレーカーが開いて
+   すぐに返す（データベースの検索結果で代替する）まで・障害が直ってから戻るまでを表示する
+
+    python -m bench.resilience
+    python -m bench.resilience --stall-rate 0.1 --requests 200 --time-scale 0.05
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+import llm_transport  # noqa: E402
+from bench.common import summarize  # noqa: E402
+from bench.fake_openai import LatencyModel  # noqa: E402
+from bench.fake_server import serve  # noqa: E402
+from llm_limiter import RateLimiter  # noqa: E402
+from llm_transport import CircuitBreaker, Transport  # noqa: E402
+from openai import OpenAI  # noqa: E402
+
+
+def report(line):
+    """結果の表示（アプリのデバッグ出力は抑えている）"""
+    print(line, file=sys.__stdout__, flush=True)
+
+
+def use_transport(fake, args, hedge_budget):
+    """アプリの通信層とクライアントを差し替える"""
+    app.llm = Transport(
+        call_timeout=args.call_timeout,
+        hedge_budget=hedge_budget,
+        breaker=CircuitBreaker(min_calls=args.breaker_min_calls, window=args.breaker_window,
+                               open_seconds=args.breaker_open),
+    )
+    app.client = OpenAI(base_url=fake.base_url, api_key='fake', **app.llm.client_options())
+
+
+def search(number):
+    """/api/search と同じ処理（キャッシュを使わず毎回生成する）。(秒, source) を返す"""
+    llm_transport.set_deadline(app.LLM_REQUEST_BUDGET_SEC)
+    started = time.monotonic()
+    try:
+        source, _ = app.generate_or_fallback('マネージャー', '自動車', '営業', f'領域{number}', bypass_cache=True)
+    except Exception as e:
+        source = type(e).__name__
+    return time.monotonic() - started, source
+
+
+def run_tail(fake, args):
+    report(f"[遅延] 応答を止める割合 {args.stall_rate:.0%}（{args.stall_sec:.0f}秒）、{args.requests}リクエスト")
+    report(f"{'hedge':<6} {'p50(s)':>7} {'p95(s)':>7} {'p99(s)':>7} {'calls/req':>9} {'hedges':>6} {'wins':>5} {'stalls':>6}")
+    for hedge_budget in (0.0, args.hedge_budget):
+        use_transport(fake, args, hedge_budget)
+        # 応答時間の分布（p90）を覚えさせてから計測する
+        fake.set_faults(stall_rate=0.0)
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(search, range(-30, 0)))
+        fake.set_faults(stall_rate=args.stall_rate)
+        fake.reset()
+        calls_before = app.llm.stats()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(search, range(args.requests)))
+        stats = app.llm.stats()
+        summary = summarize([seconds / args.time_scale for seconds, _ in results])
+        report(f"{'on' if hedge_budget else 'off':<6} {summary['p50']:>7.2f} {summary['p95']:>7.2f} {summary['p99']:>7.2f} "
+               f"{fake.stats()['calls'] / args.requests:>9.2f} {stats['hedges'] - calls_before['hedges']:>6} "
+               f"{stats['hedge_wins'] - calls_before['hedge_wins']:>5} {fake.stats()['stalls']:>6}")
+    fake.set_faults(stall_rate=0.0)
+
+
+def run_outage(fake, args):
+    report(f"\n[障害] 全呼び出しを500に → {args.outage_requests}リクエスト → 復旧")
+    use_transport(fake, args, args.hedge_budget)
+    report(f"{'phase':<9} {'req':>4} {'p50(s)':>7} {'max(s)':>7} {'upstream':>8} {'source':<30} {'breaker'}")
+
+    def phase(name, count):
+        fake.reset()
+        results = [search(number) for number in range(count)]
+        sources = {}
+        for _, source in results:
+            sources[source] = sources.get(source, 0) + 1
+        seconds = [s for s, _ in results]
+        stats = fake.stats()
+        state = CircuitBreaker.STATES[app.llm.stats()['breaker_state']]
+        report(f"{name:<9} {count:>4} {summarize(seconds)['p50']:>7.3f} {max(seconds):>7.3f} "
+               f"{stats['calls'] + stats['errors']:>8} {str(sources):<30} {state}")
+
+    fake.set_faults(error_rate=1.0)
+    phase('outage', args.outage_requests)
+    fake.set_faults(error_rate=0.0)
+    phase('recovery', 3)
+    time.sleep(args.breaker_open)
+    phase('closed', 3)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ヘッジ・サーキットブレーカーの確認')
+    parser.add_argument('--requests', type=int, default=100, help='遅延の計測のリクエスト数')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--stall-rate', type=float, default=0.05, help='応答を止める割合')
+    parser.add_argument('--stall-sec', type=float, default=20.0, help='応答を止める秒数')
+    parser.add_argument('--hedge-budget', type=float, default=0.1)
+    parser.add_argument('--call-timeout', type=float, default=10.0, help='1回の呼び出しのタイムアウト（実時間の秒）')
+    parser.add_argument('--outage-requests', type=int, default=20)
+    parser.add_argument('--breaker-min-calls', type=int, default=5)
+    parser.add_argument('--breaker-window', type=float, default=30.0)
+    parser.add_argument('--breaker-open', type=float, default=2.0)
+    parser.add_argument('--time-scale', type=float, default=0.1, help='フェイクの応答時間の縮小率')
+    args = parser.parse_args(argv)
+
+    latency = LatencyModel(time_scale=args.time_scale)
+    fake = serve(short_rate=0.2, latency=latency, seed=42, stall_seconds=args.stall_sec)
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        app.load_data()
+        app.llm_limiter = RateLimiter(max_concurrent=args.concurrency * 2, rpm=1e12, tpm=1e12, max_queue=args.concurrency * 2)
+        run_tail(fake, args)
+        run_outage(fake, args)
+    finally:
+        sys.stdout = stdout
+        fake.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""生成戦略（generation_strategies.py）のベンチマーク
+
+フェイクのOpenAIクライアントで、短い項目の割合ごとに各戦略の
+レイテンシ（p50/p95）・API呼び出し回数・トークン数を比較する。
+
+    python -m bench.strategies
+    python -m bench.strategies --short-rates 0.1 0.3 0.5 --trials 200 --time-scale 0.02
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+import generation_strategies  # noqa: E402
+from bench.common import percentile  # noqa: E402
+from bench.fake_openai import FakeOpenAI, LatencyModel  # noqa: E402
+from llm_limiter import BoundedExecutor, RateLimiter  # noqa: E402
+
+
+def run_trial(strategy, args, time_scale, executor):
+    def fetch(count, deadline):
+        return app._stream_job_descriptions_raw('マネージャー', '自動車', '営業', '', None, 5, count, deadline)
+
+    started = time.monotonic()
+    items = list(generation_strategies.run(
+        strategy, fetch, target=10, min_chars=50, max_calls=5,
+        budget=args.budget * time_scale,
+        overrequest_factor=args.overrequest_factor,
+        hedge_delay=args.hedge_delay * time_scale,
+        max_parallel=args.max_parallel,
+        executor=executor,
+    ))
+    elapsed = (time.monotonic() - started) / time_scale
+    short = sum(1 for item in items if len(item) < 50)
+    return elapsed, short
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='生成戦略のベンチマーク')
+    parser.add_argument('--strategies', nargs='+', default=list(generation_strategies.STRATEGIES))
+    parser.add_argument('--short-rates', nargs='+', type=float, default=[0.0, 0.2, 0.4])
+    parser.add_argument('--trials', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--time-scale', type=float, default=0.05,
+                        help='待ち時間の縮小率（結果は実時間に換算して表示。小さすぎるとスレッドの切り替えの遅れが拡大されて不正確）')
+    parser.add_argument('--budget', type=float, default=app.GENERATION_BUDGET_SEC)
+    parser.add_argument('--overrequest-factor', type=float, default=app.GENERATION_OPTIONS['overrequest_factor'])
+    parser.add_argument('--hedge-delay', type=float, default=app.GENERATION_OPTIONS['hedge_delay'])
+    parser.add_argument('--max-parallel', type=int, default=app.GENERATION_OPTIONS['max_parallel'])
+    parser.add_argument('--ttft', type=float, default=1.5, help='最初のトークンまでの時間の中央値（秒）')
+    parser.add_argument('--per-token', type=float, default=0.035, help='1トークンあたりの生成時間（秒）')
+    args = parser.parse_args(argv)
+
+    # ベンチマーク中はアプリのデバッグ出力を抑える
+    devnull = open(os.devnull, 'w')
+    # 時間を縮めているので、流量制限（llm_limiter）の待ちで制限時間を超えないよう制限を外す
+    app.llm_limiter = RateLimiter(max_concurrent=args.concurrency * (args.max_parallel + 1),
+                                  rpm=1e12, tpm=1e12, max_queue=args.concurrency * (args.max_parallel + 1))
+
+    # hedged の並列生成用（リクエストごとに max_parallel 本まで）
+    llm_executor = BoundedExecutor(max_workers=args.concurrency * args.max_parallel, max_pending=0)
+
+    print(f"{'strategy':<12} {'short':>5} {'p50(s)':>7} {'p95(s)':>7} {'calls/req':>9} "
+          f"{'prompt tok/req':>14} {'compl tok/req':>13} {'short items':>11}")
+    for short_rate in args.short_rates:
+        for strategy in args.strategies:
+            latency = LatencyModel(ttft_median=args.ttft, per_token=args.per_token, time_scale=args.time_scale)
+            fake = FakeOpenAI(short_rate=short_rate, latency=latency, seed=42)
+            app.client = fake
+
+            stdout = sys.stdout
+            sys.stdout = devnull
+            try:
+                with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                    results = list(executor.map(
+                        lambda _: run_trial(strategy, args, args.time_scale, llm_executor), range(args.trials)))
+            finally:
+                sys.stdout = stdout
+
+            latencies = [elapsed for elapsed, _ in results]
+            stats = fake.chat.completions.stats()
+            print(f"{strategy:<12} {short_rate:>5.2f} {statistics.median(latencies):>7.1f} "
+                  f"{percentile(latencies, 95):>7.1f} {stats['calls'] / args.trials:>9.2f} "
+                  f"{stats['prompt_tokens'] / args.trials:>14.0f} {stats['completion_tokens'] / args.trials:>13.0f} "
+                  f"{sum(short for _, short in results) / args.trials:>11.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""参照データ（サンプル・インデックス・同義語辞書）の世代管理と再読み込み
+
+サンプルデータ（Excel/スナップショット）・検索用インデックス・同義語辞書（data/synonyms.json）を
+1つの世代（DataState）にまとめて持つ。再読み込みでは新しい世代を裏のスレッドで作り、
+できあがってから参照を1回で差し替える。読み込み中も既存の世代でリクエストを処理し続ける。
+
+リクエストの開始時に現在の世代を contextvars に固定する（pin）。処理の途中で
+差し替わっても、そのリクエスト（と、そこから投入したスレッド）は最後まで同じ世代を使う。
+
+再読み込みのきっかけ:
+- ファイルの監視: 元ファイル（Excel・スナップショット・同義語辞書・インデックスの meta.json・
+  再読み込み要求ファイル）の更新日時とサイズを定期的に確認し、変わっていれば読み込む
+- 管理用エンドポイント: 再読み込み要求ファイルを更新して自プロセスですぐ読み込む。
+  他のワーカープロセスはファイルの監視で追従する
+
+再読み込みで類似検索・重複検出のインデックスが新しいデータと一致しなくなった場合は、
+差し替える前に現在のデータから作り直す（メモリ上のみ。ファイルは各コマンドで作り直す）。
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+
+from dataset import EXCEL_PATH, SNAPSHOT_PATH, load_dataset, text_array
+from dedupe import INDEX_DIR as DEDUPE_DIR
+from dedupe import ReferenceIndex, reference_texts
+from search_index import CategoryIndex
+from semantic_index import INDEX_DIR as SEMANTIC_DIR
+from semantic_index import SemanticIndex, document_texts
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SYNONYMS_PATH = os.path.join(BASE_DIR, 'data', 'synonyms.json')
+RELOAD_STAMP_PATH = os.path.join(BASE_DIR, 'data', 'reload.stamp')
+
+# 監視するファイル（ないファイルは「ない」という状態として比較する）
+WATCHED_PATHS = (
+    EXCEL_PATH,
+    SNAPSHOT_PATH,
+    SYNONYMS_PATH,
+    os.path.join(SEMANTIC_DIR, 'meta.json'),
+    os.path.join(DEDUPE_DIR, 'meta.json'),
+    RELOAD_STAMP_PATH,
+)
+
+
+class Synonyms:
+    """業界・部門の同義語辞書と、管理職・スタッフの判定に使う語"""
+
+    def __init__(self, version, industry, department, management_positions, staff_positions):
+        self.version = version
+        self.industry = industry
+        self.department = department
+        self.management_positions = management_positions
+        self.staff_positions = staff_positions
+
+    @classmethod
+    def load(cls, path=SYNONYMS_PATH):
+        """JSONから読み込む（形式が不正なら ValueError）"""
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        for name in ('industry_synonyms', 'department_synonyms'):
+            table = data.get(name)
+            if not isinstance(table, dict) or not all(
+                    isinstance(k, str) and isinstance(v, str) for k, v in table.items()):
+                raise ValueError(f"{name} は文字列から文字列への対応にしてください")
+        for name in ('management_positions', 'staff_positions'):
+            words = data.get(name)
+            if not isinstance(words, list) or not all(isinstance(word, str) and word for word in words):
+                raise ValueError(f"{name} は空でない文字列のリストにしてください")
+        return cls(
+            version=str(data.get('version', '')),
+            industry=data['industry_synonyms'],
+            department=data['department_synonyms'],
+            management_positions=data['management_positions'],
+            staff_positions=data['staff_positions'],
+        )
+
+
+class DataState:
+    """1世代分の参照データ（作成後は変更しない）"""
+
+    def __init__(self, df, search_index, semantic_index, reference_index, synonyms, sources, generation,
+                 index_status=None):
+        self.df = df
+        self.job_texts = text_array(df)
+        self.search_index = search_index
+        self.semantic_index = semantic_index
+        self.reference_index = reference_index
+        # インデックスごとの状態（loaded / rebuilt / missing / stale）
+        self.index_status = index_status or {}
+        self.synonyms = synonyms
+        self.sources = sources  # 読み込んだ時点の監視ファイルの状態
+        self.generation = generation
+        self.loaded_at = time.time()
+
+    def describe(self):
+        return {
+            'generation': self.generation,
+            'loaded_at': round(self.loaded_at, 3),
+            'rows': len(self.df),
+            'synonyms_version': self.synonyms.version,
+            'semantic_index': self.semantic_index is not None,
+            'reference_index': self.reference_index is not None,
+            'index_status': self.index_status,
+        }
+
+
+def source_signature(paths=WATCHED_PATHS):
+    """監視するファイルの (パス, 更新日時, サイズ) の組"""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+
+def load_index(index_class, directory, df, texts, name, rebuild):
+    """インデックスを読み込み、(インデックス, 状態) を返す
+
+    ファイルが古い（データと一致しない・読めない）場合、rebuild=True なら df から作り直す。
+    ファイルがない場合は作らない（使わない設定として扱う）。
+    """
+    index = index_class.load_for(df)
+    if index is not None:
+        return index, 'loaded'
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        return None, 'missing'
+    if not rebuild:
+        return None, 'stale'
+    started = time.perf_counter()
+    index = index_class.from_texts(texts(df))
+    print(f"[DATA] {name}を現在のデータから作り直しました（{index.rows}件, "
+          f"{time.perf_counter() - started:.2f}秒、メモリ上のみ）", flush=True)
+    return index, 'rebuilt'
+
+
+def build_state(indexed_columns, generation, rebuild_indexes=False):
+    """ファイルから新しい世代を作る（失敗したら例外）
+
+    rebuild_indexes: 類似検索・重複検出のインデックスが古ければ作り直す（再読み込み用）。
+    起動時は作り直さず、警告を出してインデックスなしで動く。
+    """
+    # 読み込み中にファイルが更新された場合に取りこぼさないよう、先に状態を控えておく
+    sources = source_signature()
+    synonyms = Synonyms.load()
+    # スナップショット（data/samples.arrow）があればそちらを使う
+    df = load_dataset()
+    search_index = CategoryIndex(df, indexed_columns)
+    # 類似検索インデックス（data/semantic/）がなければ keyword で検索する
+    semantic_index, semantic_status = load_index(
+        SemanticIndex, SEMANTIC_DIR, df, document_texts, '類似検索インデックス', rebuild_indexes)
+    # 重複検出インデックス（data/dedupe/）がなければ参考サンプルの写しは判定しない
+    reference_index, reference_status = load_index(
+        ReferenceIndex, DEDUPE_DIR, df, reference_texts, '重複検出インデックス', rebuild_indexes)
+    return DataState(df, search_index, semantic_index, reference_index, synonyms, sources, generation,
+                     index_status={'semantic': semantic_status, 'reference': reference_status})
+
+
+class DataStore:
+    """現在の世代を持ち、再読み込みでは新しい世代を作ってから差し替える"""
+
+    def __init__(self, indexed_columns, watch_interval=10.0):
+        self.indexed_columns = indexed_columns
+        self.watch_interval = watch_interval  # 0以下ならファイルを監視しない
+        self.current = None
+        self._pinned = contextvars.ContextVar('data_state', default=None)
+        self._lock = threading.Lock()  # 初回の読み込み・再読み込みを1つずつ行う
+        self._reloading = False  # 裏のスレッドで再読み込み中か（_reload_lock で確認・変更する）
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        self._last_attempt = None  # 最後に読み込もうとした時点の監視ファイルの状態
+        self._counters = {'reloads': 0, 'reload_errors': 0}
+        self.last_error = None
+
+    @classmethod
+    def from_env(cls, indexed_columns):
+        return cls(indexed_columns, watch_interval=float(os.getenv('DATA_WATCH_INTERVAL_SEC', 10)))
+
+    # --- 参照 ---
+
+    def get(self):
+        """このリクエストで固定した世代（固定していなければ現在の世代）"""
+        return self._pinned.get() or self.current
+
+    def pin(self):
+        """現在の世代をこのコンテキストに固定し、unpin() に渡すトークンを返す"""
+        return self._pinned.set(self.current)
+
+    def unpin(self, token):
+        self._pinned.reset(token)
+
+    # --- 読み込み ---
+
+    def load(self):
+        """まだ読み込んでいなければ読み込む（同時に呼ばれても1回だけ）"""
+        if self.current is not None:
+            return
+        with self._lock:
+            if self.current is not None:
+                return
+            self._last_attempt = source_signature()
+            self.current = build_state(self.indexed_columns, generation=1)
+
+    def reload(self, reason=''):
+        """新しい世代を作って差し替える（失敗したら今の世代のまま例外）"""
+        with self._lock:
+            self._last_attempt = source_signature()
+            generation = self.current.generation + 1 if self.current else 1
+            started = time.perf_counter()
+            try:
+                state = build_state(self.indexed_columns, generation, rebuild_indexes=True)
+            except Exception as e:
+                self._counters['reload_errors'] += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"[DATA] 再読み込みに失敗（{reason}）: {self.last_error}", flush=True)
+                raise
+            # 参照の代入は1回なので、読み取り側は古い世代か新しい世代のどちらかを必ず見る
+            self.current = state
+            self._counters['reloads'] += 1
+            self.last_error = None
+            print(f"[DATA] 再読み込み完了（{reason}）: 世代{generation}, {len(state.df)}件, "
+                  f"{time.perf_counter() - started:.2f}秒", flush=True)
+            return state
+
+    def reload_async(self, reason=''):
+        """裏のスレッドで再読み込みを始める（既に実行中ならFalse）
+
+        実行中かの確認・設定・解除は同じロックで行う（読み込み中も _lock を待たずに返る）。
+        """
+        with self._reload_lock:
+            if self._reloading:
+                return False
+            self._reloading = True
+
+        def run():
+            try:
+                self.reload(reason)
+            except Exception:
+                pass  # reload() が記録済み
+            finally:
+                with self._reload_lock:
+                    self._reloading = False
+
+        try:
+            threading.Thread(target=run, daemon=True, name='data-reload').start()
+        except Exception:
+            with self._reload_lock:
+                self._reloading = False
+            raise
+        return True
+
+    def request_reload(self, reason=''):
+        """全ワーカーに再読み込みを求める（要求ファイルを更新し、自プロセスはすぐ始める）"""
+        os.makedirs(os.path.dirname(RELOAD_STAMP_PATH), exist_ok=True)
+        with open(RELOAD_STAMP_PATH, 'w', encoding='utf-8') as f:
+            f.write(f"{time.time()} {os.getpid()} {reason}\n")
+        return self.reload_async(reason)
+
+    # --- ファイルの監視 ---
+
+    def start_watcher(self):
+        """監視スレッドを起動する（fork後のワーカーごとに呼ぶ）"""
+        if self.watch_interval <= 0 or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, daemon=True, name='data-watcher')
+        self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                signature = source_signature()
+                # 読み込みに失敗したファイルは、さらに更新されるまで読み直さない
+                if self.current is not None and signature != self._last_attempt:
+                    changed = [os.path.basename(path) for (path, *stat), (_, *before)
+                               in zip(signature, self._last_attempt or ()) if stat != before]
+                    self.reload_async(f"ファイルの更新: {', '.join(changed) or '?'}")
+            except Exception as e:
+                print(f"[DATA] 監視エラー: {e}", flush=True)
+
+    def stats(self):
+        state = self.current
+        return {
+            **self._counters,
+            'generation': state.generation if state else 0,
+            'rows': len(state.df) if state else 0,
+            'reloading': int(self._reloading),
+        }
+
+    def status(self):
+        return {
+            'current': self.current.describe() if self.current else None,
+            'reloading': self._reloading,
+            'last_error': self.last_error,
+            'watch_interval': self.watch_interval,
+            **self._counters,
+        }
@@ -0,0 +1,145 @@
+"""サンプルデータの読み込み（Excel → Arrowスナップショット）
+
+起動時に毎回Excelをパースすると数秒かかるため、必要な列だけを
+Arrow(Feather)形式のスナップショットに変換しておき、起動時はそちらを読む。
+
+読み込んだデータはコンパクトな形にする（compact()）。
+- 業界・部門・ポジション: カテゴリ型（値の種類は数十なので、行ごとには整数コードだけを持つ）
+- 職務内容: Arrowの文字列型（1本の連続したバッファ。スナップショットからはコピーせずに読める）
+
+    python dataset.py          # スナップショットを作成（ビルド時に実行）
+    python dataset.py --check  # スナップショットが最新か確認
+"""
+import argparse
+import hashlib
+import os
+import sys
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EXCEL_PATH = os.path.join(BASE_DIR, '米国での業務内容.xlsx')
+SHEET_NAME = '米国での業務内容'
+SNAPSHOT_PATH = os.path.join(BASE_DIR, 'data', 'samples.arrow')
+
+# アプリで使用する列のみ保持する
+COLUMNS = ['業界', '部門', 'ポジション', '職務内容']
+CATEGORY_COLUMNS = ['業界', '部門', 'ポジション']
+TEXT_COLUMN = '職務内容'
+
+# スナップショットの形式を変えたら上げる（古いスナップショットは自動的に無視される）
+SNAPSHOT_FORMAT = '2'
+
+
+def file_sha256(path):
+    """ファイル内容のSHA-256を返す"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_excel(excel_path=EXCEL_PATH):
+    """Excelから必要な列だけを読み込む"""
+    return pd.read_excel(excel_path, sheet_name=SHEET_NAME, usecols=COLUMNS)[COLUMNS]
+
+
+def compact(df):
+    """カテゴリ列をカテゴリ型、職務内容をArrowの文字列型にする
+
+    職務内容が空の行は参考サンプルにならないので除く。
+    """
+    text = df[TEXT_COLUMN]
+    keep = text.notna() & text.str.strip().ne('').fillna(False).astype(bool)
+    if not keep.all():
+        df = df[keep].reset_index(drop=True)
+    columns = {column: df[column].astype('category') for column in CATEGORY_COLUMNS}
+    columns[TEXT_COLUMN] = df[TEXT_COLUMN].astype(pd.StringDtype('pyarrow'))
+    return pd.DataFrame(columns, copy=False)
+
+
+def text_array(df):
+    """職務内容のArrow配列（行位置で1件ずつ取り出すと、pandas経由より速い）"""
+    return df[TEXT_COLUMN].array._pa_array.combine_chunks()
+
+
+def build_snapshot(excel_path=EXCEL_PATH, snapshot_path=SNAPSHOT_PATH):
+    """ExcelをパースしてArrowスナップショットを書き出す（カテゴリ列は辞書エンコード）"""
+    df = compact(read_excel(excel_path))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        'source_sha256': file_sha256(excel_path),
+        'format': SNAPSHOT_FORMAT,
+    })
+
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    # 書き込み途中のファイルを読まれないよう、一時ファイル経由で置き換える
+    tmp_path = snapshot_path + '.tmp'
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, snapshot_path)
+    return df
+
+
+def read_snapshot(snapshot_path=SNAPSHOT_PATH):
+    """スナップショットを読み込み、(DataFrame, メタデータ) を返す"""
+    table = feather.read_table(snapshot_path, memory_map=True)
+    metadata = {k.decode(): v.decode() for k, v in (table.schema.metadata or {}).items()}
+    # 文字列列はArrowのバッファのまま（Pythonの文字列オブジェクトを作らない）、辞書列はカテゴリ型になる
+    df = table.to_pandas(types_mapper={pa.string(): pd.StringDtype('pyarrow')}.get)
+    return df, metadata
+
+
+def snapshot_is_fresh(metadata, excel_path=EXCEL_PATH):
+    """スナップショットが現在のExcelから作られたものか確認"""
+    if metadata.get('format') != SNAPSHOT_FORMAT:
+        return False
+    if not os.path.exists(excel_path):
+        # Excelがない環境ではスナップショットをそのまま信頼する
+        return True
+    return metadata.get('source_sha256') == file_sha256(excel_path)
+
+
+def load_dataset(excel_path=EXCEL_PATH, snapshot_path=SNAPSHOT_PATH):
+    """スナップショットがあれば使い、なければ・古ければExcelから読み込む"""
+    if os.path.exists(snapshot_path):
+        try:
+            df, metadata = read_snapshot(snapshot_path)
+            if snapshot_is_fresh(metadata, excel_path):
+                print(f"INFO: スナップショットから読み込み ({len(df)}件)", flush=True)
+                return compact(df)
+            print("WARNING: スナップショットが古いためExcelから読み込みます", flush=True)
+        except Exception as e:
+            print(f"WARNING: スナップショットの読み込みに失敗: {e}", flush=True)
+
+    print("INFO: Excelから読み込み", flush=True)
+    return compact(read_excel(excel_path))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='サンプルデータのスナップショットを作成')
+    parser.add_argument('--excel', default=EXCEL_PATH)
+    parser.add_argument('--output', default=SNAPSHOT_PATH)
+    parser.add_argument('--check', action='store_true', help='スナップショットが最新か確認のみ行う')
+    args = parser.parse_args(argv)
+
+    if args.check:
+        if not os.path.exists(args.output):
+            print(f"スナップショットがありません: {args.output}")
+            return 1
+        _, metadata = read_snapshot(args.output)
+        if not snapshot_is_fresh(metadata, args.excel):
+            print("スナップショットが古くなっています")
+            return 1
+        print("スナップショットは最新です")
+        return 0
+
+    df = build_snapshot(args.excel, args.output)
+    print(f"スナップショットを作成しました: {args.output} ({len(df)}件)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""近似重複の検出（文字シングル + MinHash/LSH）
+
+生成結果には、助詞が1〜2か所違うだけの項目（リトライや文字数不足からの補充で入りやすい）や、
+参考サンプル（データの職務内容）をほぼそのまま写した項目が混ざることがある。
+項目を正規化した文字3-gramの集合にし、MinHash署名（NUM_PERM個の最小ハッシュ）で
+Jaccard係数を推定する。署名を BANDS 個の帯に分けたLSHで候補を引くので、
+1項目あたりの判定は登録済みの件数によらずほぼ一定の時間で済む。
+
+- NearDuplicates: 1回の生成の中で採用した項目との重複判定（プロセス内の辞書）
+- ReferenceIndex: データの職務内容全件のLSHインデックス。data/dedupe/ に .npy で保存し、
+  起動時はメモリマップで読む（帯ごとにソートしたキーを二分探索するので全件を走査しない）
+
+    python dedupe.py          # データの職務内容のインデックスを作成（ビルド時に実行）
+    python dedupe.py --check  # インデックスが現在のデータと一致するか確認
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import unicodedata
+import zlib
+
+import numpy as np
+
+from semantic_index import text_digest
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_DIR = os.path.join(BASE_DIR, 'data', 'dedupe')
+
+# 形式やパラメータを変えたら上げる（古いインデックスは自動的に無視される）
+INDEX_FORMAT = '1'
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+
+# 推定Jaccard係数がこれ以上なら重複とみなす
+#   生成結果どうし: 助詞が1〜2か所違う60文字程度の項目はおおよそ0.7〜0.8
+#   参考サンプルとの比較: ほぼそのままの写し（数か所の言い換え程度まで）だけを対象にする
+DUPLICATE_THRESHOLD = 0.6
+COPY_THRESHOLD = 0.7
+
+TEXT_COLUMN = '職務内容'
+ARRAYS = ('signatures', 'band_keys', 'band_rows')
+
+_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.default_rng(20240601)
+_A = _rng.integers(1, int(_PRIME), NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, int(_PRIME), NUM_PERM, dtype=np.uint64)
+# 帯の値（ROWS_PER_BAND個）を1つの64bitキーにまとめる係数（奇数）
+_BAND_MIX = _rng.integers(1, 1 << 62, ROWS_PER_BAND, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_EMPTY = np.full(NUM_PERM, int(_PRIME), dtype=np.uint32)
+
+IGNORED = re.compile(r'[\s。、，．・,.「」『』（）()【】\[\]"\'：:；;！!？?～~ー\-]+')
+
+
+def normalize(text):
+    """表記の揺れを除く（全角/半角・大文字/小文字・空白・句読点・括弧）"""
+    return IGNORED.sub('', unicodedata.normalize('NFKC', text or '').lower())
+
+
+def shingles(text):
+    """正規化したテキストの文字3-gramの集合（短いテキストは全体を1つ）"""
+    text = normalize(text)
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def signature(text):
+    """MinHash署名（NUM_PERM個のuint32）"""
+    grams = shingles(text)
+    if not grams:
+        return _EMPTY.copy()
+    hashes = np.fromiter((zlib.crc32(gram.encode('utf-8')) for gram in grams), dtype=np.uint64, count=len(grams))
+    hashes %= _PRIME
+    # (a * h + b) mod p を全ハッシュ関数 × 全シングルでまとめて計算し、関数ごとの最小値を取る
+    return ((hashes[:, None] * _A + _B) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+def band_keys(signatures):
+    """署名（件数 × NUM_PERM）を帯ごとのキー（件数 × BANDS のuint64）にする"""
+    signatures = np.asarray(signatures, dtype=np.uint64).reshape(-1, BANDS, ROWS_PER_BAND)
+    return (signatures * _BAND_MIX).sum(axis=2, dtype=np.uint64)
+
+
+def similarity(sig, others):
+    """推定Jaccard係数（署名の一致する割合）"""
+    return (np.asarray(others) == sig).mean(axis=-1)
+
+
+class NearDuplicates:
+    """登録した項目との近似重複を判定する（1回の生成の中で使う）"""
+
+    def __init__(self, threshold=DUPLICATE_THRESHOLD):
+        self.threshold = threshold
+        self.items = []
+        self._signatures = []
+        self._buckets = [{} for _ in range(BANDS)]
+
+    def find(self, sig):
+        """閾値以上に似た登録済みの項目を (項目, 類似度) で返す（なければNone）"""
+        candidates = set()
+        for band, key in enumerate(band_keys(sig)[0].tolist()):
+            candidates.update(self._buckets[band].get(key, ()))
+        if not candidates:
+            return None
+        candidates = sorted(candidates)
+        scores = similarity(sig, [self._signatures[i] for i in candidates])
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        return self.items[candidates[best]], float(scores[best])
+
+    def add(self, item, sig):
+        position = len(self.items)
+        self.items.append(item)
+        self._signatures.append(sig)
+        for band, key in enumerate(band_keys(sig)[0].tolist()):
+            self._buckets[band].setdefault(key, []).append(position)
+
+
+class ReferenceIndex:
+    """データの職務内容全件のLSHインデックス（配列はメモリマップでもよい）
+
+    band_keys / band_rows は帯ごとにキーでソートした (BANDS × 件数) の配列。
+    """
+
+    def __init__(self, signatures, band_keys, band_rows):
+        # メモリマップのままでも、np.memmap のサブクラスを通さない方が小さな処理は速い
+        self.signatures = np.asarray(signatures)
+        self.band_keys = np.asarray(band_keys)
+        self.band_rows = np.asarray(band_rows)
+
+    @property
+    def rows(self):
+        return len(self.signatures)
+
+    @classmethod
+    def from_texts(cls, texts):
+        signatures = np.stack([signature(text) for text in texts]) if texts else np.zeros((0, NUM_PERM), np.uint32)
+        keys = band_keys(signatures).T  # BANDS × 件数
+        order = np.argsort(keys, axis=1, kind='stable')
+        return cls(signatures, np.take_along_axis(keys, order, axis=1), order.astype(np.int32))
+
+    @classmethod
+    def load(cls, directory=INDEX_DIR, mmap_mode='r'):
+        """保存したインデックスを読み込み、(ReferenceIndex, メタデータ) を返す"""
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode) for name in ARRAYS}
+        return cls(**arrays), meta
+
+    @classmethod
+    def load_for(cls, df, directory=INDEX_DIR):
+        """df と一致するインデックスがあれば読み込む（なければ・古ければNone）"""
+        if not os.path.exists(os.path.join(directory, 'meta.json')):
+            print("WARNING: 重複検出インデックスがありません（python dedupe.py で作成）", flush=True)
+            return None
+        try:
+            index, meta = cls.load(directory)
+        except Exception as e:
+            print(f"WARNING: 重複検出インデックスの読み込みに失敗: {e}", flush=True)
+            return None
+        if not index_is_fresh(meta, reference_texts(df)):
+            print("WARNING: 重複検出インデックスが古いため使用しません", flush=True)
+            return None
+        print(f"INFO: 重複検出インデックスを読み込み ({index.rows}件)", flush=True)
+        return index
+
+    def save(self, directory, digest):
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            # 書き込み途中のファイルを読まれないよう、一時ファイル経由で置き換える
+            path = os.path.join(directory, f'{name}.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, getattr(self, name))
+            os.replace(path + '.tmp', path)
+        # meta.jsonを最後に書く（これが揃っていることを有効なインデックスの条件にする）
+        meta = {
+            'format': INDEX_FORMAT,
+            'rows': self.rows,
+            'text_sha256': digest,
+            'num_perm': NUM_PERM,
+            'bands': BANDS,
+            'shingle_size': SHINGLE_SIZE,
+        }
+        with open(os.path.join(directory, 'meta.json.tmp'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(directory, 'meta.json.tmp'), os.path.join(directory, 'meta.json'))
+
+    def find(self, sig, threshold=COPY_THRESHOLD):
+        """閾値以上に似た行を (行位置, 類似度) で返す（なければNone）"""
+        candidates = []
+        for band, key in enumerate(band_keys(sig)[0]):
+            keys = self.band_keys[band]
+            start = keys.searchsorted(key, side='left')
+            end = keys.searchsorted(key, side='right')
+            if end > start:
+                candidates.append(self.band_rows[band, start:end])
+        if not candidates:
+            return None
+        candidates = np.unique(np.concatenate(candidates))
+        scores = similarity(sig, self.signatures[candidates])
+        best = int(np.argmax(scores))
+        if scores[best] < threshold:
+            return None
+        return int(candidates[best]), float(scores[best])
+
+
+def reference_texts(df):
+    return [text if isinstance(text, str) else '' for text in df[TEXT_COLUMN].tolist()]
+
+
+def index_is_fresh(meta, texts):
+    """インデックスが現在のデータ・形式から作られたものか確認"""
+    return (
+        meta.get('format') == INDEX_FORMAT
+        and meta.get('rows') == len(texts)
+        and meta.get('text_sha256') == text_digest(texts)
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='職務内容の重複検出インデックスを作成')
+    parser.add_argument('--output', default=INDEX_DIR)
+    parser.add_argument('--check', action='store_true', help='インデックスが最新か確認のみ行う')
+    args = parser.parse_args(argv)
+
+    from dataset import load_dataset
+    texts = reference_texts(load_dataset())
+
+    if args.check:
+        try:
+            _, meta = ReferenceIndex.load(args.output)
+        except (OSError, ValueError) as e:
+            print(f"インデックスを読み込めません: {e}")
+            return 1
+        if not index_is_fresh(meta, texts):
+            print("インデックスが古くなっています")
+            return 1
+        print("インデックスは最新です")
+        return 0
+
+    index = ReferenceIndex.from_texts(texts)
+    index.save(args.output, text_digest(texts))
+    print(f"インデックスを作成しました: {args.output} ({index.rows}件)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,291 @@
+"""職務内容生成のリトライ戦略
+
+50文字未満の項目が返ってきたときの補充方法を切り替えられるようにする。
+
+- sequential : 不足分を1回ずつ順番に再生成する（従来の動作）
+- overrequest: 最初から不足数より多め（× overrequest_factor）に依頼し、再生成の回数を減らす
+- hedged     : overrequest と同じく多めに依頼し、足りなくなった（短い項目が出た）・遅い（最初の
+               項目が hedge_delay 秒来ない）ときだけ、共有スレッドプールで並列に追加の生成を投げる
+
+どの戦略も fetch(count, deadline) を使って生成する。fetch は count 件の生成を依頼し、
+完成した項目を順に返すジェネレータ（close() で生成を打ち切れること）を返す。
+deadline（time.monotonic() 基準）を過ぎたら待つのをやめ、集まった分と
+フォールバック（50文字未満を長い順）で返す。この場合と目標件数に届かなかった場合は、
+run() の戻り値の complete が False になる（キャッシュなどに残さないこと）。
+
+採用済みの項目と近似重複する項目（助詞が違うだけなど）は、リトライやフォールバックを
+含めて採用しない（dedupe.py のMinHash/LSH）。check を渡すと、項目ごとに追加の除外判定
+（参考サンプルの写しなど）を行う。
+"""
+import math
+import queue
+import threading
+import time
+
+import dedupe
+
+
+class Collector:
+    """採用・除外の判定とフォールバック（全戦略で共通）"""
+
+    def __init__(self, target, min_chars, check=None, on_drop=None):
+        self.target = target
+        self.min_chars = min_chars
+        self.check = check  # (項目, 署名) → 除外する理由（なければNone）
+        self.on_drop = on_drop  # 除外した理由ごとの通知（計測用）
+        self.accepted = []
+        self.timed_out = False  # 目標件数に届く前に制限時間を過ぎたか
+        self.rejected = []  # (文字数, 項目, 署名) 50文字未満のもの
+        self.duplicates = dedupe.NearDuplicates()  # 採用済みの項目
+        self._lock = threading.Lock()
+
+    @property
+    def needed(self):
+        return max(self.target - len(self.accepted), 0)
+
+    def finish(self, deadline):
+        """生成を終えるときに呼ぶ（制限時間で打ち切ったかを記録する。フォールバックの前に呼ぶこと）"""
+        if self.needed and expired(deadline):
+            self.timed_out = True
+
+    @property
+    def complete(self):
+        """制限時間内に目標件数が揃ったか（フォールバックの項目を含む）"""
+        return not self.needed and not self.timed_out
+
+    def offer(self, item):
+        """項目を判定し、採用したらTrue"""
+        with self._lock:
+            if not self.needed:
+                return False
+            sig = dedupe.signature(item)
+            reason = self._drop_reason(item, sig)
+            if reason:
+                self._drop(reason, item)
+                return False
+            char_count = len(item)
+            if char_count >= self.min_chars:
+                self._accept(item, sig)
+                print(f"[DEBUG] 採用: {char_count}文字", flush=True)
+                return True
+            self.rejected.append((char_count, item, sig))
+            print(f"[DEBUG] 除外: {char_count}文字 - {item[:30]}...", flush=True)
+            return False
+
+    def _drop_reason(self, item, sig):
+        if self.duplicates.find(sig) is not None:
+            return 'duplicate'
+        if self.check is not None:
+            return self.check(item, sig)
+        return None
+
+    def _drop(self, reason, item):
+        print(f"[DEBUG] 除外（{reason}）: {item[:30]}...", flush=True)
+        if self.on_drop is not None:
+            self.on_drop(reason)
+
+    def _accept(self, item, sig):
+        self.accepted.append(item)
+        self.duplicates.add(item, sig)
+
+    def fallback(self):
+        """不足分を50文字未満の項目から長い順に補う"""
+        with self._lock:
+            added = []
+            for char_count, item, sig in sorted(self.rejected, key=lambda x: x[0], reverse=True):
+                if not self.needed:
+                    break
+                # 採用済み（先に補った項目を含む）と近似重複するものは使わない
+                if self.duplicates.find(sig) is not None:
+                    self._drop('duplicate', item)
+                    continue
+                self._accept(item, sig)
+                added.append(item)
+                print(f"[DEBUG] フォールバック採用: {char_count}文字", flush=True)
+            return added
+
+
+def expired(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def _consume(fetch, count, deadline, collector):
+    """1回分の生成を読み、採用した項目を返す（揃ったら打ち切る）"""
+    items = fetch(count, deadline)
+    try:
+        for item in items:
+            if collector.offer(item):
+                yield item
+            if not collector.needed or expired(deadline):
+                break
+    finally:
+        items.close()
+
+
+def sequential(fetch, collector, max_calls, deadline, factor=1.0, **_):
+    """不足分を順番に再生成"""
+    calls = 0
+    while collector.needed and calls < max_calls and not expired(deadline):
+        count = math.ceil(collector.needed * factor)
+        yield from _consume(fetch, count, deadline, collector)
+        calls += 1
+        print(f"[DEBUG] リトライ{calls}: 採用{len(collector.accepted)}件", flush=True)
+    collector.finish(deadline)
+    yield from collector.fallback()
+
+
+def overrequest(fetch, collector, max_calls, deadline, overrequest_factor=1.4, **_):
+    """多めに依頼して再生成を減らす（目標に達した時点でストリームは閉じるので余分なトークンは少ない）"""
+    yield from sequential(fetch, collector, max_calls, deadline, factor=overrequest_factor)
+
+
+def hedged(fetch, collector, max_calls, deadline, hedge_delay=3.0, max_parallel=2, overrequest_factor=1.0,
+           executor=None, **_):
+    """多めに依頼して生成し、足りなくなった・遅いときだけ並列に追加の生成を投げる
+
+    追加するのは、実行中の生成の残り件数では目標に届かなくなったとき（短い・重複の項目が出た。
+    不足分だけ依頼する）と、hedge_delay 秒たっても最初の項目が来ないとき（同じ件数をもう1本）。
+    生成は executor（llm_limiter.BoundedExecutor）の空いているスレッドで実行し、空きがなければ
+    追加しない。実行中の生成がなくなったら、このスレッドで順番に補充する（sequential と同じ）。
+    """
+    if executor is None:
+        yield from sequential(fetch, collector, max_calls, deadline, factor=overrequest_factor)
+        return
+
+    events = queue.Queue()
+    stop = threading.Event()
+    running = {}  # 呼び出し番号 → 依頼件数・受け取った件数・開始時刻
+    state = {'calls': 0}
+    errors = []
+
+    def produce(call, count):
+        try:
+            items = fetch(count, deadline)
+            try:
+                for item in items:
+                    events.put((call, 'item', item))
+                    if stop.is_set():
+                        break
+            finally:
+                items.close()
+        except Exception as e:
+            events.put((call, 'error', e))
+        finally:
+            events.put((call, 'done', None))
+
+    def launch(count):
+        call = state['calls']
+        if call >= max_calls or len(running) >= max_parallel:
+            return False
+        # 待ち行列には入れない（空きを待つと、プールのスレッドで待っている呼び出し元と詰まる）
+        if executor.try_submit(produce, call, count) is None:
+            return False
+        running[call] = {'requested': count, 'received': 0, 'started': time.monotonic(), 'hedged': False}
+        state['calls'] += 1
+        return True
+
+    def request_count(needed):
+        return math.ceil(needed * overrequest_factor)
+
+    try:
+        launch(request_count(collector.needed))
+        while collector.needed and running and not expired(deadline):
+            now = time.monotonic()
+            # 期限を過ぎていれば待たない（負の timeout は queue.get が ValueError を投げる）
+            timeout = max(0.0, deadline - now) if deadline is not None else None
+
+            # 実行中の生成の残りでは足りない（短い・重複の項目が出た）なら、不足分を追加で依頼する
+            outstanding = sum(call['requested'] - call['received'] for call in running.values())
+            if collector.needed > outstanding and launch(request_count(collector.needed - outstanding)):
+                continue
+
+            # 最初の項目が hedge_delay 秒たっても来ない生成には、同じ件数をもう1本投げる
+            slow = [call for call in running.values() if not call['received'] and not call['hedged']]
+            if slow:
+                call = min(slow, key=lambda call: call['started'])
+                hedge_at = call['started'] + hedge_delay
+                if hedge_at > now:
+                    timeout = hedge_at - now if timeout is None else min(timeout, hedge_at - now)
+                else:
+                    call['hedged'] = True
+                    launch(request_count(collector.needed))
+                    continue
+
+            try:
+                call, event, payload = events.get(timeout=timeout)
+            except queue.Empty:
+                continue
+
+            if event == 'item':
+                running[call]['received'] += 1
+                if collector.offer(payload):
+                    yield payload
+            elif event == 'error':
+                print(f"[DEBUG] 並列生成エラー: {payload}", flush=True)
+                errors.append(payload)
+            else:
+                del running[call]
+                if not running and collector.needed:
+                    # 実行中の生成がなくなったらすぐに補充する
+                    launch(request_count(collector.needed))
+    finally:
+        # 残りの生成は次の項目を受け取った時点で打ち切られる
+        stop.set()
+
+    calls = state['calls']
+    print(f"[DEBUG] 並列生成: {calls}回, 採用{len(collector.accepted)}件", flush=True)
+    if collector.needed and calls < max_calls and not expired(deadline):
+        # 共有スレッドプールに空きがなく投げられなかったので、このスレッドで続ける
+        yield from sequential(fetch, collector, max_calls - calls, deadline, factor=overrequest_factor)
+        return
+
+    collector.finish(deadline)
+    if errors and not collector.accepted and not collector.rejected:
+        raise errors[-1]
+    yield from collector.fallback()
+
+
+class Generation:
+    """run() の戻り値。採用した項目を順に返す
+
+    最後まで読んだ後の complete が False なら、制限時間で打ち切ったか目標件数に届かなかった。
+    """
+
+    def __init__(self, items, collector):
+        self._items = items
+        self._collector = collector
+
+    def __iter__(self):
+        return iter(self._items)
+
+    @property
+    def complete(self):
+        return self._collector.complete
+
+    @property
+    def timed_out(self):
+        """目標件数に届く前に制限時間を過ぎた"""
+        return self._collector.timed_out
+
+
+STRATEGIES = {
+    'sequential': sequential,
+    'overrequest': overrequest,
+    'hedged': hedged,
+}
+
+
+def run(strategy, fetch, target, min_chars, max_calls, budget=None, check=None, on_drop=None, **options):
+    """指定した戦略で生成し、採用した項目を順に返す（Generation）
+
+    budget: 全体の制限時間（秒）。Noneなら制限なし（0はすぐに期限切れ）。
+    check: (項目, MinHash署名) → 除外する理由（なければNone）。近似重複の判定に加えて行う
+    on_drop: 除外した項目ごとに理由（'duplicate' または check の返した値）で呼ばれる
+    options: overrequest_factor, hedge_delay, max_parallel, executor（hedged の並列生成に使う
+             llm_limiter.BoundedExecutor。なければ並列にしない）など戦略ごとの設定
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"unknown generation strategy: {strategy}")
+    deadline = time.monotonic() + budget if budget is not None else None
+    collector = Collector(target, min_chars, check, on_drop)
+    return Generation(STRATEGIES[strategy](fetch, collector, max_calls, deadline, **options), collector)
@@ -0,0 +1,37 @@
+"""gunicornの設定（Procfile: gunicorn -c gunicorn.conf.py wsgi:app）
+
+処理時間のほとんどはOpenAIの応答待ち（I/O）なので、プロセスは少なめにして
+各プロセスのスレッドを多くする。SSE（/api/compare/stream）は生成が終わるまで
+1スレッドを占有するため、同時に開く画面の数だけスレッドが必要になる。
+
+OpenAI呼び出しの流量制限（LLM_RPM など）はワーカープロセスごとにかかるので、
+プロバイダの上限を WEB_CONCURRENCY で割った値を設定すること。
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# fork前にデータ・インデックスを読み込み、ワーカー間で共有する（wsgi.py）
+preload_app = True
+
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 32))
+
+# gthreadでは timeout はワーカーの応答確認で、長い生成リクエストを打ち切るものではない
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+accesslog = None  # アクセスログはアプリがJSONで出力する（metrics.py）
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    """ワーカーごとにOpenAIクライアントと一括生成ジョブのスレッドを用意する"""
+    from app import initialize
+    try:
+        initialize()
+    except Exception as e:
+        # 失敗しても最初のリクエストで再試行する（/readyz は準備ができるまで503）
+        worker.log.error(f"初期化に失敗しました: {e}")
@@ -0,0 +1,254 @@
+"""LLM生成結果のキャッシュ（プロセス内LRU ＋ SQLite）
+
+同じ条件の生成を何度もOpenAIに投げないよう、結果をキャッシュする。
+- 1段目: プロセス内のLRU（TTL付き、ワーカーごと）
+- 2段目: SQLiteファイル（gunicornの全ワーカーで共有）
+
+キーは make_key() で正規化済みの入力・モデル名・プロンプトのバージョンから作る。
+
+他のワーカーで削除した値を返し続けないよう、invalidate() はSQLiteに記録を残す。
+- 全件の削除: 無効化の世代（epoch）を進める。世代が変わっていればプロセス内のLRUを全部捨てる
+- キーの削除: 削除したキーと時刻を残す。その後に削除されたキーだけをLRUから捨てる
+各ワーカーは読み込みのときに、最大 sync_interval 秒に1回だけこれを確認する
+（プロセス内LRUのヒットには毎回SQLiteを読まない）。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(kind, **parts):
+    """キャッシュキーを作成（値の順序に依存しないようJSONでソートしてハッシュ化）"""
+    payload = json.dumps({'kind': kind, **parts}, ensure_ascii=False, sort_keys=True)
+    return f"{kind}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+class LLMCache:
+    """2段構成のキャッシュ"""
+
+    def __init__(self, path=None, ttl=7 * 24 * 3600, memory_ttl=300, max_entries=512, sync_interval=2.0):
+        self.path = path  # Noneまたは空文字ならSQLiteを使わない
+        self.ttl = ttl
+        self.memory_ttl = memory_ttl
+        self.max_entries = max_entries
+        self.sync_interval = sync_interval  # 他のワーカーの invalidate() を確認する間隔（秒）
+
+        self._memory = OrderedDict()  # key -> (有効期限, 値)
+        self._epoch = None  # プロセス内のLRUを作ったときの無効化の世代
+        self._synced_at = None  # 最後に無効化の記録を確認した時刻（time.time()）
+        self._next_sync = 0.0  # 次に確認する時刻（time.monotonic()）
+        self._lock = threading.Lock()
+        self._local = threading.local()  # スレッドごとのSQLite接続
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'bypasses': 0,
+            'stores': 0,
+            'skipped': 0,  # cacheable で保存しなかった結果
+            'errors': 0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        """環境変数から設定を読み込んで作成"""
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'llm_cache.sqlite3')
+        return cls(
+            path=os.getenv('LLM_CACHE_PATH', default_path),
+            ttl=float(os.getenv('LLM_CACHE_TTL', 7 * 24 * 3600)),
+            memory_ttl=float(os.getenv('LLM_CACHE_MEMORY_TTL', 300)),
+            max_entries=int(os.getenv('LLM_CACHE_SIZE', 512)),
+            sync_interval=float(os.getenv('LLM_CACHE_SYNC_SEC', 2)),
+        )
+
+    # --- SQLite ---
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS llm_cache ('
+                ' key TEXT PRIMARY KEY,'
+                ' value TEXT NOT NULL,'
+                ' created_at REAL NOT NULL,'
+                ' expires_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE TABLE IF NOT EXISTS llm_cache_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS llm_cache_invalidated (key TEXT PRIMARY KEY, at REAL NOT NULL)')
+            self._local.conn = conn
+        return conn
+
+    def _disk_get(self, key):
+        row = self._connection().execute(
+            'SELECT value, expires_at FROM llm_cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def _disk_set(self, key, value):
+        now = time.time()
+        self._connection().execute(
+            'INSERT OR REPLACE INTO llm_cache (key, value, created_at, expires_at) VALUES (?, ?, ?, ?)',
+            (key, json.dumps(value, ensure_ascii=False), now, now + self.ttl)
+        )
+
+    def _sync(self):
+        """他のワーカーが invalidate() した値をプロセス内のLRUから捨てる（sync_interval 秒に1回）"""
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_sync:
+                return
+            self._next_sync = now + self.sync_interval
+            since = self._synced_at
+        # 時計のずれと書き込みの遅れの分、少し前から確認する
+        started = time.time()
+        try:
+            conn = self._connection()
+            row = conn.execute("SELECT value FROM llm_cache_meta WHERE name = 'epoch'").fetchone()
+            epoch = row[0] if row else 0
+            keys = []
+            if since is not None:
+                keys = [key for (key,) in conn.execute(
+                    'SELECT key FROM llm_cache_invalidated WHERE at >= ?', (since - 1.0,))]
+        except sqlite3.Error as e:
+            print(f"[CACHE] 読み込みエラー: {e}", flush=True)
+            self._count('errors')
+            return
+        with self._lock:
+            if epoch != self._epoch:
+                self._memory.clear()
+                self._epoch = epoch
+            for key in keys:
+                self._memory.pop(key, None)
+            self._synced_at = started
+
+    # --- プロセス内LRU ---
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return value
+
+    def _memory_set(self, key, value):
+        with self._lock:
+            self._memory[key] = (time.time() + self.memory_ttl, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    # --- 公開API ---
+
+    def get(self, key):
+        """キャッシュから取得（なければNone）"""
+        if self.path:
+            self._sync()
+        value = self._memory_get(key)
+        if value is not None:
+            self._count('memory_hits')
+            return value
+
+        if self.path:
+            try:
+                value = self._disk_get(key)
+            except sqlite3.Error as e:
+                # キャッシュの障害で生成自体を止めない
+                print(f"[CACHE] 読み込みエラー: {e}", flush=True)
+                self._count('errors')
+                value = None
+            if value is not None:
+                self._count('disk_hits')
+                self._memory_set(key, value)
+                return value
+
+        self._count('misses')
+        return None
+
+    def set(self, key, value):
+        """キャッシュに保存"""
+        self._memory_set(key, value)
+        if self.path:
+            try:
+                self._disk_set(key, value)
+            except sqlite3.Error as e:
+                print(f"[CACHE] 書き込みエラー: {e}", flush=True)
+                self._count('errors')
+                return
+        self._count('stores')
+
+    def get_or_compute(self, key, compute, bypass=False, cacheable=None):
+        """キャッシュにあれば返し、なければ compute() の結果を保存して返す
+
+        bypass=True の場合はキャッシュを読まずに再計算し、結果で上書きする。
+        compute() が例外を投げた場合と、cacheable(結果) が False の場合は何も保存しない。
+        """
+        if bypass:
+            self._count('bypasses')
+        else:
+            value = self.get(key)
+            if value is not None:
+                return value
+
+        value = compute()
+        if cacheable is None or cacheable(value):
+            self.set(key, value)
+        else:
+            self._count('skipped')
+        return value
+
+    def invalidate(self, key=None):
+        """指定キー（省略時は全件）を削除（他のワーカーのプロセス内LRUからも sync_interval 秒以内に消える）"""
+        with self._lock:
+            if key is None:
+                self._memory.clear()
+            else:
+                self._memory.pop(key, None)
+        if self.path:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                if key is None:
+                    conn.execute('DELETE FROM llm_cache')
+                    conn.execute('DELETE FROM llm_cache_invalidated')
+                    conn.execute(
+                        "INSERT INTO llm_cache_meta (name, value) VALUES ('epoch', 1)"
+                        " ON CONFLICT(name) DO UPDATE SET value = value + 1"
+                    )
+                else:
+                    conn.execute('DELETE FROM llm_cache WHERE key = ?', (key,))
+                    conn.execute('INSERT OR REPLACE INTO llm_cache_invalidated (key, at) VALUES (?, ?)', (key, now))
+                    # LRUの有効期限を過ぎた記録は要らない
+                    conn.execute('DELETE FROM llm_cache_invalidated WHERE at < ?', (now - self.memory_ttl - 60,))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def stats(self):
+        """ヒット・ミス件数などを返す"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,213 @@
+"""OpenAI呼び出しの流量制限（プロセス全体で共有）
+
+- RateLimiter: 同時実行数・1分あたりのリクエスト数(RPM)・トークン数(TPM)を制限する。
+  待ち行列が一杯、または待ち時間が上限を超えたら Overloaded を投げる（APIは503を返す）。
+- BoundedExecutor: リクエスト間で共有するスレッドプール。受付数に上限を設け、
+  超えたら Overloaded を投げる（リクエストごとにスレッドを作らない）。
+
+制限はワーカープロセスごと。gunicornで複数ワーカーを動かす場合は、
+プロバイダの上限をワーカー数で割った値を設定すること。
+"""
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    """混雑のため受け付けられない（503で返す）"""
+
+
+class TokenBucket:
+    """1分あたりの量で補充されるトークンバケット（残量はマイナスにもなる＝使いすぎの繰り越し）"""
+
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self.level = per_minute
+        self._updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    def wait_time(self, amount):
+        """amount を取り出せるまでの秒数（0なら今すぐ取り出せる）"""
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.per_minute
+
+
+class Slot:
+    """RateLimiter.slot() が返す実行枠。実際の使用トークン数を record() で記録する"""
+
+    def __init__(self, estimated_tokens):
+        self.estimated_tokens = estimated_tokens
+        self.used_tokens = None
+
+    def record(self, tokens):
+        self.used_tokens = tokens
+
+
+class RateLimiter:
+    """同時実行数・RPM・TPM の制限と、上限付きの待ち行列"""
+
+    def __init__(self, max_concurrent=8, rpm=500, tpm=300000, max_queue=32, queue_timeout=30):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._counters = {'acquired': 0, 'rejected': 0, 'timeouts': 0, 'wait_seconds': 0.0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_concurrent=int(os.getenv('LLM_MAX_CONCURRENT', 8)),
+            rpm=float(os.getenv('LLM_RPM', 500)),
+            tpm=float(os.getenv('LLM_TPM', 300000)),
+            max_queue=int(os.getenv('LLM_QUEUE_SIZE', 32)),
+            queue_timeout=float(os.getenv('LLM_QUEUE_TIMEOUT_SEC', 30)),
+        )
+
+    def acquire(self, estimated_tokens, timeout=None):
+        """実行枠を確保する（確保できるまで待つ）"""
+        timeout = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+        started = time.monotonic()
+        deadline = started + timeout
+
+        with self._cond:
+            if self._waiting >= self.max_queue:
+                self._counters['rejected'] += 1
+                raise Overloaded("OpenAI呼び出しの待ち行列が一杯です")
+            self._waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._take(estimated_tokens, now, started)
+                    if wait == 0:
+                        return
+
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._counters['timeouts'] += 1
+                        raise Overloaded("OpenAI呼び出しの待ち時間が上限を超えました")
+                    self._cond.wait(remaining if wait is None else min(wait, remaining))
+            finally:
+                self._waiting -= 1
+
+    def try_acquire(self, estimated_tokens):
+        """待たずに確保できればTrue（ヘッジなど、枠がなければやめてよい呼び出し用。release() で返す）
+
+        待っている呼び出しがあれば、その順番を抜かさないよう確保しない。
+        """
+        with self._cond:
+            if self._waiting:
+                return False
+            now = time.monotonic()
+            return self._take(estimated_tokens, now, now) == 0
+
+    def _take(self, estimated_tokens, now, started):
+        """確保できれば確保して0、できなければ待つ秒数（同時実行数の空き待ちはNone）。_cond の中で呼ぶ"""
+        self._requests.refill(now)
+        self._tokens.refill(now)
+        if self._active >= self.max_concurrent:
+            return None  # 実行中の呼び出しが終わるまで待つ
+        wait = max(self._requests.wait_time(1), self._tokens.wait_time(estimated_tokens))
+        if wait == 0:
+            self._requests.level -= 1
+            self._tokens.level -= estimated_tokens
+            self._active += 1
+            self._counters['acquired'] += 1
+            self._counters['wait_seconds'] += now - started
+        return wait
+
+    def release(self, estimated_tokens, used_tokens=None):
+        """実行枠を返す（実際の使用量が分かれば見積もりとの差をTPMに反映）"""
+        with self._cond:
+            self._active -= 1
+            if used_tokens is not None:
+                self._tokens.level -= used_tokens - estimated_tokens
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, estimated_tokens, timeout=None):
+        """with limiter.slot(見積もりトークン数) as slot: の形で使う"""
+        self.acquire(estimated_tokens, timeout)
+        slot = Slot(estimated_tokens)
+        try:
+            yield slot
+        finally:
+            self.release(estimated_tokens, slot.used_tokens)
+
+    def stats(self):
+        with self._cond:
+            return {
+                **self._counters,
+                'active': self._active,
+                'waiting': self._waiting,
+            }
+
+
+class BoundedExecutor:
+    """受付数に上限のある共有スレッドプール"""
+
+    def __init__(self, max_workers=8, max_pending=16):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm')
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._lock = threading.Lock()
+        self._running = 0  # 投入して終わっていない数（待ちを含む）
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_workers=int(os.getenv('LLM_WORKERS', 8)),
+            max_pending=int(os.getenv('LLM_MAX_PENDING', 16)),
+        )
+
+    def submit_all(self, calls):
+        """[(fn, args), ...] をまとめて投入する（全部入らなければ1つも投入せずOverloaded）"""
+        acquired = 0
+        for _ in calls:
+            if not self._slots.acquire(blocking=False):
+                for _ in range(acquired):
+                    self._slots.release()
+                with self._lock:
+                    self.rejected += 1
+                raise Overloaded("サーバーが混雑しています。しばらくしてから再度お試しください")
+            acquired += 1
+
+        with self._lock:
+            self._running += len(calls)
+        return [self._submit(fn, args) for fn, args in calls]
+
+    def try_submit(self, fn, *args):
+        """空いているスレッドがあればすぐに実行する（なければ投入せずNone。待ち行列には入れない）
+
+        生成中の追加の呼び出し（ヘッジ）用。呼び出し元がプールのスレッドで結果を待っていても、
+        待ち行列で詰まらない。
+        """
+        with self._lock:
+            if self._running >= self.max_workers or not self._slots.acquire(blocking=False):
+                return None
+            self._running += 1
+        return self._submit(fn, args)
+
+    def _submit(self, fn, args):
+        # 呼び出し元のコンテキスト（リクエストIDなど）を引き継いで実行する
+        future = self._executor.submit(contextvars.copy_context().run, fn, *args)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, _):
+        with self._lock:
+            self._running -= 1
+        self._slots.release()
@@ -0,0 +1,505 @@
+"""OpenAI呼び出しの通信層（接続プール・呼び出しごとの期限・ヘッジ・サーキットブレーカー）
+
+- 接続プール: httpx の接続数・keep-alive・接続タイムアウトを設定したクライアントを使う。
+  SDKの自動リトライは LLM_MAX_RETRIES 回まで（既定1回）。
+- 期限: リクエストごとに OpenAI 呼び出しに使える時間（LLM_REQUEST_BUDGET_SEC）を
+  contextvars で持ち回り、各呼び出しのタイムアウトは残り時間と LLM_CALL_TIMEOUT_SEC の
+  短い方にする。残りがなければ呼び出さずに DeadlineExceeded（504）。ストリーミングは最初の
+  チャンクの後も同じ期限で打ち切る（期限でストリームを閉じ、読み出し側に DeadlineExceeded）。
+- ヘッジ: 最初の応答（ストリーミングは最初のチャンク）が直近の p90 を過ぎても来なければ、
+  同じ呼び出しをもう1本投げ、先に応答した方を使う（遅い方は閉じる）。
+  追加の呼び出しは全体の LLM_HEDGE_BUDGET（既定10%）まで。
+- サーキットブレーカー: 直近 LLM_BREAKER_WINDOW_SEC 秒の失敗率が LLM_BREAKER_FAILURE_RATE を
+  超えたら LLM_BREAKER_OPEN_SEC 秒は呼び出さずに CircuitOpen（503）。その後1回だけ試し、
+  成功すれば元に戻す。
+
+状態はワーカープロセスごと。
+"""
+import collections
+import contextvars
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+
+import httpx
+import openai
+
+from llm_limiter import Overloaded
+
+
+class CircuitOpen(Overloaded):
+    """OpenAIの障害でサーキットブレーカーが開いている（503で返す）"""
+
+    def __init__(self, message="OpenAIへの接続を一時的に停止しています", retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(TimeoutError):
+    """リクエストの制限時間内に応答がなかった（504で返す）"""
+
+
+# ブレーカーの失敗として数える例外（入力の誤りなど4xxは数えない）
+FAILURE_ERRORS = (
+    openai.APIConnectionError,  # 接続エラー・タイムアウト
+    openai.InternalServerError,
+    openai.RateLimitError,
+    TimeoutError,
+)
+
+# このリクエストで OpenAI 呼び出しに使える期限（time.monotonic() 基準、Noneなら制限なし）
+_deadline = contextvars.ContextVar('llm_deadline', default=None)
+
+
+def set_deadline(seconds):
+    """このリクエスト（コンテキスト）の期限を今から seconds 秒後にする（Noneなら制限なし）"""
+    _deadline.set(time.monotonic() + seconds if seconds else None)
+
+
+def remaining(deadline=None):
+    """リクエストの期限と deadline の早い方までの残り秒数（どちらもなければNone）"""
+    deadlines = [d for d in (_deadline.get(), deadline) if d is not None]
+    if not deadlines:
+        return None
+    return max(min(deadlines) - time.monotonic(), 0.0)
+
+
+def budget(seconds):
+    """seconds 秒とリクエストの残り時間の短い方（生成の制限時間に使う）"""
+    left = remaining()
+    return seconds if left is None else min(seconds, left)
+
+
+class LatencyTracker:
+    """呼び出しの種類ごとの直近の応答時間（ヘッジの待ち時間に使う）"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def observe(self, kind, seconds):
+        with self._lock:
+            self._samples[kind].append(seconds)
+
+    def quantile(self, kind, q):
+        """直近の応答時間の q 分位点（件数が min_samples 未満ならNone）"""
+        with self._lock:
+            samples = sorted(self._samples[kind])
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+class CircuitBreaker:
+    """直近の失敗率で呼び出しを止める（closed → open → half_open → closed）"""
+
+    STATES = ('closed', 'open', 'half_open')
+
+    def __init__(self, failure_rate=0.5, min_calls=10, window=30.0, open_seconds=15.0):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.state = 'closed'
+        self._results = collections.deque()  # (時刻, 成功したか)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._counters = {'opened': 0, 'rejected': 0}
+
+    def _retry_after(self, now):
+        return max(self._opened_at + self.open_seconds - now, 0.0)
+
+    def check(self):
+        """止めていれば CircuitOpen（試しの呼び出しの枠は使わないので、流量制限の待ちの前に呼べる）"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'open':
+                rejected = self._retry_after(now) > 0
+            else:
+                rejected = self.state == 'half_open' and self._probing
+            if not rejected:
+                return
+            self._counters['rejected'] += 1
+            retry_after = max(self._retry_after(now), 1.0)
+        raise CircuitOpen(retry_after=round(retry_after))
+
+    def allow(self):
+        """呼び出してよければ何もせず、止めていれば CircuitOpen"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'closed':
+                return
+            if self.state == 'open' and self._retry_after(now) <= 0:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True  # この1回で回復したか確かめる
+                return
+            self._counters['rejected'] += 1
+            retry_after = max(self._retry_after(now), 1.0)
+        raise CircuitOpen(retry_after=round(retry_after))
+
+    def record(self, ok):
+        """呼び出しの結果を記録し、失敗率に応じて状態を変える"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'half_open':
+                self._probing = False
+                if ok:
+                    self.state = 'closed'
+                    self._results.clear()
+                    print("[TRANSPORT] サーキットブレーカー: 回復", flush=True)
+                else:
+                    self._open(now)
+                return
+            if self.state == 'open':
+                return  # 開く前に始まった呼び出しの結果
+            self._results.append((now, ok))
+            while self._results and self._results[0][0] < now - self.window:
+                self._results.popleft()
+            failures = sum(1 for _, result in self._results if not result)
+            if len(self._results) >= self.min_calls and failures / len(self._results) >= self.failure_rate:
+                self._open(now)
+
+    def _open(self, now):
+        self.state = 'open'
+        self._opened_at = now
+        self._results.clear()
+        self._counters['opened'] += 1
+        print(f"[TRANSPORT] サーキットブレーカー: {self.open_seconds:.0f}秒停止", flush=True)
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, 'state': self.STATES.index(self.state)}
+
+
+class _Attempt:
+    """1本分の呼び出し（ヘッジした場合は2本）を別スレッドで行い、最初の応答を待つ"""
+
+    def __init__(self, results, call, stream):
+        self.results = results
+        self.call = call
+        self.stream = stream
+        self.started = time.monotonic()
+        self.abandoned = False
+        self._lock = threading.Lock()
+        self._response = None
+
+    def start(self):
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._run,), daemon=True).start()
+
+    def _run(self):
+        try:
+            response = self.call()
+            with self._lock:
+                # 最初のチャンクを待っている間に使わないと決まったら、abandon() で閉じられるようにする
+                self._response = response
+                abandoned = self.abandoned
+            if abandoned:
+                _close(response)
+                return
+            first = _first_chunk(response) if self.stream else None
+        except Exception as e:
+            self.results.put((self, 'error', e))
+            return
+        self.results.put((self, 'ok', (response, first)))
+
+    def abandon(self):
+        """応答を使わない（届いていれば閉じ、まだなら届いた時点で閉じる）"""
+        with self._lock:
+            self.abandoned = True
+            response = self._response
+        if response is not None:
+            _close(response)
+
+
+_NO_CHUNK = object()
+
+
+def _first_chunk(stream):
+    iterator = iter(stream)
+    return iterator, next(iterator, _NO_CHUNK)
+
+
+def _close(response):
+    close = getattr(response, 'close', None)
+    if close is not None:
+        close()
+
+
+class _Watchdog:
+    """期限に関数を呼ぶ共有スレッド（ストリームごとにスレッドを作らない）"""
+
+    def __init__(self):
+        self._heap = []  # [期限, 順番, 関数]（取り消したものは関数がNone）
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, deadline, fn):
+        entry = [deadline, next(self._order), fn]
+        with self._cond:
+            heapq.heappush(self._heap, entry)
+            # fork後の子プロセスにはスレッドが引き継がれないので、なければ起動する
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name='llm-watchdog')
+                self._thread.start()
+            self._cond.notify()
+        return entry
+
+    def cancel(self, entry):
+        with self._cond:
+            entry[2] = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._heap and self._heap[0][2] is None:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                wait = self._heap[0][0] - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                fn = heapq.heappop(self._heap)[2]
+            try:
+                fn()
+            except Exception as e:
+                print(f"[TRANSPORT] 期限の処理でエラー: {e}", flush=True)
+
+
+_watchdog = _Watchdog()
+
+
+class HedgedStream:
+    """先に最初のチャンクが届いたストリーム（受信済みのチャンクから順に返す）
+
+    deadline（time.monotonic() 基準）を過ぎたらストリームを閉じ、読み出し側に DeadlineExceeded を投げる
+    （最初のチャンクの後に止まったストリームも、httpx の読み取りタイムアウトを待たずに打ち切る）。
+    """
+
+    def __init__(self, stream, iterator, first, deadline=None, on_expire=None):
+        self._stream = stream
+        self._iterator = iterator
+        self._first = first
+        self._on_expire = on_expire
+        self._expired = False
+        self._timer = _watchdog.schedule(deadline, self._expire) if deadline is not None else None
+
+    def _expire(self):
+        self._expired = True
+        if self._on_expire is not None:
+            self._on_expire()
+        _close(self._stream)
+
+    def __iter__(self):
+        try:
+            if self._first is not _NO_CHUNK:
+                yield self._first
+            for chunk in self._iterator:
+                if self._expired:
+                    break
+                yield chunk
+        except Exception:
+            # 閉じたストリームの読み取りエラー（接続の切断など）は期限切れとして返す
+            if not self._expired:
+                raise
+        finally:
+            self._cancel()
+        if self._expired:
+            raise DeadlineExceeded("OpenAIの応答がタイムアウトしました（ストリーミングの途中）")
+
+    def _cancel(self):
+        if self._timer is not None:
+            _watchdog.cancel(self._timer)
+            self._timer = None
+
+    def close(self):
+        self._cancel()
+        _close(self._stream)
+
+
+class Transport:
+    """OpenAI呼び出しの期限・ヘッジ・サーキットブレーカー（create() で呼ぶ）"""
+
+    def __init__(self, call_timeout=60.0, connect_timeout=5.0, max_retries=1, pool_size=32,
+                 keepalive=30.0, hedge_quantile=0.9, hedge_min_delay=0.5, hedge_budget=0.1,
+                 tracker=None, breaker=None):
+        self.call_timeout = call_timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_budget = hedge_budget  # 0ならヘッジしない
+        self.tracker = tracker or LatencyTracker()
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self._counters = {'calls': 0, 'hedges': 0, 'hedge_wins': 0, 'hedges_limited': 0, 'failures': 0,
+                          'deadline_exceeded': 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            call_timeout=float(os.getenv('LLM_CALL_TIMEOUT_SEC', 60)),
+            connect_timeout=float(os.getenv('LLM_CONNECT_TIMEOUT_SEC', 5)),
+            max_retries=int(os.getenv('LLM_MAX_RETRIES', 1)),
+            pool_size=int(os.getenv('LLM_POOL_SIZE', 32)),
+            keepalive=float(os.getenv('LLM_KEEPALIVE_SEC', 30)),
+            hedge_quantile=float(os.getenv('LLM_HEDGE_QUANTILE', 0.9)),
+            hedge_min_delay=float(os.getenv('LLM_HEDGE_MIN_DELAY_SEC', 0.5)),
+            hedge_budget=float(os.getenv('LLM_HEDGE_BUDGET', 0.1)),
+            breaker=CircuitBreaker(
+                failure_rate=float(os.getenv('LLM_BREAKER_FAILURE_RATE', 0.5)),
+                min_calls=int(os.getenv('LLM_BREAKER_MIN_CALLS', 10)),
+                window=float(os.getenv('LLM_BREAKER_WINDOW_SEC', 30)),
+                open_seconds=float(os.getenv('LLM_BREAKER_OPEN_SEC', 15)),
+            ),
+        )
+
+    def client_options(self):
+        """OpenAI(...) に渡す接続プール・タイムアウト・リトライの設定"""
+        http_client = openai.DefaultHttpxClient(
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size,
+                                keepalive_expiry=self.keepalive),
+            timeout=httpx.Timeout(self.call_timeout, connect=self.connect_timeout),
+        )
+        return {'http_client': http_client, 'max_retries': self.max_retries}
+
+    def _timeout(self, deadline, timeout):
+        """この呼び出しのタイムアウト（リクエストの残り時間まで）"""
+        left = remaining(deadline)
+        seconds = min(timeout or self.call_timeout, self.call_timeout)
+        if left is not None:
+            if left <= 0:
+                self._count('deadline_exceeded')
+                raise DeadlineExceeded("リクエストの制限時間を超えました")
+            seconds = min(seconds, left)
+        return seconds
+
+    def _hedge_delay(self, kind):
+        if self.hedge_budget <= 0:
+            return None
+        p = self.tracker.quantile(kind, self.hedge_quantile)
+        if p is None:
+            return None
+        return max(p, self.hedge_min_delay)
+
+    def _take_hedge(self, limiter, estimated_tokens):
+        """ヘッジの予算と流量制限の空き（待たない）があれば確保してTrue"""
+        with self._lock:
+            if self._counters['hedges'] >= self.hedge_budget * self._counters['calls']:
+                return False
+            if limiter is not None and not limiter.try_acquire(estimated_tokens):
+                self._counters['hedges_limited'] += 1
+                return False
+            self._counters['hedges'] += 1
+            return True
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def create(self, client, kind, deadline=None, timeout=None, limiter=None, estimated_tokens=0, **params):
+        """client.chat.completions.create(**params) を期限・ヘッジ・ブレーカー付きで呼ぶ
+
+        kind: 応答時間を分けて記録する呼び出しの種類（generation / evaluation）
+        deadline: この呼び出しの期限（time.monotonic() 基準）。リクエストの期限と早い方を使う
+        timeout: この呼び出しのタイムアウト（秒、LLM_CALL_TIMEOUT_SEC まで）
+        limiter: ヘッジの呼び出しも流量制限（RateLimiter）に estimated_tokens で数える。
+            空きがなければヘッジしない。1本目の枠は呼び出し側で確保しておくこと
+        ストリーミングでは最初のチャンクが届いた時点で返す。
+        """
+        seconds = self._timeout(deadline, timeout)
+        self.breaker.allow()
+        self._count('calls')
+        stream = bool(params.get('stream'))
+        call_deadline = time.monotonic() + seconds
+        hedge_delay = self._hedge_delay(kind)
+        if hedge_delay is not None and hedge_delay >= seconds:
+            hedge_delay = None
+
+        results = queue.Queue()
+
+        def launch():
+            attempt = _Attempt(results, lambda: client.chat.completions.create(
+                timeout=max(call_deadline - time.monotonic(), 0.001), **params), stream)
+            attempt.start()
+            return attempt
+
+        attempts = [launch()]
+        hedge_slot = False  # ヘッジのために確保した流量制限の枠（返った時点で1本に戻るので返す）
+        error = None
+        try:
+            while True:
+                now = time.monotonic()
+                wait = call_deadline - now
+                if wait <= 0:
+                    raise DeadlineExceeded("OpenAIの応答がタイムアウトしました")
+                hedge_at = None
+                if hedge_delay is not None and len(attempts) == 1:
+                    hedge_at = attempts[0].started + hedge_delay
+                    wait = min(wait, max(hedge_at - now, 0))
+                try:
+                    attempt, status, payload = results.get(timeout=wait)
+                except queue.Empty:
+                    if hedge_at is not None and time.monotonic() >= hedge_at:
+                        hedge_delay = None
+                        if self._take_hedge(limiter, estimated_tokens):
+                            hedge_slot = limiter is not None
+                            print(f"[TRANSPORT] {kind}: {hedge_at - attempts[0].started:.1f}秒応答がないため追加で呼び出し",
+                                  flush=True)
+                            attempts.append(launch())
+                    continue
+                if status == 'error':
+                    error = error or payload
+                    attempt.abandoned = True
+                    if all(a.abandoned for a in attempts):
+                        raise error
+                    continue
+                break
+        except Exception as e:
+            for a in attempts:
+                a.abandon()
+            if isinstance(e, DeadlineExceeded):
+                self._count('deadline_exceeded')
+            if isinstance(e, FAILURE_ERRORS):
+                self._count('failures')
+                self.breaker.record(False)
+            else:
+                self.breaker.record(True)  # 入力の誤りなどOpenAIの障害ではないもの
+            raise
+        finally:
+            if hedge_slot:
+                limiter.release(estimated_tokens)
+
+        for a in attempts:
+            if a is not attempt:
+                a.abandon()
+        if attempt is not attempts[0]:
+            self._count('hedge_wins')
+        self.tracker.observe(kind, time.monotonic() - attempt.started)
+        self.breaker.record(True)
+        response, first = payload
+        if stream:
+            iterator, chunk = first
+            return HedgedStream(response, iterator, chunk, deadline=call_deadline,
+                                on_expire=lambda: self._count('deadline_exceeded'))
+        return response
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        breaker = self.breaker.stats()
+        stats['breaker_state'] = breaker['state']
+        stats['breaker_opened'] = breaker['opened']
+        stats['breaker_rejected'] = breaker['rejected']
+        return stats
@@ -0,0 +1,265 @@
+"""計測（段階ごとの所要時間・トークン数・件数）と構造化ログ
+
+- Counter / Histogram: Prometheusのテキスト形式で /metrics に出力する
+- gauge(): キャッシュや待ち行列の stats() のように、出力時に値を読むもの
+- リクエストごとのID・段階ごとの所要時間を contextvars で持ち回り、
+  JSON形式のログ（1行1イベント）に付ける
+
+記録はロック1回と加算だけなので、リクエスト処理への影響はほぼない。
+値はプロセスごと（gunicornの複数ワーカーではワーカーごとの値になる）。
+"""
+import bisect
+import contextvars
+import functools
+import json
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# 秒単位のヒストグラムの既定の区切り（OpenAIの呼び出しは数十秒かかるため長めまで持つ）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """増えるだけの値（ラベルの組み合わせごと）"""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Histogram:
+    """値の分布（区切りごとの件数・合計・件数）"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # ラベル → [区切りごとの件数..., 区切りを超えた件数], 合計
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, [('le', _format_value(float(bound)))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}"
+
+
+class Gauge:
+    """出力時に関数を呼んで値を読む（数値、または {ラベルの値: 数値} を返す関数）"""
+
+    type = 'gauge'
+
+    def __init__(self, name, help, fn, labels=()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = tuple(labels)
+
+    def samples(self):
+        value = self.fn()
+        if isinstance(value, dict):
+            for key, item in sorted(value.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(item)}"
+        elif value is not None:
+            yield f"{self.name} {_format_value(value)}"
+
+
+class Registry:
+    """メトリクスの一覧（/metrics に出力する順）"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheusのテキスト形式"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                # 1つの値の取得に失敗しても他は出力する
+                print(f"[METRICS] {metric.name} の取得エラー: {e}", flush=True)
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labels=()):
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+
+def gauge(name, help, fn, labels=()):
+    return REGISTRY.register(Gauge(name, help, fn, labels))
+
+
+def stats_gauges(prefix, help, stats):
+    """stats() が返すdictの数値の項目を、それぞれ <prefix>_<項目名> のゲージにする"""
+    for name, value in stats().items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            gauge(f"{prefix}_{name}", f"{help}: {name}", lambda name=name: stats().get(name))
+
+
+def render():
+    return REGISTRY.render()
+
+
+# --- リクエスト単位の情報 ---
+
+STAGE_SECONDS = histogram('stage_duration_seconds', '処理段階ごとの所要時間（秒）', labels=('stage',))
+
+
+class RequestContext:
+    """1リクエスト（または一括ジョブの1行）分のIDと段階ごとの所要時間"""
+
+    def __init__(self, request_id):
+        self.id = request_id
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage, seconds):
+        # 並列に実行した段階（similar/randomの生成など）は合計する
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def stage_millis(self):
+        with self._lock:
+            return {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()}
+
+
+_current = contextvars.ContextVar('metrics_request', default=None)
+
+
+def start_request(request_id=None):
+    """現在のコンテキストでリクエストを開始する（不正なIDは新しく振り直す）"""
+    if not request_id or not REQUEST_ID_PATTERN.match(request_id):
+        request_id = uuid.uuid4().hex[:16]
+    context = RequestContext(request_id)
+    _current.set(context)
+    return context
+
+
+def current_request():
+    return _current.get()
+
+
+def record_stage(stage, seconds):
+    """段階の所要時間を記録（ヒストグラムと、現在のリクエストの内訳）"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    context = _current.get()
+    if context is not None:
+        context.add_stage(stage, seconds)
+
+
+@contextmanager
+def stage(name):
+    """with metrics.stage('retrieval'): の形で所要時間を記録する（例外時も記録）"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def timed(name):
+    """関数の所要時間を段階 name として記録するデコレータ"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def log(event, **fields):
+    """JSON形式のログを1行出力（現在のリクエストIDを付ける）"""
+    context = _current.get()
+    record = {'ts': round(time.time(), 3), 'event': event}
+    if context is not None:
+        record['request_id'] = context.id
+    record.update(fields)
+    print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
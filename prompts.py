@@ -0,0 +1,203 @@
+"""OpenAIに送るプロンプトの組み立てとトークン数の見積もり
+
+プロバイダのプロンプトキャッシュ（先頭が一致するプロンプトの処理を省く）に当たりやすいよう、
+メッセージは変わらない部分から順に並べる。
+
+1. system: 役割と指示（手順・制約・文字数・文体）。入力によらず常に同じ文字列
+2. user:   参考サンプル（同じリクエストのリトライ・先行リクエストでは同じ）
+3. user の末尾: ポジション・業界・部門・担当領域と件数（リクエストごとに変わる）
+
+参考サンプルはトークン数の上限（REFERENCE_TOKEN_BUDGET。5件あたりで、件数に比例）に収まるよう、
+近似重複を除き、長すぎるものを切り詰めてから入れる。
+トークン数は送信前にローカルで見積もる（日本語はおおよそ1文字1トークン、英数字は4文字で1トークン）。
+モデルのトークナイザー（tiktoken）は使わない概算なので、流量制限の予約と参考サンプルの上限の目安に使い、
+実際の使用量は応答の usage で補正する（bench.prompts で見積もりと usage の差を確認できる）。
+
+文面を変えたら app.py の PROMPT_VERSION を上げること（生成結果のキャッシュが作り直される）。
+"""
+import functools
+import math
+import os
+
+from dedupe import NearDuplicates, normalize, signature
+
+# 参考サンプル全体と1件あたりのトークン数の上限
+# 参考サンプル REFERENCE_SAMPLE_COUNT 件分の上限（件数の多い呼び出しは件数に比例して増やす）
+REFERENCE_TOKEN_BUDGET = int(os.getenv('REFERENCE_TOKEN_BUDGET', 400))
+REFERENCE_SAMPLE_COUNT = 5
+MAX_SAMPLE_TOKENS = int(os.getenv('REFERENCE_MAX_SAMPLE_TOKENS', 100))
+
+# メッセージ1件ごとの区切りと、応答の開始に使われるトークン数（OpenAIのchat形式の目安）
+MESSAGE_OVERHEAD = 3
+REPLY_OVERHEAD = 3
+
+GENERATION_SYSTEM = """あなたは米国ビザ申請書に適した職務内容を日本語で生成するアシスタントです。
+
+【ステップ1: 特徴の分析】
+まず、【条件】について以下の点を考えてください（出力不要）：
+- 業界の特徴は何か（市場環境、規制、競争要因など）
+- 部門で重要な業務領域は何か
+- ポジションとして期待される役割・責任は何か
+- 担当領域があれば、その領域で特に重要な業務は何か
+- アメリカで行う業務として適切な内容は何か
+
+【ステップ2: 職務内容の生成】
+上記の分析を踏まえて、この組み合わせに特有の職務内容を生成してください。
+
+【重要な制約】
+- これはアメリカで行う業務内容です。
+- 参考サンプルの「内容」は完全に無視してください。参考サンプルは異なる業界・部門のものが含まれています。
+- 参考サンプルから学ぶべきは「文体」「1文あたりの長さ」「具体性のレベル」「表現パターン」のみです。
+- 生成する内容は、必ず【条件】の業界・部門の業務に限定してください。
+- 業界・部門・ポジションの特徴を反映した具体的な内容にしてください。
+
+【文字数の厳守（最重要）】
+- 各項目は「最低50文字以上」で記述すること。50文字未満の出力は絶対に不可。
+- 目標は60〜80文字。短い文は具体的な情報を追加して必ず50文字以上にすること。
+- 例：「営業戦略を立案」(8文字)→NG、「北米市場における新規顧客開拓に向けた営業戦略の立案と、四半期ごとの売上目標達成に向けたアクションプランの策定」(65文字)→OK
+
+【具体性の確保】
+- 必ず含めるべき要素：対象（製品/市場/顧客層）、手法・プロセス、目的・成果
+- 業界特有の専門用語、規制名、システム名などを積極的に使用すること
+
+【文体の制約】
+- 必ず日本語で出力すること（英語や中国語など他の言語は使用しないこと）
+- 文体は「です・ます調」ではなく、体言止めや「~する」などの常体で統一すること
+- 文末表現は「~を行う」「~に関与」「~を担当」「~の実施」「~を図る」「~を推進」などを使用すること
+- 番号付きリストで出力すること（分析結果は出力せず、職務内容のみ出力）"""
+
+EVALUATION_SYSTEM = """あなたは職務内容の品質を評価する専門家です。JSON形式で回答してください。
+ユーザーが示す入力条件と、2つのパターン（A・B）で生成された職務内容を比較して評価してください。
+
+【評価基準】
+1. 業界特性の反映: 指定された業界特有の業務内容が含まれているか
+2. 部門特性の反映: 指定された部門の典型的な業務が含まれているか
+3. ポジション特性の反映: 指定されたポジションとしての役割・責任が適切か
+4. 担当領域の反映: 担当領域が指定されていれば、それに関連する業務が含まれているか
+5. 具体性: 抽象的でなく、具体的な業務内容になっているか
+6. 多様性: 似たような内容の繰り返しがなく、多様な業務が含まれているか
+
+【出力形式】
+以下のJSON形式で出力してください（他の文章は不要）:
+{
+  "winner": "A" または "B" または "同等",
+  "score_a": 1-10の整数,
+  "score_b": 1-10の整数,
+  "reason": "選んだ理由を1-2文で簡潔に"
+}"""
+
+
+def count_tokens(text):
+    """テキストのトークン数の見積もり（英数字・記号は4文字で1トークン、それ以外は1文字1トークン）
+
+    モデルのトークナイザーで数えた値ではない概算（実際の使用量は usage で確認する）。
+    """
+    if not text:
+        return 0
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return (len(text) - ascii_chars) + math.ceil(ascii_chars / 4)
+
+
+def count_message_tokens(messages):
+    """メッセージ全体のトークン数の見積もり（送信前の流量制限・ログに使う）"""
+    return sum(count_tokens(message['content']) + MESSAGE_OVERHEAD for message in messages) + REPLY_OVERHEAD
+
+
+def truncate(text, max_tokens):
+    """max_tokens に収まるよう切り詰める（句点・読点があればそこで切る）"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    used = 0.0
+    end = 0
+    for end, char in enumerate(text):
+        used += 0.25 if char.isascii() else 1
+        if used > max_tokens - 1:  # 末尾の「…」の分
+            break
+    cut = text[:end]
+    # 後半にある最後の句読点で切る（なければそのまま）
+    stop = max(cut.rfind('。'), cut.rfind('、'))
+    if stop >= len(cut) // 2:
+        cut = cut[:stop]
+    return cut + '…'
+
+
+def select_references(samples, limit, budget=None, max_sample_tokens=None):
+    """プロンプトに入れる参考サンプルを選ぶ（samples はタプル）
+
+    先頭から順に、近似重複を除き、長すぎるものは切り詰め、合計がトークン数の上限を
+    超える手前まで最大 limit 件。(選んだサンプルのタプル, 件数の内訳) を返す。
+    上限の既定は REFERENCE_TOKEN_BUDGET を limit 件分に比例させたもの（5件未満でも減らさない）。
+    件数の内訳は呼び出しごとの新しい辞書（書き換えてもキャッシュには影響しない）。
+    """
+    selected, counts = _select_references(samples, limit, budget, max_sample_tokens)
+    return selected, dict(counts)
+
+
+@functools.lru_cache(maxsize=256)
+def _select_references(samples, limit, budget, max_sample_tokens):
+    if budget is None:
+        budget = REFERENCE_TOKEN_BUDGET * max(limit, REFERENCE_SAMPLE_COUNT) // REFERENCE_SAMPLE_COUNT
+    max_sample_tokens = MAX_SAMPLE_TOKENS if max_sample_tokens is None else max_sample_tokens
+    counts = {'used': 0, 'duplicate': 0, 'truncated': 0, 'over_budget': 0}
+    selected = []
+    seen = NearDuplicates()
+    used_tokens = 0
+    for sample in samples:
+        if len(selected) >= limit:
+            break
+        if not sample or not normalize(sample):
+            continue
+        sig = signature(sample)
+        if seen.find(sig) is not None:
+            counts['duplicate'] += 1
+            continue
+        seen.add(sample, sig)
+        text = truncate(sample, max_sample_tokens)
+        if text != sample:
+            counts['truncated'] += 1
+        tokens = count_tokens(text) + 2  # 番号と改行
+        if used_tokens + tokens > budget:
+            # 以降は入れない（並び順は検索の優先度なので、後ろの短いもので埋めない）
+            counts['over_budget'] += 1
+            break
+        selected.append(text)
+        used_tokens += tokens
+    counts['used'] = len(selected)
+    return tuple(selected), counts
+
+
+def generation_messages(position, industry, department, area, references=(), count=10):
+    """職務内容生成用のメッセージ（references は select_references() で選んだもの）"""
+    parts = []
+    if references:
+        lines = '\n'.join(f"{i}. {sample}" for i, sample in enumerate(references, 1))
+        parts.append(f"【フォーマット参考サンプル】以下は文体・長さ・具体性のレベルの参考例です:\n{lines}")
+
+    conditions = [f"- ポジション:{position}", f"- 業界:{industry}", f"- 部門:{department}"]
+    if area:
+        conditions.append(f"- 担当領域:{area}")
+    parts.append("【条件】\n" + '\n'.join(conditions))
+    parts.append(f"この条件に特有の職務内容{count}件を番号付きリストで出力してください。")
+
+    return [
+        {"role": "system", "content": GENERATION_SYSTEM},
+        {"role": "user", "content": '\n\n'.join(parts)},
+    ]
+
+
+def evaluation_messages(position, industry, department, area, similar_results, random_results):
+    """2パターンの評価用のメッセージ"""
+    conditions = [f"- ポジション: {position}", f"- 業界: {industry}", f"- 部門: {department}"]
+    if area:
+        conditions.append(f"- 担当領域: {area}")
+    pattern_a = '\n'.join(f"{i}. {item}" for i, item in enumerate(similar_results, 1))
+    pattern_b = '\n'.join(f"{i}. {item}" for i, item in enumerate(random_results, 1))
+    content = (
+        "【入力条件】\n" + '\n'.join(conditions)
+        + f"\n\n【パターンA: 似た業界・部門を参照】\n{pattern_a}"
+        + f"\n\n【パターンB: ランダムサンプルを参照】\n{pattern_b}"
+    )
+    return [
+        {"role": "system", "content": EVALUATION_SYSTEM},
+        {"role": "user", "content": content},
+    ]
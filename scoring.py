@@ -0,0 +1,165 @@
+"""生成結果のローカル評価（OpenAIを呼ばず、数ミリ秒で2パターンを採点する）
+
+評価項目（それぞれ0〜1）:
+- length:    文字数（50文字未満は0、目標の60〜80文字で1）と、件数が揃っているか
+- diversity: 項目どうしの文字2-gramのJaccard係数の平均を1から引いたもの（似た項目の繰り返しが少ないほど高い）
+- coverage:  業界・部門・担当領域のキーワード（文字2-gram）が項目に含まれている割合
+- style:     日本語の常体で書かれているか（です・ます調・英語の項目は減点）
+
+両パターンの全項目とキーワードを1つの2-gram行列にして、重なりを行列積でまとめて計算する。
+総合点は項目の加重平均を1〜10点にしたもの（AIの評価の score_a / score_b と同じ尺度）。
+"""
+import re
+
+import numpy as np
+
+MIN_CHARS = 50
+TARGET_CHARS = (60, 80)
+
+WEIGHTS = {'length': 0.3, 'diversity': 0.25, 'coverage': 0.3, 'style': 0.15}
+LABELS = {'length': '文字数', 'diversity': '多様性', 'coverage': '業界・部門の反映', 'style': '文体'}
+
+# 総合点の差がこれ未満なら「同等」
+TIE_MARGIN = 0.3
+
+POLITE_ENDING = re.compile(r'(です|ます|ました|ません|でした|ください)[。．.]?$')
+LATIN = re.compile(r'[A-Za-z]')
+KEYWORD_SEPARATORS = re.compile(r'[\s、,，/・]+')
+
+
+def bigrams(text):
+    """文字2-gramの集合（1文字のテキストはその文字だけ）"""
+    text = re.sub(r'\s+', '', text or '')
+    if len(text) < 2:
+        return {text} if text else set()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def split_keywords(values):
+    """業界・部門・担当領域の入力からキーワードのリストを作る（重複・空を除く）"""
+    keywords = []
+    for value in values:
+        for word in KEYWORD_SEPARATORS.split(value or ''):
+            if word and word not in keywords:
+                keywords.append(word)
+    return keywords
+
+
+def _incidence(texts, vocabulary):
+    """texts × 2-gram の0/1行列"""
+    matrix = np.zeros((len(texts), len(vocabulary)), dtype=np.float32)
+    for row, text in enumerate(texts):
+        columns = [vocabulary[gram] for gram in bigrams(text)]
+        matrix[row, columns] = 1.0
+    return matrix
+
+
+def length_scores(lengths):
+    """項目ごとの文字数の点（50文字未満は0、目標の範囲で1、長すぎるものは少し減点）"""
+    low, high = TARGET_CHARS
+    return np.select(
+        [lengths < MIN_CHARS, lengths < low, lengths <= high, lengths <= high * 1.5],
+        [0.0, 0.8, 1.0, 0.8],
+        default=0.5,
+    )
+
+
+def style_scores(items):
+    """項目ごとの文体の点（常体の日本語なら1）"""
+    scores = np.ones(len(items))
+    for i, item in enumerate(items):
+        text = item.strip()
+        if POLITE_ENDING.search(text):
+            scores[i] = 0.5
+        if len(LATIN.findall(text)) > len(text) * 0.3:
+            scores[i] = 0.0
+    return scores
+
+
+def _pattern_scores(rows, overlap, sizes, keyword_hits, lengths, styles, expected):
+    """1パターン分の評価項目（rows: 行列の中でのこのパターンの行）"""
+    count = len(rows)
+    if count == 0:
+        return {name: 0.0 for name in WEIGHTS}
+
+    length = float(length_scores(lengths[rows]).mean()) * min(count / expected, 1.0)
+
+    if count > 1:
+        inter = overlap[np.ix_(rows, rows)]
+        union = sizes[rows][:, None] + sizes[rows][None, :] - inter
+        jaccard = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+        pairs = np.triu_indices(count, k=1)
+        diversity = 1.0 - float(jaccard[pairs].mean())
+    else:
+        diversity = 1.0
+
+    # キーワードがなければ全項目が満たしているとみなす
+    coverage = float(keyword_hits[rows].max(axis=1).mean()) if keyword_hits.shape[1] else 1.0
+
+    return {
+        'length': round(length, 3),
+        'diversity': round(diversity, 3),
+        'coverage': round(coverage, 3),
+        'style': round(float(styles[rows].mean()), 3),
+    }
+
+
+def total_score(scores):
+    """評価項目の加重平均を1〜10点にする"""
+    total = sum(WEIGHTS[name] * scores[name] for name in WEIGHTS)
+    return round(1 + 9 * total, 1)
+
+
+def score_patterns(items_a, items_b, keywords=(), expected=10):
+    """2パターンの評価項目を計算し、(Aの項目, Bの項目) を返す"""
+    items = [item or '' for item in list(items_a) + list(items_b)]
+    keywords = [keyword for keyword in keywords if keyword]
+
+    vocabulary = {}
+    for text in items + keywords:
+        for gram in bigrams(text):
+            vocabulary.setdefault(gram, len(vocabulary))
+
+    matrix = _incidence(items, vocabulary)
+    sizes = matrix.sum(axis=1)
+    overlap = matrix @ matrix.T
+    if keywords:
+        keyword_matrix = _incidence(keywords, vocabulary)
+        # 項目 × キーワード: キーワードの2-gramのうち項目に含まれる割合
+        keyword_hits = (matrix @ keyword_matrix.T) / np.maximum(keyword_matrix.sum(axis=1), 1.0)
+    else:
+        keyword_hits = np.zeros((len(items), 0), dtype=np.float32)
+    lengths = np.array([len(item) for item in items])
+    styles = style_scores(items)
+
+    rows_a = np.arange(len(items_a))
+    rows_b = np.arange(len(items_a), len(items))
+    common = (overlap, sizes, keyword_hits, lengths, styles, expected)
+    return _pattern_scores(rows_a, *common), _pattern_scores(rows_b, *common)
+
+
+def evaluate(items_a, items_b, keywords=(), expected=10):
+    """AIの評価と同じ形式（winner / score_a / score_b / reason）で2パターンを比較する"""
+    scores_a, scores_b = score_patterns(items_a, items_b, keywords, expected)
+    score_a, score_b = total_score(scores_a), total_score(scores_b)
+
+    if abs(score_a - score_b) < TIE_MARGIN:
+        winner = '同等'
+        reason = '文字数・多様性・業界と部門の反映・文体の自動評価で差がほとんどありません。'
+    else:
+        winner = 'A' if score_a > score_b else 'B'
+        better, worse = (scores_a, scores_b) if winner == 'A' else (scores_b, scores_a)
+        # 点差への寄与が大きい項目を理由にする
+        gains = sorted(WEIGHTS, key=lambda name: WEIGHTS[name] * (better[name] - worse[name]), reverse=True)
+        strengths = [LABELS[name] for name in gains[:2] if better[name] > worse[name]]
+        reason = f"自動評価で{'・'.join(strengths)}の点が上回りました。"
+
+    return {
+        'winner': winner,
+        'score_a': score_a,
+        'score_b': score_b,
+        'reason': reason,
+        'judge': 'local',
+        'local_scores': {'A': scores_a, 'B': scores_b},
+    }
+
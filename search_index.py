@@ -0,0 +1,89 @@
+"""カテゴリ列（業界・部門・ポジション）の文字n-gram転置インデックス
+
+カテゴリ列は値の種類が少ない（数十種類）ため、行ごとではなく値ごとに
+n-gramの転置リストを作り、パターンに一致する値を求める。行の判定は
+カテゴリ型の整数コードを「一致する値か」の表で引くだけ（行数分のベクトル演算1回）で、
+結果は行数と同じ長さの真偽値配列（| や & で組み合わせられる）。
+判定は pandas の ``str.contains(pattern, case=False, na=False)`` と同じ
+（正規表現・大文字小文字無視・文字列以外は不一致）。
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+# これらを含むパターンは正規表現として扱い、n-gramでの絞り込みを行わない
+REGEX_CHARS = set('.^$*+?{}[]\\|()')
+
+
+def ngrams(text, n):
+    """文字n-gramの集合を返す"""
+    if len(text) < n:
+        return set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class ColumnIndex:
+    """1列分のインデックス"""
+
+    def __init__(self, series, n=2):
+        self.n = n
+        if not isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype('category')
+        self.values = list(series.cat.categories)
+        # 行ごとの値ID（NaNは-1。表の最後の要素＝常に不一致を引く）
+        self.codes = series.cat.codes.to_numpy()
+        # pandasのstr.containsは文字列以外（NaNや数値）を不一致とする
+        self.string_ids = [value_id for value_id, value in enumerate(self.values) if isinstance(value, str)]
+        self.all_rows = self._rows(self.string_ids)
+
+        # n-gram → その n-gram を含む値のID
+        self.postings = {}
+        for value_id in self.string_ids:
+            for gram in ngrams(self.values[value_id].lower(), n):
+                self.postings.setdefault(gram, set()).add(value_id)
+
+    def candidates(self, pattern):
+        """n-gramの積集合で候補となる値IDを絞り込む"""
+        if REGEX_CHARS.intersection(pattern):
+            return self.string_ids
+        grams = ngrams(pattern.lower(), self.n)
+        if not grams:
+            return self.string_ids
+
+        result = None
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if not posting:
+                return ()
+            result = set(posting) if result is None else result & posting
+            if not result:
+                return ()
+        return result
+
+    def _rows(self, value_ids):
+        """値IDのいずれかに該当する行の真偽値配列"""
+        table = np.zeros(len(self.values) + 1, dtype=bool)
+        table[list(value_ids)] = True
+        return table[self.codes]
+
+    def match(self, pattern):
+        """パターンに一致する行の真偽値配列を返す"""
+        if not pattern:
+            return self.all_rows.copy()
+
+        # n-gramが揃っていても部分文字列とは限らないので、候補は必ず正規表現で確認する
+        regex = re.compile(pattern, flags=re.IGNORECASE)
+        return self._rows(value_id for value_id in self.candidates(pattern)
+                          if regex.search(self.values[value_id]))
+
+
+class CategoryIndex:
+    """複数のカテゴリ列に対するインデックス"""
+
+    def __init__(self, df, columns, n=2):
+        self.columns = {column: ColumnIndex(df[column], n) for column in columns}
+
+    def match(self, column, pattern):
+        """df[column].str.contains(pattern, na=False, case=False) と同じ行の真偽値配列を返す"""
+        return self.columns[column].match(pattern)
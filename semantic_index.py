@@ -0,0 +1,227 @@
+"""職務内容の類似検索インデックス（文字n-gram TF-IDF）
+
+業界・部門の部分一致では、データにない語（例: 「半導体」「倉庫」）を入力すると
+参考サンプルがランダムになってしまう。職務内容の本文とカテゴリ名から
+文字n-gramのTF-IDFベクトルを作っておき、入力とのコサイン類似度で上位を返す。
+
+n-gramはハッシュで固定次元に落とし、特徴量ごとの転置リスト（CSC形式の疎行列）として
+data/semantic/ に .npy で保存する。起動時はメモリマップで読むだけなので、
+gunicornの各ワーカーで同じページを共有できる。
+
+    python semantic_index.py          # インデックスを作成（ビルド時に実行）
+    python semantic_index.py --check  # インデックスが現在のデータと一致するか確認
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import zlib
+from collections import Counter
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_DIR = os.path.join(BASE_DIR, 'data', 'semantic')
+
+# 形式やパラメータを変えたら上げる（古いインデックスは自動的に無視される）
+INDEX_FORMAT = '1'
+N_FEATURES = 2 ** 18
+NGRAM_RANGE = (1, 3)
+
+TEXT_COLUMNS = ['業界', '部門', '職務内容']
+ARRAYS = ('indptr', 'indices', 'data', 'idf')
+
+
+def document_text(row):
+    """1行分の検索対象テキスト（カテゴリ名 + 職務内容）"""
+    return ' '.join(value for value in row if isinstance(value, str))
+
+
+def document_texts(df):
+    return [document_text(row) for row in df[TEXT_COLUMNS].itertuples(index=False)]
+
+
+def text_digest(texts):
+    """インデックスの元になったテキストのSHA-256（データが変わったら作り直す）"""
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def features(text):
+    """文字n-gramをハッシュした特徴量ID → 出現回数"""
+    text = text.lower()
+    counts = Counter()
+    for word in text.split():
+        for n in range(NGRAM_RANGE[0], NGRAM_RANGE[1] + 1):
+            for i in range(len(word) - n + 1):
+                counts[zlib.crc32(word[i:i + n].encode('utf-8')) % N_FEATURES] += 1
+    return counts
+
+
+def build(texts):
+    """テキストのリストからインデックスの配列を作る"""
+    doc_features = [features(text) for text in texts]
+
+    # IDF（scikit-learnのsmooth_idfと同じ式）
+    document_frequency = np.zeros(N_FEATURES, dtype=np.int64)
+    for counts in doc_features:
+        document_frequency[list(counts)] += 1
+    idf = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(np.float32)
+
+    # 行ごとに sublinear TF × IDF を計算してL2正規化し、(特徴量, 行, 重み) を集める
+    columns, rows, weights = [], [], []
+    for row, counts in enumerate(doc_features):
+        if not counts:
+            continue
+        ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        vector = (1 + np.log(tf)) * idf[ids]
+        vector /= np.linalg.norm(vector)
+        columns.append(ids)
+        rows.append(np.full(len(ids), row, dtype=np.int32))
+        weights.append(vector)
+
+    columns = np.concatenate(columns)
+    order = np.argsort(columns, kind='stable')
+    indptr = np.zeros(N_FEATURES + 1, dtype=np.int64)
+    np.cumsum(np.bincount(columns, minlength=N_FEATURES), out=indptr[1:])
+    return {
+        'indptr': indptr,
+        'indices': np.concatenate(rows)[order],
+        'data': np.concatenate(weights)[order].astype(np.float32),
+        'idf': idf,
+    }
+
+
+class SemanticIndex:
+    """類似検索インデックス（配列はメモリマップでもよい）"""
+
+    def __init__(self, indptr, indices, data, idf, rows):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.idf = idf
+        self.rows = rows
+
+    @classmethod
+    def from_texts(cls, texts):
+        return cls(rows=len(texts), **build(texts))
+
+    @classmethod
+    def load(cls, directory=INDEX_DIR, mmap_mode='r'):
+        """保存したインデックスを読み込み、(SemanticIndex, メタデータ) を返す"""
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode) for name in ARRAYS}
+        return cls(rows=meta['rows'], **arrays), meta
+
+    @classmethod
+    def load_for(cls, df, directory=INDEX_DIR):
+        """df と一致するインデックスがあれば読み込む（なければ・古ければNone）"""
+        if not os.path.exists(os.path.join(directory, 'meta.json')):
+            print("WARNING: 類似検索インデックスがありません（python semantic_index.py で作成）", flush=True)
+            return None
+        try:
+            index, meta = cls.load(directory)
+        except Exception as e:
+            print(f"WARNING: 類似検索インデックスの読み込みに失敗: {e}", flush=True)
+            return None
+        if not index_is_fresh(meta, document_texts(df)):
+            print("WARNING: 類似検索インデックスが古いため使用しません", flush=True)
+            return None
+        print(f"INFO: 類似検索インデックスを読み込み ({index.rows}件)", flush=True)
+        return index
+
+    def save(self, directory, digest):
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAYS:
+            # 書き込み途中のファイルを読まれないよう、一時ファイル経由で置き換える
+            path = os.path.join(directory, f'{name}.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, getattr(self, name))
+            os.replace(path + '.tmp', path)
+        # meta.jsonを最後に書く（これが揃っていることを有効なインデックスの条件にする）
+        meta = {
+            'format': INDEX_FORMAT,
+            'rows': self.rows,
+            'text_sha256': digest,
+            'n_features': N_FEATURES,
+            'ngram_range': list(NGRAM_RANGE),
+        }
+        with open(os.path.join(directory, 'meta.json.tmp'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(directory, 'meta.json.tmp'), os.path.join(directory, 'meta.json'))
+
+    def scores(self, text):
+        """全行とのコサイン類似度（行数の長さのfloat32配列）"""
+        counts = features(text)
+        scores = np.zeros(self.rows, dtype=np.float32)
+        if not counts:
+            return scores
+        ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        query = (1 + np.log(tf)) * self.idf[ids]
+        query /= np.linalg.norm(query)
+
+        # クエリに含まれる特徴量の転置リストだけを連結し、行ごとに重みを足し合わせる
+        starts, ends = self.indptr[ids], self.indptr[ids + 1]
+        lengths = ends - starts
+        if not lengths.sum():
+            return scores
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        weights = self.data[positions] * np.repeat(query, lengths)
+        return np.bincount(self.indices[positions], weights=weights, minlength=self.rows).astype(np.float32)
+
+    def top(self, text, k):
+        """類似度の高い順に (行位置, スコア) を最大k件返す（スコア0の行は除く）"""
+        scores = self.scores(text)
+        k = min(k, self.rows)
+        if k <= 0:
+            return []
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return [(int(row), float(scores[row])) for row in candidates if scores[row] > 0]
+
+
+def index_is_fresh(meta, texts):
+    """インデックスが現在のデータ・形式から作られたものか確認"""
+    return (
+        meta.get('format') == INDEX_FORMAT
+        and meta.get('rows') == len(texts)
+        and meta.get('text_sha256') == text_digest(texts)
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='職務内容の類似検索インデックスを作成')
+    parser.add_argument('--output', default=INDEX_DIR)
+    parser.add_argument('--check', action='store_true', help='インデックスが最新か確認のみ行う')
+    args = parser.parse_args(argv)
+
+    from dataset import load_dataset
+    texts = document_texts(load_dataset())
+
+    if args.check:
+        try:
+            _, meta = SemanticIndex.load(args.output)
+        except (OSError, ValueError) as e:
+            print(f"インデックスを読み込めません: {e}")
+            return 1
+        if not index_is_fresh(meta, texts):
+            print("インデックスが古くなっています")
+            return 1
+        print("インデックスは最新です")
+        return 0
+
+    index = SemanticIndex.from_texts(texts)
+    index.save(args.output, text_digest(texts))
+    print(f"インデックスを作成しました: {args.output} ({index.rows}件, 非ゼロ要素 {len(index.data)})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
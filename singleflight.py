@@ -0,0 +1,216 @@
+"""同一計算の相乗り（single-flight）
+
+同じキーの計算が実行中なら、新たに計算せずその結果を待って受け取る。
+- 同じプロセス内: スレッド間で1つの計算を共有する
+- ワーカー間: SQLiteのリース（inflightテーブル）で1つのワーカーだけが計算し、
+  他のワーカーはリースに書き込まれた結果（またはエラー）をポーリングで受け取る
+
+計算が例外を投げた場合は、待っていた全員に同じ例外が届く。
+相乗りするのは呼び出した時点で実行中の計算だけ。終わった計算の結果（リースに result_ttl の間
+残る）は status() で状態を知らせるためのもので、新しい呼び出しには使わない。
+混雑・期限切れなど一時的なエラー（transient_errors）は、待っていたワーカーが受け取れる間だけ残す。
+ワーカー間の結果はJSONで渡すため、JSONにない情報（リストの属性など）は encode / decode で
+JSONにできる形との変換を指定する。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class RemoteError(Exception):
+    """別ワーカーでの計算が失敗した"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """キーごとに計算を1回にまとめる"""
+
+    def __init__(self, path=None, lease_ttl=180, result_ttl=10, poll_interval=0.25, error_types=(),
+                 encode=None, decode=None, transient_errors=()):
+        self.path = path  # Noneまたは空文字ならプロセス内のみ
+        self.lease_ttl = lease_ttl  # 計算中のワーカーが落ちた場合に他が引き継ぐまでの時間
+        self.result_ttl = result_ttl  # 終わった計算の結果をリースに残しておく時間
+        self.poll_interval = poll_interval
+        # ワーカー間でそのまま再送出する例外（それ以外は RemoteError になる）
+        self.error_types = {cls.__name__: cls for cls in error_types}
+        # 一時的なエラー（次の呼び出しでは起きないかもしれないので、待っていたワーカーにだけ渡す）
+        self.transient_errors = tuple(transient_errors)
+        # ワーカー間で渡す結果の変換（結果 → JSONにできる値、その逆）
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda value: value)
+
+        self._owner = None  # (pid, リースの持ち主)。fork 後に作り直すため使うときに決める
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {'leaders': 0, 'local_joins': 0, 'remote_joins': 0}
+
+    @property
+    def owner(self):
+        """リースの持ち主（プロセスごと。preload_app で fork したワーカーが親と同じ値を使わないようにする）"""
+        pid = os.getpid()
+        with self._lock:
+            if self._owner is None or self._owner[0] != pid:
+                self._owner = (pid, f"{pid}:{uuid.uuid4().hex[:8]}")
+            return self._owner[1]
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, 'in_flight': len(self._calls)}
+
+    def status(self, key):
+        """key の計算の状態を (状態, エラーメッセージ) で返す
+
+        状態は 'running' / 'done' / 'error'、実行中でも直前に終わったものでもなければNone。
+        他のワーカーの計算はリースから読む（終わった計算は result_ttl の間だけ分かる）。
+        """
+        with self._lock:
+            if key in self._calls:
+                return 'running', None
+        if not self.path:
+            return None, None
+        try:
+            row = self._connection().execute(
+                'SELECT status, payload, expires_at FROM inflight WHERE key = ?', (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"[SINGLEFLIGHT] 状態の読み込みエラー: {e}", flush=True)
+            return None, None
+        if row is None or row[2] < time.time():
+            return None, None
+        status, payload, _ = row
+        if status == 'error':
+            return status, json.loads(payload).get('message', '')
+        return status, None
+
+    def do(self, key, compute):
+        """key の計算を実行（実行中なら相乗り）して結果を返す"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self._count('local_joins')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._lead(key, compute)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _lead(self, key, compute):
+        """プロセス内の代表として、ワーカー間のリースを取ってから計算する"""
+        if not self.path:
+            self._count('leaders')
+            return compute()
+
+        while True:
+            try:
+                acquired = self._try_acquire(key)
+            except sqlite3.Error as e:
+                # リースが使えなくても計算は続ける（重複するだけ）
+                print(f"[SINGLEFLIGHT] リース取得エラー: {e}", flush=True)
+                self._count('leaders')
+                return compute()
+
+            if acquired:
+                self._count('leaders')
+                return self._compute_with_lease(key, compute)
+
+            outcome = self._wait_remote(key)
+            if outcome is not None:
+                self._count('remote_joins')
+                status, payload = outcome
+                if status == 'done':
+                    return self.decode(payload)
+                error_type = self.error_types.get(payload.get('type'), RemoteError)
+                raise error_type(payload.get('message', ''))
+            # リースが期限切れになった（計算中のワーカーが落ちた）ので取り直す
+
+    def _compute_with_lease(self, key, compute):
+        try:
+            result = compute()
+        except Exception as e:
+            ttl = self.poll_interval * 4 if isinstance(e, self.transient_errors) else None
+            self._finish(key, 'error', {'type': type(e).__name__, 'message': str(e)}, ttl)
+            raise
+        self._finish(key, 'done', self.encode(result))
+        return result
+
+    # --- SQLite ---
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS inflight ('
+                ' key TEXT PRIMARY KEY,'
+                ' owner TEXT NOT NULL,'
+                ' status TEXT NOT NULL,'
+                ' payload TEXT,'
+                ' expires_at REAL NOT NULL)'
+            )
+            self._local.conn = conn
+        return conn
+
+    def _try_acquire(self, key):
+        """リースを取得できたらTrue（期限切れのリースと、終わった計算のリースは上書きする）"""
+        now = time.time()
+        conn = self._connection()
+        conn.execute("DELETE FROM inflight WHERE expires_at < ? OR (key = ? AND status != 'running')", (now, key))
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO inflight (key, owner, status, payload, expires_at) VALUES (?, ?, ?, NULL, ?)',
+            (key, self.owner, 'running', now + self.lease_ttl)
+        )
+        return cursor.rowcount == 1
+
+    def _finish(self, key, status, payload, ttl=None):
+        ttl = self.result_ttl if ttl is None else ttl
+        try:
+            self._connection().execute(
+                'UPDATE inflight SET status = ?, payload = ?, expires_at = ? WHERE key = ? AND owner = ?',
+                (status, json.dumps(payload, ensure_ascii=False), time.time() + ttl, key, self.owner)
+            )
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"[SINGLEFLIGHT] 結果の書き込みエラー: {e}", flush=True)
+
+    def _wait_remote(self, key):
+        """他ワーカーの計算結果を待つ（リースが消えたらNone）"""
+        conn = self._connection()
+        while True:
+            row = conn.execute(
+                'SELECT status, payload, expires_at FROM inflight WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None or row[2] < time.time():
+                return None
+            status, payload, _ = row
+            if status != 'running':
+                return status, json.loads(payload)
+            time.sleep(self.poll_interval)
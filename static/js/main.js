@@ -6,6 +6,8 @@ document.addEventListener('DOMContentLoaded', function() {
     const evaluationResult = document.getElementById('evaluationResult');
     const error = document.getElementById('error');
 
+    const PATTERNS = ['database', 'similar', 'random'];
+
     searchForm.addEventListener('submit', async function(e) {
         e.preventDefault();
 
@@ -21,14 +23,14 @@ document.addEventListener('DOMContentLoaded', function() {
         }
 
         // UI更新
-        loadingText.textContent = '3パターン生成中です。30秒程度かかります...';
+        loadingText.textContent = '3パターン生成中です。準備できたものから表示します...';
         loading.style.display = 'block';
         compareResults.style.display = 'none';
         evaluationResult.style.display = 'none';
         error.style.display = 'none';
 
         try {
-            const response = await fetch('/api/compare', {
+            const response = await fetch('/api/compare/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -41,13 +43,34 @@ document.addEventListener('DOMContentLoaded', function() {
                 })
             });
 
-            const data = await response.json();
-
-            if (data.success) {
-                displayCompareResults(data.results);
-            } else {
-                showError(data.error || '生成中にエラーが発生しました');
+            // 入力エラーや混雑（429/503）はJSONでエラー内容が返る
+            if (!response.ok) {
+                const data = await response.json().catch(() => ({}));
+                showError(data.error || 'サーバーとの通信に失敗しました: HTTP ' + response.status);
+                return;
             }
+            if (!response.body) {
+                throw new Error('HTTP ' + response.status);
+            }
+
+            resetCompareResults();
+            compareResults.style.display = 'block';
+
+            // 届いたイベントから順に表示する
+            let completed = 0;
+            await readEventStream(response, function(event, data) {
+                if (event === 'item') {
+                    appendItem(data.name, data.text);
+                } else if (event === 'pattern') {
+                    displayPattern(data.name, data);
+                    completed += 1;
+                    loadingText.textContent = `生成中です...（${completed}/${PATTERNS.length}パターン完了）`;
+                } else if (event === 'evaluation') {
+                    displayEvaluation(data);
+                } else if (event === 'error') {
+                    showError(data.error || '生成中にエラーが発生しました');
+                }
+            });
         } catch (err) {
             showError('サーバーとの通信に失敗しました: ' + err.message);
         } finally {
@@ -55,65 +78,113 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
-    function displayCompareResults(results) {
-        const patterns = ['similar', 'random'];
+    // Server-Sent Eventsのレスポンスを読み、イベントごとにコールバックを呼ぶ
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
 
-        patterns.forEach(pattern => {
-            const data = results[pattern];
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                const dataLines = [];
+                block.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) {
+                        event = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        dataLines.push(line.slice(5).trim());
+                    }
+                });
+                if (dataLines.length > 0) {
+                    onEvent(event, JSON.parse(dataLines.join('\n')));
+                }
+            }
+        }
+    }
 
-            // 参照したサンプルを表示
+    function resetCompareResults() {
+        PATTERNS.forEach(pattern => {
             const samplesEl = document.getElementById('samples_' + pattern);
+            if (samplesEl) {
+                samplesEl.innerHTML = '';
+            }
+            const generatedEl = document.getElementById('generated_' + pattern);
+            generatedEl.innerHTML = '<p class="text-muted small">生成中...</p>';
+            generatedEl.dataset.streaming = 'false';
+        });
+    }
+
+    // 生成中の項目を1件ずつ追加（パターン完了時にdisplayPatternで描き直す）
+    function appendItem(pattern, item) {
+        const generatedEl = document.getElementById('generated_' + pattern);
+        if (generatedEl.dataset.streaming !== 'true') {
+            generatedEl.innerHTML = '';
+            generatedEl.dataset.streaming = 'true';
+        }
+        generatedEl.appendChild(createItem(generatedEl.children.length, item));
+    }
+
+    function createItem(index, item) {
+        const div = document.createElement('div');
+        div.className = 'mb-2 small';
+        const number = document.createElement('strong');
+        number.textContent = `${index + 1}.`;
+        div.appendChild(number);
+        div.appendChild(document.createTextNode(' ' + item));
+        return div;
+    }
+
+    function displayPattern(pattern, data) {
+        // 参照したサンプルを表示（データベース直接は参照サンプルなし）
+        const samplesEl = document.getElementById('samples_' + pattern);
+        if (samplesEl) {
             samplesEl.innerHTML = '';
             data.samples_used.forEach(sample => {
                 const li = document.createElement('li');
                 li.textContent = sample.substring(0, 50) + (sample.length > 50 ? '...' : '');
                 samplesEl.appendChild(li);
             });
-
-            // 生成結果を表示
-            const generatedEl = document.getElementById('generated_' + pattern);
-            generatedEl.innerHTML = '';
-            data.generated.forEach((item, index) => {
-                const div = document.createElement('div');
-                div.className = 'mb-2 small';
-                div.innerHTML = `<strong>${index + 1}.</strong> ${item}`;
-                generatedEl.appendChild(div);
-            });
-        });
-
-        // データベース直接パターン
-        const dbData = results['database'];
-        const dbGeneratedEl = document.getElementById('generated_database');
-        dbGeneratedEl.innerHTML = '';
-        if (dbData.generated.length === 0) {
-            dbGeneratedEl.innerHTML = '<p class="text-muted">該当するサンプルがありません</p>';
-        } else {
-            dbData.generated.forEach((item, index) => {
-                const div = document.createElement('div');
-                div.className = 'mb-2 small';
-                div.innerHTML = `<strong>${index + 1}.</strong> ${item}`;
-                dbGeneratedEl.appendChild(div);
-            });
         }
 
-        // AI評価結果を表示
-        if (results.evaluation) {
-            const eval_ = results.evaluation;
-            document.getElementById('scoreA').textContent = eval_.score_a || '-';
-            document.getElementById('scoreB').textContent = eval_.score_b || '-';
-
-            let winnerText = eval_.winner;
-            if (winnerText === 'A') {
-                winnerText = '似た業界・部門';
-            } else if (winnerText === 'B') {
-                winnerText = 'ランダム';
-            }
-            document.getElementById('winner').textContent = winnerText || '-';
-            document.getElementById('evalReason').textContent = eval_.reason || '';
-            evaluationResult.style.display = 'block';
+        // 生成結果を表示
+        const generatedEl = document.getElementById('generated_' + pattern);
+        generatedEl.innerHTML = '';
+        generatedEl.dataset.streaming = 'false';
+        if (data.generated.length === 0) {
+            generatedEl.innerHTML = '<p class="text-muted">該当するサンプルがありません</p>';
+            return;
         }
+        data.generated.forEach((item, index) => {
+            generatedEl.appendChild(createItem(index, item));
+        });
+    }
 
-        compareResults.style.display = 'block';
+    function displayEvaluation(eval_) {
+        // 評価結果を表示（judge=local はローカルの自動評価。AIの評価が後から届いたら上書きする）
+        document.getElementById('evalTitle').textContent =
+            eval_.judge === 'local' ? '📊 自動評価結果' : '🤖 AI評価結果';
+        document.getElementById('scoreA').textContent = eval_.score_a || '-';
+        document.getElementById('scoreB').textContent = eval_.score_b || '-';
+
+        let winnerText = eval_.winner;
+        if (winnerText === 'A') {
+            winnerText = '似た業界・部門';
+        } else if (winnerText === 'B') {
+            winnerText = 'ランダム';
+        }
+        document.getElementById('winner').textContent = winnerText || '-';
+        document.getElementById('evalReason').textContent = eval_.reason || '';
+        evaluationResult.style.display = 'block';
     }
 
     function showError(message) {
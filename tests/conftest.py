@@ -0,0 +1,47 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# テストからリポジトリ直下のモジュール（search_index.py など）を読み込めるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app を読み込む前に、リポジトリ内のキャッシュ・ストア・ジョブのファイルを使わないようにする
+os.environ['LLM_CACHE_PATH'] = ''
+os.environ['WARM_STORE_PATH'] = ''
+os.environ.setdefault('BATCH_JOBS_DIR', tempfile.mkdtemp(prefix='test-jobs-'))
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    """データを読み込んだ app モジュール（OpenAIは各テストでフェイクに差し替える）"""
+    import app
+    app.load_data()
+    return app
+
+
+@pytest.fixture
+def fake_llm(app_module, monkeypatch, tmp_path):
+    """フェイクのOpenAIクライアント（bench/fake_openai.py）と、テストごとの空のキャッシュ・通信層
+
+    返り値は FakeCompletions（calls などの計測値を持つ）。
+    """
+    from bench.fake_openai import FakeOpenAI, LatencyModel
+    from llm_cache import LLMCache
+    from llm_limiter import RateLimiter
+    from llm_transport import Transport
+    from singleflight import SingleFlight
+
+    app = app_module
+    fake = FakeOpenAI(short_rate=0.0, latency=LatencyModel(time_scale=0), seed=1)
+    cache = LLMCache(path=str(tmp_path / 'llm_cache.sqlite3'), sync_interval=0)
+    monkeypatch.setattr(app, 'client', fake)
+    monkeypatch.setattr(app, 'llm_cache', cache)
+    monkeypatch.setattr(app, 'inflight', SingleFlight(
+        path=cache.path, poll_interval=0.01, error_types=app.inflight.error_types.values(),
+        transient_errors=app.inflight.transient_errors, encode=app.inflight.encode, decode=app.inflight.decode))
+    monkeypatch.setattr(app, 'llm', Transport(hedge_budget=0.0))
+    monkeypatch.setattr(app, 'llm_limiter', RateLimiter(max_concurrent=16, rpm=1e12, tpm=1e12))
+    return fake.chat.completions
@@ -0,0 +1,62 @@
+"""データの再読み込み（data_state.DataStore.reload_async）が重ならないことの確認"""
+import threading
+import time
+
+from data_state import DataStore
+
+
+def blocking_store(monkeypatch):
+    """reload() が release されるまで止まる DataStore（読み込みの回数と同時実行数を記録する）"""
+    store = DataStore(indexed_columns=[], watch_interval=0)
+    release = threading.Event()
+    state = {'runs': 0, 'active': 0, 'max_active': 0}
+    lock = threading.Lock()
+
+    def reload(reason=''):
+        with lock:
+            state['runs'] += 1
+            state['active'] += 1
+            state['max_active'] = max(state['max_active'], state['active'])
+        release.wait(5)
+        with lock:
+            state['active'] -= 1
+
+    monkeypatch.setattr(store, 'reload', reload)
+    return store, release, state
+
+
+def wait_until(condition, timeout=2.0):
+    end = time.monotonic() + timeout
+    while not condition() and time.monotonic() < end:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_reload_async_runs_one_at_a_time(monkeypatch):
+    store, release, state = blocking_store(monkeypatch)
+    started = []
+    threads = [threading.Thread(target=lambda: started.append(store.reload_async('test'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert started.count(True) == 1
+    assert store.status()['reloading'] is True
+
+    release.set()
+    assert wait_until(lambda: not store.status()['reloading'])
+    assert state == {'runs': 1, 'active': 0, 'max_active': 1}
+
+    # 終わった後は次の再読み込みを始められる
+    assert store.reload_async('again') is True
+    assert wait_until(lambda: state['runs'] == 2 and not store.status()['reloading'])
+
+
+def test_reload_async_does_not_wait_for_running_load(monkeypatch):
+    """同期の読み込み（_lock）中でも、要求はすぐに受け付けて返る"""
+    store, release, state = blocking_store(monkeypatch)
+    release.set()
+    with store._lock:
+        started = time.monotonic()
+        assert store.reload_async('test') is True
+        assert time.monotonic() - started < 0.5
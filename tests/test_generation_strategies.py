@@ -0,0 +1,99 @@
+"""生成戦略（generation_strategies.py）の動作をスタブの fetch で確認する"""
+import threading
+import time
+
+import generation_strategies
+from llm_limiter import BoundedExecutor
+
+LONG = 'あ' * 60
+
+
+def stub_fetch(items, delay=0.0):
+    """呼ばれるたびに items を delay 秒おきに返す fetch"""
+    calls = []
+
+    def fetch(count, deadline):
+        calls.append(count)
+
+        def stream():
+            for item in items[:count]:
+                time.sleep(delay)
+                yield item
+        return stream()
+
+    fetch.calls = calls
+    return fetch
+
+
+def test_hedged_waits_without_error_after_deadline(monkeypatch):
+    """期限の確認の直後に期限を過ぎても（待ち時間が負）、queue.get が ValueError にならない"""
+    monkeypatch.setattr(generation_strategies, 'expired', lambda deadline: False)
+    fetch = stub_fetch([f'{LONG}{i}' for i in range(10)], delay=0.01)
+    results = generation_strategies.run('hedged', fetch, target=10, min_chars=50, max_calls=1,
+                                        budget=0.0, hedge_delay=10)
+    assert len(list(results)) == 10
+
+
+def test_hedged_does_not_hedge_fast_complete_call():
+    fetch = stub_fetch([f'{LONG}{i}' for i in range(14)])
+    results = generation_strategies.run('hedged', fetch, target=10, min_chars=50, max_calls=5, budget=5,
+                                        hedge_delay=1.0, overrequest_factor=1.4, executor=BoundedExecutor(4, 0))
+    assert len(list(results)) == 10 and results.complete
+    assert fetch.calls == [14]
+
+
+def test_hedged_requests_only_the_shortfall_when_items_are_short():
+    """短い項目で残りの件数では足りなくなったら、不足分だけ追加で依頼する"""
+    items = [f'{LONG}{i}' for i in range(8)] + ['短い'] * 6
+    fetch = stub_fetch(items, delay=0.01)
+    results = generation_strategies.run('hedged', fetch, target=10, min_chars=50, max_calls=5, budget=5,
+                                        hedge_delay=1.0, overrequest_factor=1.0, executor=BoundedExecutor(4, 0))
+    list(results)
+    assert fetch.calls[0] == 10
+    assert all(count < 10 for count in fetch.calls[1:]) and len(fetch.calls) > 1
+
+
+def test_hedged_hedges_slow_first_item():
+    """最初の項目が hedge_delay 秒来なければ、同じ件数をもう1本投げて先に来た項目を使う"""
+    calls = []
+
+    def fetch(count, deadline):
+        calls.append(count)
+        slow = len(calls) == 1
+
+        def stream():
+            if slow:
+                time.sleep(0.5)
+            for i in range(count):
+                yield f'{LONG}{len(calls)}-{i}'
+        return stream()
+
+    started = time.monotonic()
+    results = generation_strategies.run('hedged', fetch, target=10, min_chars=50, max_calls=5, budget=5,
+                                        hedge_delay=0.05, executor=BoundedExecutor(4, 0))
+    assert len(list(results)) == 10 and results.complete
+    assert calls == [10, 10]
+    assert time.monotonic() - started < 0.4
+
+
+def test_hedged_runs_inline_when_executor_is_busy():
+    """共有スレッドプールに空きがなければ並列にせず、呼び出し元のスレッドで生成する"""
+    executor = BoundedExecutor(1, 0)
+    release = threading.Event()
+    assert executor.try_submit(release.wait) is not None
+    assert executor.try_submit(release.wait) is None
+    try:
+        fetch = stub_fetch([f'{LONG}{i}' for i in range(10)])
+        results = generation_strategies.run('hedged', fetch, target=10, min_chars=50, max_calls=5, budget=5,
+                                            executor=executor)
+        assert len(list(results)) == 10 and results.complete
+        assert fetch.calls == [10]
+    finally:
+        release.set()
+
+
+def test_try_submit_releases_slot_when_done():
+    executor = BoundedExecutor(1, 0)
+    executor.try_submit(lambda: None).result(timeout=1)
+    time.sleep(0.01)
+    assert executor.try_submit(lambda: 'ok').result(timeout=1) == 'ok'
@@ -0,0 +1,172 @@
+"""生成結果のキャッシュ（llm_cache.py）とキャッシュキー、フェイクのOpenAIを使った相乗り・再生成の確認"""
+import threading
+import time
+
+import pytest
+
+from llm_cache import LLMCache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'cache.sqlite3')
+
+
+def test_shared_between_instances(path):
+    """SQLiteを通して別のワーカー（インスタンス）からも読める"""
+    a, b = LLMCache(path), LLMCache(path)
+    a.set('k', ['生成結果'])
+    assert b.get('k') == ['生成結果']
+    assert b.stats()['disk_hits'] == 1
+    assert b.get('k') == ['生成結果']
+    assert b.stats()['memory_hits'] == 1
+
+
+def test_expired_entries_are_misses(path):
+    cache = LLMCache(path, ttl=0.05, memory_ttl=0.05)
+    cache.set('k', ['a'])
+    time.sleep(0.1)
+    assert cache.get('k') is None
+    assert LLMCache(path).get('k') is None
+
+
+def test_memory_only_without_path():
+    cache = LLMCache(path=None)
+    cache.set('k', ['a'])
+    assert cache.get('k') == ['a']
+
+
+def test_invalidate_key_reaches_other_instances(path):
+    """キーの削除は他のインスタンスのプロセス内LRUからも消え、他のキーは残る"""
+    a, b = LLMCache(path, sync_interval=0), LLMCache(path, sync_interval=0)
+    a.set('k', ['old'])
+    a.set('j', ['j'])
+    assert b.get('k') == ['old'] and b.get('j') == ['j']
+
+    a.invalidate('k')
+    assert b.get('k') is None
+    assert b.get('j') == ['j']
+    assert b.stats()['memory_hits'] == 1  # j はLRUに残っている
+
+
+def test_invalidate_all_reaches_other_instances(path):
+    a, b = LLMCache(path, sync_interval=0), LLMCache(path, sync_interval=0)
+    a.set('k', ['old'])
+    assert b.get('k') == ['old']
+    a.invalidate()
+    assert b.get('k') is None
+    assert a.get('k') is None
+
+
+def test_memory_hits_do_not_read_sqlite_within_sync_interval(path):
+    cache = LLMCache(path, sync_interval=60)
+    cache.set('k', ['a'])
+    cache.get('k')
+    calls = []
+    connection = cache._connection
+    cache._connection = lambda: calls.append(1) or connection()
+    for _ in range(100):
+        assert cache.get('k') == ['a']
+    assert calls == []
+
+
+def test_get_or_compute(path):
+    cache = LLMCache(path)
+    values = iter([['1回目'], ['2回目']])
+    assert cache.get_or_compute('k', lambda: next(values)) == ['1回目']
+    assert cache.get_or_compute('k', lambda: next(values)) == ['1回目']
+    # bypass は再計算して上書きする
+    assert cache.get_or_compute('k', lambda: next(values), bypass=True) == ['2回目']
+    assert LLMCache(path).get('k') == ['2回目']
+
+
+def test_get_or_compute_does_not_store_failures_or_uncacheable(path):
+    cache = LLMCache(path)
+    with pytest.raises(ZeroDivisionError):
+        cache.get_or_compute('k', lambda: 1 / 0)
+    assert cache.get('k') is None
+    assert cache.get_or_compute('k', lambda: ['短い'], cacheable=lambda value: False) == ['短い']
+    assert cache.get('k') is None
+    assert cache.stats()['skipped'] == 1
+
+
+# --- キャッシュキー ---
+
+def key(app, position, industry='製薬', department='営業', area='', kind='reference'):
+    return app.generation_cache_key(kind, position, industry, department, area)
+
+
+def test_key_distinguishes_positions_in_same_category(app_module):
+    """区分が同じでもプロンプトに入るポジションが違えば別のキー"""
+    app = app_module
+    assert app.infer_position_category('CFO') == app.infer_position_category('営業部長')
+    assert len({key(app, position) for position in ['CFO', '社長', '営業部長']}) == 3
+    assert len({key(app, position) for position in ['エンジニア', '弁護士', 'データサイエンティスト']}) == 3
+
+
+def test_key_ignores_notation_differences(app_module):
+    app = app_module
+    assert key(app, 'CFO') == key(app, ' CFO ')
+    assert key(app, 'Data  Scientist') == key(app, 'data scientist')
+    # 業界・部門は同義語辞書で正規化する
+    assert key(app, 'マネージャー', industry='製薬') == key(app, 'マネージャー', industry='医薬品')
+
+
+def test_key_depends_on_kind_and_area(app_module):
+    app = app_module
+    assert key(app, 'マネージャー') != key(app, 'マネージャー', kind='similar')
+    assert key(app, 'マネージャー') != key(app, 'マネージャー', area='北米')
+
+
+# --- フェイクのOpenAIでの生成 ---
+
+def generate(app, position='マネージャー', bypass_cache=False):
+    return app.generate_with_references(position, '製薬', '営業', '', bypass_cache=bypass_cache, retrieval='keyword')
+
+
+def test_generation_is_cached(app_module, fake_llm):
+    first = generate(app_module)
+    calls = fake_llm.calls
+    assert len(first) == 10 and calls >= 1
+    assert generate(app_module) == first
+    assert fake_llm.calls == calls
+
+
+def test_bypass_regenerates_and_overwrites(app_module, fake_llm):
+    generate(app_module)
+    calls = fake_llm.calls
+    again = generate(app_module, bypass_cache=True)
+    assert fake_llm.calls > calls
+    assert generate(app_module) == again
+
+
+def test_incomplete_generation_is_not_cached(app_module, fake_llm, monkeypatch):
+    """目標件数に届かなかった結果（制限時間での打ち切りなど）は返すが、キャッシュしない"""
+    app = app_module
+    monkeypatch.setattr(app, 'generate_job_descriptions',
+                        lambda *args, **kwargs: app.GeneratedItems(['途中まで'], complete=False))
+    result = generate(app)
+    assert result == ['途中まで'] and not app.is_complete(result)
+    assert app.llm_cache.get(key(app, 'マネージャー')) is None
+    assert app.llm_cache.stats()['skipped'] == 1
+
+
+def test_concurrent_identical_requests_share_one_generation(app_module, fake_llm):
+    """同じ条件の同時リクエストは1回の生成に相乗りする"""
+    started = threading.Barrier(4)
+    results = []
+
+    def run():
+        started.wait()
+        results.append(generate(app_module, position='部長'))
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == 4 and all(result == results[0] for result in results)
+    shared = fake_llm.calls
+    generate(app_module, position='部長', bypass_cache=True)
+    # 4回分ではなく、1回分の生成の呼び出し回数だけ
+    assert shared == fake_llm.calls - shared
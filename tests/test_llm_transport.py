@@ -0,0 +1,156 @@
+"""通信層（llm_transport.py）のサーキットブレーカー・ヘッジ・期限を、HTTPのフェイクサーバー（bench/fake_server.py）で確認する"""
+import time
+
+import openai
+import pytest
+
+from bench.fake_openai import LatencyModel
+from bench.fake_server import serve
+from llm_limiter import RateLimiter
+from llm_transport import CircuitBreaker, CircuitOpen, DeadlineExceeded, Transport
+
+MESSAGES = [{'role': 'user', 'content': '3件を番号付きリストで'}]
+
+
+@pytest.fixture
+def server():
+    server = serve(short_rate=0.0, seed=1, stall_seconds=5.0,
+                   latency=LatencyModel(ttft_median=0.001, ttft_sigma=0.0, per_token=0.0))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(server, transport):
+    return openai.OpenAI(base_url=server.base_url, api_key='fake', **{**transport.client_options(), 'max_retries': 0})
+
+
+def call(transport, client, **params):
+    return transport.create(client, 'generation', model='fake', messages=MESSAGES, **params)
+
+
+def test_breaker_opens_probes_and_recovers(server):
+    """closed →（失敗率）→ open →（停止時間後の1回）→ half_open → 成功で closed"""
+    breaker = CircuitBreaker(failure_rate=0.5, min_calls=4, window=30, open_seconds=0.2)
+    transport = Transport(hedge_budget=0.0, breaker=breaker)
+    client = make_client(server, transport)
+
+    server.set_faults(error_rate=1.0)
+    for _ in range(4):
+        with pytest.raises(openai.InternalServerError):
+            call(transport, client)
+    assert breaker.state == 'open'
+
+    # 開いている間はOpenAIを呼ばずに断る
+    calls = server.stats()['calls'] + server.stats()['errors']
+    with pytest.raises(CircuitOpen):
+        call(transport, client)
+    assert server.stats()['calls'] + server.stats()['errors'] == calls
+
+    # 停止時間後の試しの呼び出しが失敗したら、また開く
+    time.sleep(0.25)
+    with pytest.raises(openai.InternalServerError):
+        call(transport, client)
+    assert breaker.state == 'open'
+
+    # 試しの呼び出し中は、他の呼び出しを断る
+    time.sleep(0.25)
+    breaker.allow()
+    assert breaker.state == 'half_open'
+    with pytest.raises(CircuitOpen):
+        call(transport, client)
+    breaker.record(False)
+
+    # 回復したら閉じる
+    time.sleep(0.25)
+    server.set_faults(error_rate=0.0)
+    assert call(transport, client).choices[0].message.content
+    assert breaker.state == 'closed'
+    assert transport.stats()['breaker_opened'] == 3
+
+
+def test_errors_below_min_calls_keep_breaker_closed(server):
+    transport = Transport(hedge_budget=0.0, breaker=CircuitBreaker(min_calls=10))
+    client = make_client(server, transport)
+    server.set_faults(error_rate=1.0)
+    for _ in range(3):
+        with pytest.raises(openai.InternalServerError):
+            call(transport, client)
+    assert transport.breaker.state == 'closed'
+
+
+def slow_transport(hedge_budget):
+    """直近の応答時間を記録済みで、0.05秒応答がなければヘッジする通信層"""
+    transport = Transport(hedge_budget=hedge_budget, hedge_min_delay=0.05, breaker=CircuitBreaker(min_calls=100))
+    # テスト中の遅い応答で p90 が変わらないよう、記録できる上限まで入れておく
+    for _ in range(200):
+        transport.tracker.observe('generation', 0.01)
+    return transport
+
+
+def test_hedges_stay_within_budget(server):
+    transport = slow_transport(hedge_budget=0.5)
+    client = make_client(server, transport)
+    server.set_faults(stall_rate=1.0, stall_seconds=0.2)
+    for _ in range(6):
+        call(transport, client)
+    stats = transport.stats()
+    assert stats['calls'] == 6
+    assert stats['hedges'] == 3
+
+
+def test_no_hedges_without_budget_or_limiter_capacity(server):
+    server.set_faults(stall_rate=1.0, stall_seconds=0.2)
+
+    transport = slow_transport(hedge_budget=0.0)
+    call(transport, make_client(server, transport))
+    assert transport.stats()['hedges'] == 0
+
+    # 流量制限に空きがなければヘッジしない（1本目の枠は呼び出し側が確保している）
+    limiter = RateLimiter(max_concurrent=1, rpm=1e12, tpm=1e12)
+    transport = slow_transport(hedge_budget=1.0)
+    with limiter.slot(100) as slot:
+        call(transport, make_client(server, transport), limiter=limiter, estimated_tokens=slot.estimated_tokens)
+    stats = transport.stats()
+    assert stats['hedges'] == 0 and stats['hedges_limited'] == 1
+    assert limiter.stats()['active'] == 0
+
+
+def test_stream_stalled_after_first_chunk_hits_call_deadline(server):
+    """最初のチャンクの後に止まったストリームも、呼び出しの期限で打ち切る"""
+    transport = Transport(hedge_budget=0.0)
+    client = make_client(server, transport)
+    server.set_faults(stream_stall_rate=1.0, stall_seconds=5.0)
+    started = time.monotonic()
+    stream = call(transport, client, timeout=0.3, stream=True)
+    chunks = []
+    with pytest.raises(DeadlineExceeded):
+        for chunk in stream:
+            chunks.append(chunk)
+    assert chunks
+    assert time.monotonic() - started < 2.0
+    assert transport.stats()['deadline_exceeded'] == 1
+
+
+def test_stream_finishing_in_time_is_not_cut(server):
+    transport = Transport(hedge_budget=0.0)
+    stream = call(transport, make_client(server, transport), timeout=5, stream=True)
+    text = ''.join(chunk.choices[0].delta.content or '' for chunk in stream if chunk.choices)
+    assert text.count('\n') >= 2
+    assert transport.stats()['deadline_exceeded'] == 0
+
+
+def test_slow_stream_is_cut_at_call_deadline():
+    """チャンクごとの間隔は読み取りタイムアウト内でも、ストリーム全体で呼び出しの期限を超えたら打ち切る"""
+    server = serve(short_rate=0.0, seed=1, latency=LatencyModel(ttft_median=0.001, ttft_sigma=0.0, per_token=0.02))
+    try:
+        transport = Transport(hedge_budget=0.0)
+        started = time.monotonic()
+        stream = call(transport, make_client(server, transport), timeout=0.3, stream=True)
+        with pytest.raises(DeadlineExceeded):
+            for _ in stream:
+                pass
+        assert 0.3 <= time.monotonic() - started < 1.0
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,46 @@
+"""プロンプトの組み立て（prompts.py）とゴールデンファイル（bench/golden/prompts.json）の確認"""
+import prompts
+
+from bench import prompts as bench_prompts
+
+
+def test_prompts_match_golden(app_module, capsys):
+    """文面を変えたら python -m bench.prompts --update で書き換え、PROMPT_VERSION を上げる"""
+    rendered = bench_prompts.render_cases()
+    ok = bench_prompts.check_golden(rendered, update=False)
+    assert ok, capsys.readouterr().out
+
+
+def test_select_references_returns_fresh_counts():
+    """キャッシュした結果の内訳を呼び出し側が書き換えても、次の呼び出しに影響しない"""
+    samples = tuple(bench_prompts.SAMPLES)
+    selected, counts = prompts.select_references(samples, 5)
+    expected = dict(counts)
+    counts['used'] = 99
+    again, counts_again = prompts.select_references(samples, 5)
+    assert again == selected
+    assert counts_again == expected
+    assert counts_again is not counts
+
+
+def test_select_references_drops_duplicates_and_truncates():
+    selected, counts = prompts.select_references(tuple(bench_prompts.SAMPLES), 5)
+    assert counts['duplicate'] == 1
+    assert counts['truncated'] == 1
+    assert counts['used'] == len(selected)
+    assert all(prompts.count_tokens(text) <= prompts.MAX_SAMPLE_TOKENS for text in selected)
+
+
+def test_count_tokens_estimate():
+    assert prompts.count_tokens('') == 0
+    assert prompts.count_tokens('営業') == 2
+    assert prompts.count_tokens('abcdefgh') == 2
+
+
+def test_warm_store_version_is_not_metered(app_module):
+    """事前生成ストアの確認（起動時）は、参考サンプルの計測に数えない"""
+    before = app_module.PROMPT_REFERENCES.value(result='used')
+    version = app_module.warm_store_version()
+    assert app_module.PROMPT_REFERENCES.value(result='used') == before
+    assert version == app_module.warm_store_version()
+    assert set(version) == {'model', 'prompt_version', 'prompt_sha256'}
@@ -0,0 +1,23 @@
+"""/readyz はデータの読み込みで準備完了を判定し、OpenAIクライアントの状態は別に返す"""
+
+
+def test_ready_without_llm_client(app_module, monkeypatch):
+    """APIキーの設定漏れなどでクライアントを作れなくても、データがあれば200のまま"""
+    monkeypatch.setattr(app_module, 'client', None)
+    response = app_module.app.test_client().get('/readyz')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['ready'] is True and body['llm_client'] is False
+    assert body['rows'] > 0
+
+
+def test_not_ready_before_data_is_loaded(app_module, monkeypatch):
+    monkeypatch.setattr(app_module.data_store, 'current', None)
+    response = app_module.app.test_client().get('/readyz')
+    assert response.status_code == 503
+    assert response.get_json()['ready'] is False
+
+
+def test_llm_client_reported(app_module, fake_llm):
+    body = app_module.app.test_client().get('/readyz').get_json()
+    assert body['ready'] is True and body['llm_client'] is True
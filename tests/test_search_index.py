@@ -0,0 +1,74 @@
+"""CategoryIndex.match と pandas の str.contains(pattern, case=False, na=False) の一致を確認する"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from search_index import CategoryIndex
+
+ROWS = [
+    ("医薬品・製薬", "営業", "マネージャー"),
+    ("自動車部品", "品質管理", "スタッフ"),
+    ("IT・ソフトウェア", "Marketing", "Manager"),
+    ("it・ソフトウェア", "marketing", "manager"),
+    ("Automotive (EV)", "R&D", "Director"),
+    ("物流", "財務/経理", "部長"),
+    ("食品", "営業企画", "課長"),
+    ("a.b", "営業", "スタッフ"),
+    (np.nan, "人事", "マネージャー"),
+    ("半導体", np.nan, np.nan),
+    ("医薬品・製薬", "営業", "スタッフ"),
+]
+
+COLUMNS = ["業界", "部門", "ポジション"]
+
+PATTERNS = [
+    # カテゴリの部分文字列
+    "製薬", "医薬品", "自動車", "営業", "品質管理", "ソフトウェア", "物流", "財務/経理",
+    # 大文字小文字
+    "it", "IT", "marketing", "MARKETING", "Manager", "automotive", "r&d",
+    # 正規表現のメタ文字
+    "製薬|物流", "^営業$", "営業.*", "a.b", r"a\.b", "(EV)", r"\(EV\)", "[自食]", "部品$", "管理?",
+    # n-gram（2文字）より短い・空のパターン
+    "", "営", "物", "i", "M", "a", "・",
+    # 一致しないもの
+    "存在しない業界", "xyz",
+]
+
+
+@pytest.fixture(scope="module")
+def df():
+    frame = pd.DataFrame(ROWS, columns=COLUMNS)
+    # アプリと同じくカテゴリ型で持つ
+    return frame.astype({column: "category" for column in COLUMNS})
+
+
+@pytest.fixture(scope="module")
+def index(df):
+    return CategoryIndex(df, COLUMNS)
+
+
+# "(EV)" のようにグループを含むパターンで pandas が出す警告は無視する
+@pytest.mark.filterwarnings("ignore:This pattern is interpreted as a regular expression")
+@pytest.mark.parametrize("column", COLUMNS)
+@pytest.mark.parametrize("pattern", PATTERNS)
+def test_match_same_as_str_contains(df, index, column, pattern):
+    expected = df[column].astype(object).str.contains(pattern, case=False, na=False).to_numpy(dtype=bool)
+    np.testing.assert_array_equal(index.match(column, pattern), expected)
+
+
+def test_object_column_with_non_strings():
+    """カテゴリ型でない列（数値が混ざる）も str.contains と同じ"""
+    df = pd.DataFrame({"業界": ["製薬", 123, None, "製薬会社", "12製薬"]})
+    index = CategoryIndex(df, ["業界"])
+    for pattern in ["製薬", "12", "", "薬"]:
+        expected = df["業界"].str.contains(pattern, case=False, na=False).to_numpy(dtype=bool)
+        np.testing.assert_array_equal(index.match("業界", pattern), expected)
+
+
+def test_results_combine_like_boolean_masks(df, index):
+    """| と & で組み合わせた結果も pandas のマスクと同じ"""
+    expected = (
+        df["業界"].astype(object).str.contains("製薬", case=False, na=False)
+        & df["部門"].astype(object).str.contains("営業", case=False, na=False)
+    ).to_numpy(dtype=bool)
+    np.testing.assert_array_equal(index.match("業界", "製薬") & index.match("部門", "営業"), expected)
@@ -0,0 +1,151 @@
+"""ストリーミング生成の行の組み立て（app._stream_job_descriptions_raw）を、録画したチャンク列を返すスタブで確認する"""
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from llm_transport import DeadlineExceeded
+
+LONG = [
+    '北米市場全域の新規の法人顧客を対象に、CRMの商談データを用いて営業戦略を立案し、四半期売上目標の達成を図る',
+    '米国西海岸の拠点の既存の大口取引先を対象に、現地チームと週次で連携し価格交渉を実施し、顧客満足度の向上を図る',
+    'カナダ・米国地域の現地の販売代理店を対象に、競合他社の価格動向を踏まえ販売実績を分析し、市場シェアの拡大を図る',
+]
+
+
+def chunk(text=None, usage=None):
+    choices = [] if text is None else [SimpleNamespace(delta=SimpleNamespace(content=text))]
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+class RecordedStream:
+    """録画したチャンク列を delay 秒おきに返すストリーム
+
+    stall_after 個のチャンクの後は、閉じられるまで止まる（閉じられたら接続が切れたときと同じく例外）。
+    """
+
+    def __init__(self, chunks, delay=0.0, stall_after=None):
+        self.chunks = chunks
+        self.delay = delay
+        self.stall_after = stall_after
+        self.closed = False
+        self.sent = 0
+        self._closed = threading.Event()
+
+    def __iter__(self):
+        for item in self.chunks:
+            if self.closed:
+                return
+            if self.sent == self.stall_after:
+                self._closed.wait(5)
+                raise ConnectionError('stream closed')
+            time.sleep(self.delay)
+            self.sent += 1
+            yield item
+
+    def close(self):
+        self.closed = True
+        self._closed.set()
+
+
+class RecordedClient:
+    """chat.completions.create() のたびに make_stream() のストリームを返すスタブ"""
+
+    def __init__(self, make_stream, first_delay=0.0):
+        self.make_stream = make_stream
+        self.first_delay = first_delay
+        self.streams = []
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, timeout=None, **params):
+        time.sleep(self.first_delay)
+        stream = self.make_stream()
+        self.streams.append(stream)
+        return stream
+
+
+def split_text(text, size):
+    return [chunk(text[i:i + size]) for i in range(0, len(text), size)]
+
+
+@pytest.fixture
+def recorded(app_module, fake_llm, monkeypatch):
+    """app.client を録画したストリームのスタブに差し替える関数"""
+    def install(make_stream, first_delay=0.0):
+        client = RecordedClient(make_stream, first_delay)
+        monkeypatch.setattr(app_module, 'client', client)
+        return client
+    return install
+
+
+def raw(app, count=3, deadline=None):
+    return app._stream_job_descriptions_raw('マネージャー', '製薬', '営業', '', None, 5, count, deadline)
+
+
+@pytest.mark.parametrize('size', [1, 3, 7, 40])
+def test_items_split_across_chunks(app_module, recorded, size):
+    """チャンクが項目の途中・改行・番号の途中で切れても、同じ項目に組み立てる"""
+    text = '\n'.join(f'{i}. {item}' for i, item in enumerate(LONG, 1))  # 最後の項目は改行なし
+    usage = SimpleNamespace(prompt_tokens=100, completion_tokens=50, total_tokens=150)
+    recorded(lambda: RecordedStream(split_text(text, size) + [chunk(usage=usage)]))
+    assert list(raw(app_module)) == LONG
+
+
+def test_headings_and_blank_lines_are_skipped(app_module, recorded):
+    text = f'# 職務内容\n\n1) {LONG[0]}\n\n2: {LONG[1]}\n'
+    recorded(lambda: RecordedStream(split_text(text, 5)))
+    assert list(raw(app_module)) == LONG[:2]
+
+
+def test_close_stops_the_stream(app_module, recorded):
+    """呼び出し側が途中で close() すると、ストリームも閉じて残りを受信しない"""
+    text = ''.join(f'{i}. {item}\n' for i, item in enumerate(LONG * 3, 1))
+    client = recorded(lambda: RecordedStream(split_text(text, 4)))
+    items = raw(app_module, count=9)
+    assert next(items) == LONG[0]
+    items.close()
+    stream = client.streams[0]
+    assert stream.closed
+    assert stream.sent < len(stream.chunks)
+
+
+def test_stream_ending_early_returns_received_items(app_module, recorded):
+    """ストリームが途中で終わったら（usage なし）、受信した分だけ返す"""
+    text = f'1. {LONG[0]}\n2. {LONG[1][:20]}'
+    recorded(lambda: RecordedStream(split_text(text, 6)))
+    assert list(raw(app_module)) == [LONG[0], LONG[1][:20]]
+
+
+def test_deadline_during_stream_stops_generation(app_module, recorded):
+    text = ''.join(f'{i}. {item}\n' for i, item in enumerate(LONG, 1))
+    client = recorded(lambda: RecordedStream(split_text(text, 10), delay=0.02))
+    items = list(raw(app_module, deadline=time.monotonic() + 0.15))
+    assert len(items) < len(LONG)
+    assert client.streams[0].closed
+
+
+def test_stream_stalled_after_first_items_stops_at_deadline(app_module, recorded):
+    """最初のチャンクの後に止まったストリームも期限で閉じ、受信済みの項目を返す"""
+    text = ''.join(f'{i}. {item}\n' for i, item in enumerate(LONG, 1))
+    first = len(f'1. {LONG[0]}\n') // 10 + 1
+    client = recorded(lambda: RecordedStream(split_text(text, 10), stall_after=first))
+    started = time.monotonic()
+    assert list(raw(app_module, deadline=time.monotonic() + 0.3)) == LONG[:1]
+    assert time.monotonic() - started < 1.0
+    assert client.streams[0].closed
+
+
+def test_no_item_before_deadline_raises(app_module, recorded, monkeypatch):
+    """1件も生成できないまま制限時間を過ぎたら、空の結果ではなく DeadlineExceeded（6a21a04）"""
+    monkeypatch.setattr(app_module, 'GENERATION_BUDGET_SEC', 0.1)
+    recorded(lambda: RecordedStream([chunk('1. ')]), first_delay=0.3)
+    with pytest.raises(DeadlineExceeded):
+        list(app_module.iter_job_descriptions('マネージャー', '製薬', '営業', ''))
+
+    # キャッシュ経由でも同じで、何もキャッシュしない
+    recorded(lambda: RecordedStream([]), first_delay=0.3)
+    with pytest.raises(DeadlineExceeded):
+        app_module.generate_with_references('マネージャー', '製薬', '営業', '', retrieval='keyword')
+    key, _ = app_module.generation_task('reference', 'マネージャー', '製薬', '営業', '', 'keyword')
+    assert app_module.llm_cache.get(key) is None
@@ -0,0 +1,33 @@
+"""事前生成ストア（warm_store.py）の組み合わせの作り方と、リクエストのキーとの一致"""
+import warm_store
+
+
+def test_dataset_combinations_expand_positions(app_module):
+    """区分の代わりに肩書きごとに作り、リクエストと同じキーで引ける"""
+    app = app_module
+    positions = warm_store.group_positions(['部長', 'CFO', '担当者'], app.infer_position_category)
+    assert positions == {'管理職': ['部長', 'CFO'], 'スタッフ': ['担当者']}
+
+    combinations = warm_store.dataset_combinations(app.current_data().df, positions)
+    titles = {params['position'] for params, _ in combinations}
+    assert titles == {'部長', 'CFO', '担当者'}
+    counts = [count for _, count in combinations]
+    assert counts == sorted(counts, reverse=True)
+
+    params = next(params for params, _ in combinations if params['position'] == '部長')
+    key, _ = app.generation_task('reference', **params)
+    assert key == app.generation_task('reference', **{**params, 'position': ' 部長 '})[0]
+    assert key != app.generation_task('reference', **{**params, 'position': 'CFO'})[0]
+
+
+def test_dataset_combinations_without_positions_use_categories(app_module):
+    combinations = warm_store.dataset_combinations(app_module.current_data().df)
+    assert {params['position'] for params, _ in combinations} == {'管理職', 'スタッフ'}
+
+
+def test_unique_combinations_keep_first_in_order(app_module):
+    app = app_module
+    base = {'industry': '医薬品', 'department': '営業', 'area': ''}
+    combinations = [({**base, 'position': 'CFO'}, 5), ({**base, 'position': '部長'}, 4), ({**base, 'position': ' cfo'}, 3)]
+    unique = warm_store.unique_combinations(combinations, lambda params: app.generation_cache_key('reference', **params))
+    assert [params['position'] for params, _ in unique] == ['CFO', '部長']
@@ -0,0 +1,330 @@
+"""よく使われる条件の生成結果を事前に作っておく読み取り専用ストア
+
+データにある 業界 × 部門 × ポジション区分 の組み合わせ（または過去の入力の一覧）を
+件数の多い順に上位N件選び、オフラインで生成した結果を SQLite ファイルに書き出す。
+キーは生成結果のキャッシュ（llm_cache.py）と同じ generation_cache_key() なので、
+リクエストでは OpenAI もキャッシュも通さずにそのまま返せる。
+キーにはポジションの表記（正規化したもの）が入るため、データの区分名（管理職/スタッフ）の
+まま作ったストアは「部長」などの入力には当たらない。実際に入力される肩書きは --positions で
+指定するか、過去の入力（--from）から作る。
+
+ストアはモデル名・プロンプトのバージョン・プロンプトの内容（ハッシュ）と結び付けて作る。
+どれかが変わったストアは古いものとして使わない（作り直すまでは通常どおり生成する）。
+ファイルは一時ファイルに書いてから置き換えるので、稼働中のサーバーも次の確認
+（check_interval 秒ごと）で新しいファイルを開き直す。
+
+    python warm_store.py --top 200                        # データの組み合わせ上位200件
+    python warm_store.py --positions 部長 マネージャー 担当者 # 区分の代わりに肩書きごとに作る
+    python warm_store.py --from inputs.jsonl --top 500    # 過去の入力（CSV/JSONL）の上位500件
+    python warm_store.py --kinds reference similar random # 比較画面のパターンも作る
+    python warm_store.py --check                          # ストアが今のプロンプト・モデルと一致するか確認
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATH = os.path.join(BASE_DIR, 'data', 'warm_store.sqlite3')
+
+# 形式を変えたら上げる（古いストアは自動的に無視される）
+STORE_FORMAT = '1'
+
+# ストアの有効性を判定するメタデータの項目
+VERSION_FIELDS = ('model', 'prompt_version', 'prompt_sha256')
+
+
+class WarmStore:
+    """事前生成した結果の読み取り専用ストア（スレッドごとに読み取り専用で接続する）"""
+
+    def __init__(self, path=None, check_interval=30.0):
+        self.path = path  # Noneまたは空文字なら使わない
+        self.check_interval = check_interval
+        self.expected = None
+        self.meta = None
+        self._signature = None  # 開いているファイルの (inode, 更新日時, サイズ)
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {'hits': 0, 'misses': 0, 'errors': 0, 'reopens': 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            path=os.getenv('WARM_STORE_PATH', DEFAULT_PATH),
+            check_interval=float(os.getenv('WARM_STORE_CHECK_SEC', 30)),
+        )
+
+    @property
+    def enabled(self):
+        return self.meta is not None
+
+    def open(self, expected):
+        """モデル・プロンプトが expected と一致すれば使えるようにする（fork前に呼んでもよい）"""
+        self.expected = expected
+        self._refresh(force=True)
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _refresh(self, force=False):
+        """ファイルが置き換わっていれば開き直す"""
+        now = time.monotonic()
+        if not self.path or self.expected is None or (not force and now < self._next_check):
+            return
+        with self._lock:
+            if not force and now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            signature = self._file_signature()
+            if signature == self._signature and not force:
+                return
+            self._signature = signature
+            self.meta = None
+            if signature is None:
+                return
+            try:
+                meta = read_meta(self.path)
+            except sqlite3.Error as e:
+                print(f"WARNING: 事前生成ストアを読み込めません: {e}", flush=True)
+                return
+            stale = [field for field in VERSION_FIELDS if meta.get(field) != self.expected.get(field)]
+            if meta.get('format') != STORE_FORMAT:
+                stale.append('format')
+            if stale:
+                print(f"WARNING: 事前生成ストアが古いため使用しません（{', '.join(stale)} が不一致）", flush=True)
+                return
+            self.meta = meta
+            if not force:
+                self._counters['reopens'] += 1
+            print(f"INFO: 事前生成ストアを読み込み ({meta.get('entries')}件)", flush=True)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.signature != self._signature:
+            if conn is not None:
+                conn.close()
+            # 書き換えないファイルなので、ロックもジャーナルも使わずに読む
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro&immutable=1", uri=True)
+            conn.execute('PRAGMA mmap_size=268435456')
+            self._local.conn = conn
+            self._local.signature = self._signature
+        return conn
+
+    def get(self, key):
+        """事前生成した結果（なければNone）"""
+        self._refresh()
+        if not self.enabled:
+            return None
+        try:
+            row = self._connection().execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"[WARM] 読み込みエラー: {e}", flush=True)
+            self._count('errors')
+            return None
+        if row is None:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return json.loads(row[0])
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['enabled'] = int(self.enabled)
+        stats['entries'] = int(self.meta.get('entries', 0)) if self.meta else 0
+        return stats
+
+
+def read_meta(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return dict(conn.execute('SELECT name, value FROM meta').fetchall())
+    finally:
+        conn.close()
+
+
+def write_store(path, entries, meta):
+    """(キー, 種類, 入力dict, 値) のリストからストアを作り、元のファイルと置き換える"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute(
+            'CREATE TABLE entries ('
+            ' key TEXT PRIMARY KEY,'
+            ' kind TEXT NOT NULL,'
+            ' input TEXT NOT NULL,'
+            ' value TEXT NOT NULL) WITHOUT ROWID'
+        )
+        conn.execute('CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        conn.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', [
+            (key, kind, json.dumps(params, ensure_ascii=False), json.dumps(value, ensure_ascii=False))
+            for key, kind, params, value in entries
+        ])
+        meta = {**meta, 'format': STORE_FORMAT, 'entries': len(entries), 'created_at': round(time.time(), 3)}
+        conn.executemany('INSERT INTO meta VALUES (?, ?)', [(name, str(value)) for name, value in meta.items()])
+        conn.commit()
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+
+
+def dataset_combinations(df, positions=None):
+    """データの 業界 × 部門 × ポジション区分 を件数の多い順に返す
+
+    positions（区分 → 肩書きのリスト）を渡すと、区分の代わりにその区分の肩書きごとに展開する。
+    指定のない区分はデータの区分名のまま。
+    """
+    counts = df.groupby(['業界', '部門', 'ポジション'], observed=True).size().sort_values(ascending=False, kind='stable')
+    positions = positions or {}
+    return [
+        ({'position': title, 'industry': industry, 'department': department, 'area': ''}, int(count))
+        for (industry, department, position), count in counts.items() if count > 0
+        for title in positions.get(position, [position])
+    ]
+
+
+def group_positions(titles, category_of):
+    """肩書きをポジション区分ごとにまとめる（区分を推測できないものは除く）"""
+    groups = {}
+    for title in titles:
+        category = category_of(title)
+        if not category:
+            print(f"[WARM] ポジション区分を推測できないため除外: {title}", flush=True)
+            continue
+        groups.setdefault(category, []).append(title)
+    return groups
+
+
+def unique_combinations(combinations, key_of):
+    """同じキーになる組み合わせは最初の1件だけ残す（順序は変えない）"""
+    seen = set()
+    unique = []
+    for params, count in combinations:
+        key = key_of(params)
+        if key not in seen:
+            seen.add(key)
+            unique.append((params, count))
+    return unique
+
+
+def input_combinations(rows, key_of):
+    """入力の一覧（過去のリクエスト・一括生成ジョブの入力）を、同じキーになるものをまとめて件数の多い順に返す"""
+    counts = Counter()
+    first = {}
+    for row in rows:
+        key = key_of(row)
+        counts[key] += 1
+        first.setdefault(key, row)
+    return [(first[key], count) for key, count in counts.most_common()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='よく使われる条件の生成結果を事前に作る')
+    parser.add_argument('--output', default=os.getenv('WARM_STORE_PATH') or DEFAULT_PATH)
+    parser.add_argument('--top', type=int, default=200, help='生成する組み合わせの数')
+    parser.add_argument('--from', dest='source', help='過去の入力（CSV/JSONL、一括生成ジョブと同じ形式）')
+    parser.add_argument('--positions', nargs='+',
+                        help='データの組み合わせを、区分（管理職/スタッフ）の代わりにこの肩書きごとに作る')
+    parser.add_argument('--kinds', nargs='+', choices=('reference', 'similar', 'random'), default=['reference'],
+                        help='reference: /api/search・/api/generate、similar/random: 比較画面のパターン')
+    parser.add_argument('--workers', type=int, default=4, help='同時に生成する数')
+    parser.add_argument('--rpm', type=int, help='1分あたりのOpenAI呼び出し上限（省略時は LLM_RPM）')
+    parser.add_argument('--tpm', type=int, help='1分あたりのトークン上限（省略時は LLM_TPM）')
+    parser.add_argument('--check', action='store_true', help='ストアが今のモデル・プロンプトと一致するか確認のみ行う')
+    args = parser.parse_args(argv)
+
+    # 流量制限は app の読み込み時に環境変数から作られる
+    if args.rpm:
+        os.environ['LLM_RPM'] = str(args.rpm)
+    if args.tpm:
+        os.environ['LLM_TPM'] = str(args.tpm)
+    os.environ['WARM_STORE_PATH'] = ''  # 作成中は既存のストアから返さない
+    import app
+
+    expected = app.warm_store_version()
+    if args.check:
+        try:
+            meta = read_meta(args.output)
+        except sqlite3.Error as e:
+            print(f"ストアを読み込めません: {e}")
+            return 1
+        stale = [field for field in VERSION_FIELDS if meta.get(field) != expected[field]]
+        if stale or meta.get('format') != STORE_FORMAT:
+            print(f"ストアが古くなっています（{', '.join(stale) or 'format'} が不一致）")
+            return 1
+        print(f"ストアは最新です（{meta.get('entries')}件、作成 {time.ctime(float(meta['created_at']))}）")
+        return 0
+
+    app.load_data()
+    app.client = app.create_client()
+
+    if args.source:
+        from batch_jobs import parse_rows
+        with open(args.source, 'rb') as f:
+            rows = parse_rows(f.read(), args.source)
+        combinations = input_combinations(rows, lambda row: app.generation_cache_key('reference', **row))
+    else:
+        positions = group_positions(args.positions, app.infer_position_category) if args.positions else None
+        # 表記だけが違う肩書き（「CFO」と「cfo」など）は同じキーなので1件にまとめる
+        combinations = unique_combinations(
+            dataset_combinations(app.current_data().df, positions),
+            lambda params: app.generation_cache_key('reference', **params))
+    combinations = combinations[:args.top]
+
+    tasks = [(kind, params) for params, _ in combinations for kind in args.kinds]
+    print(f"{len(combinations)}件の組み合わせ × {len(args.kinds)}種類 = {len(tasks)}件を生成します", flush=True)
+
+    def run(kind, params):
+        key, compute = app.generation_task(kind, **params)
+        return key, compute()
+
+    entries = []
+    failed = 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(run, kind, params): (kind, params) for kind, params in tasks}
+        for done, future in enumerate(as_completed(futures), 1):
+            kind, params = futures[future]
+            try:
+                key, value = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[WARM] 失敗 {kind} {params}: {e}", flush=True)
+                continue
+            if not app.is_complete(value):
+                # 制限時間で打ち切った結果は書き出さない（次の実行で作り直す）
+                failed += 1
+                print(f"[WARM] 不完全 {kind} {params}: 目標件数に届かなかったため書き出しません", flush=True)
+                continue
+            entries.append((key, kind, params, value))
+            if done % 10 == 0 or done == len(tasks):
+                print(f"[WARM] {done}/{len(tasks)}（{time.monotonic() - started:.0f}秒）", flush=True)
+
+    if not entries:
+        print("生成できた結果がないため、ストアを書き出しません")
+        return 1
+    write_store(args.output, entries, {**expected, 'source': args.source or 'dataset'})
+    print(f"ストアを作成しました: {args.output}（{len(entries)}件、失敗 {failed}件）")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,20 @@
+"""本番用のエントリポイント（gunicorn -c gunicorn.conf.py wsgi:app）
+
+gunicorn.conf.py の preload_app により、このモジュールはfork前のマスタープロセスで
+1回だけ読み込まれる。ここでデータとインデックスを作っておけば、各ワーカーは
+コピーオンライトで同じメモリを共有する（ワーカーごとに読み込み直さない）。
+
+OpenAIクライアント（HTTP接続プール）と一括生成ジョブのスレッドはforkをまたげないため、
+ワーカーの起動後に gunicorn.conf.py の post_worker_init で作る。
+"""
+import gc
+
+from app import app, load_data
+
+load_data()
+
+# 読み込んだオブジェクトをGCの対象から外す。fork後にGCが参照カウント以外の
+# ヘッダーを書き換えて共有ページがコピーされるのを防ぐ
+gc.freeze()
+
+__all__ = ['app']